@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import numpy as np
+import pendulum
+import typer
+
+from trade_strat_framework.analyze import Analyze
+from trade_strat_framework.backtest import Backtest
+from trade_strat_framework.state import TickerState
+from trade_strat_framework.trade import Trade
+
+from .fakes import FakeAsyncClient, FakeClient, RecordingConn, fake_history, fake_tickers
+
+# Create typer app
+app = typer.Typer()
+
+ALL_ANALYSES = 'sma ema rsi macd bollinger'
+
+# Benchmarks, by name: function(tickers, repeat, options) -> list of
+# seconds per repetition
+BENCHMARKS = {}
+
+
+def benchmark(name):
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return(func)
+
+    return(decorator)
+
+
+class SimClock:
+    """ A UTC epoch clock that only moves when stepped. """
+
+    def __init__(self, start=None):
+        self.now = pendulum.now('UTC').int_timestamp if start is None else start
+
+    def __call__(self):
+        return(self.now)
+
+    def step(self, seconds):
+        self.now += seconds
+
+
+def _timed(func, *args):
+
+    start = time.perf_counter()
+    func(*args)
+
+    return(time.perf_counter() - start)
+
+
+def _trader(client, conn, options, **kwargs):
+
+    # No pacing (the fake client isn't rate limited, and pacing would
+    # dominate the timings at the larger sizes)
+    return(
+        Trade(
+            client,
+            conn,
+            rate_limit=options['rate_limit'],
+            metrics_interval=0,
+            interactive=True,
+            **kwargs,
+            )
+        )
+
+
+def _store_quotes(tickers, repeat, options, method='store_quotes', client_type=FakeClient, **kwargs):
+
+    # One full cycle (fetch, transform, insert) per repetition, on a new
+    # Trade each time. The metrics summary printed on exit is discarded
+    timings = []
+    for _ in range(repeat):
+        client = client_type(latency_sec=options['latency_sec'], per_symbol_sec=options['per_symbol_sec'])
+        trader = _trader(client, RecordingConn(insert_latency_sec=options['insert_latency_sec']), options, **kwargs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            timings.append(_timed(getattr(trader, method), tickers))
+
+    return(timings)
+
+
+@benchmark('store_quotes')
+def bench_store_quotes(tickers, repeat, options):
+    # Inserting in the loop (`Trade` writes behind by default)
+    return(_store_quotes(tickers, repeat, options, write_behind=False))
+
+
+@benchmark('store_quotes_write_behind')
+def bench_store_quotes_write_behind(tickers, repeat, options):
+    return(_store_quotes(tickers, repeat, options, write_behind=True))
+
+
+@benchmark('store_quotes_async')
+def bench_store_quotes_async(tickers, repeat, options):
+    return(_store_quotes(tickers, repeat, options, method='store_quotes_async', client_type=FakeAsyncClient))
+
+
+@benchmark('store_quotes_paper')
+def bench_store_quotes_paper(tickers, repeat, options):
+    return(_store_quotes(tickers, repeat, options, paper=True, analysis_types=ALL_ANALYSES))
+
+
+@benchmark('transform')
+def bench_transform(tickers, repeat, options):
+
+    # `_build_rows` on a fresh response each cycle, one period apart (after
+    # a first read, so time corrections and candles are computed)
+    clock = SimClock()
+    client = FakeClient(clock=clock)
+    trader = _trader(client, RecordingConn(), options)
+    tickerList = TickerState()
+    periodSec = trader.period_minutes*60
+
+    trader._build_rows(client.get_quotes(tickers).json(), tickerList, pendulum.from_timestamp(clock.now, 'America/New_York'), True)
+
+    timings = []
+    for _ in range(repeat):
+        clock.step(periodSec)
+        quoteDict = client.get_quotes(tickers).json()
+        readDt = pendulum.from_timestamp(clock.now, 'America/New_York')
+        timings.append(_timed(trader._build_rows, quoteDict, tickerList, readDt, False))
+
+    return(timings)
+
+
+@benchmark('analysis_dispatch')
+def bench_analysis_dispatch(tickers, repeat, options):
+
+    # One new price per ticker through every analysis (`signal_batch`, as
+    # in the paper trading loop), after warming each ticker
+    history = fake_history(tickers, 100)
+    analyzer = Analyze(None, None, analysis_types=ALL_ANALYSES)
+    for idx, ticker in enumerate(tickers):
+        analyzer.warm(ticker, history.price[:-1, idx][~np.isnan(history.price[:-1, idx])])
+
+    rng = np.random.default_rng(0)
+    prices = np.nan_to_num(history.price[-1], nan=100.0)
+
+    timings = []
+    for _ in range(repeat):
+        prices = prices*(1 + rng.normal(0, 0.002, size=len(prices)))
+        timings.append(_timed(analyzer.signal_batch, tickers, prices))
+
+    return(timings)
+
+
+@benchmark('analysis_matrices')
+def bench_analysis_matrices(tickers, repeat, options):
+
+    history = fake_history(tickers, options['periods'])
+    analyzer = Analyze(None, None, analysis_types=ALL_ANALYSES)
+
+    return([_timed(analyzer.analysis_matrices, history.price) for _ in range(repeat)])
+
+
+@benchmark('backtest')
+def bench_backtest(tickers, repeat, options):
+
+    history = fake_history(tickers, options['periods'])
+    backtest = Backtest(Analyze(None, None, analysis_types=ALL_ANALYSES), slippage_bps=1, commission=1)
+
+    return([_timed(backtest.run, history) for _ in range(repeat)])
+
+
+def _meta():
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return(
+        {
+            'date': pendulum.now('UTC').to_iso8601_string(),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            }
+        )
+
+
+def run_benchmarks(names, sizes, repeat, options, progress=None):
+    """
+    Run each benchmark in `names` at each ticker count in `sizes`.
+
+    Returns
+    -------
+    dict
+        'meta' (machine, versions, commit and the options) and 'results':
+        one dict per (benchmark, tickers) with the repetition timings and
+        their min, median and median microseconds per ticker.
+
+    """
+
+    results = []
+    for name in names:
+        for size in sizes:
+            timings = BENCHMARKS[name](fake_tickers(size), repeat, options)
+            median = statistics.median(timings)
+            results.append(
+                {
+                    'benchmark': name,
+                    'tickers': size,
+                    'repeat': repeat,
+                    'min_sec': min(timings),
+                    'median_sec': median,
+                    'us_per_ticker': median/size*1e6,
+                    'timings_sec': timings,
+                    }
+                )
+            if progress is not None:
+                progress(results[-1])
+
+    return({'meta': dict(_meta(), options=options), 'results': results})
+
+
+def compare(results, baseline, threshold=1.25):
+    """
+    Compare the median timings with a baseline (matched on benchmark and
+    ticker count).
+
+    Returns
+    -------
+    list
+        (benchmark, tickers, baseline median sec, median sec, ratio,
+        regressed) for each result in the baseline; `regressed` when the
+        ratio is over `threshold`.
+
+    """
+
+    baselineDict = {(x['benchmark'], x['tickers']): x for x in baseline['results']}
+
+    comparison = []
+    for result in results['results']:
+        base = baselineDict.get((result['benchmark'], result['tickers']))
+        if base is None:
+            continue
+        ratio = result['median_sec']/max([base['median_sec'], 1e-12])
+        comparison.append(
+            (result['benchmark'], result['tickers'], base['median_sec'], result['median_sec'], ratio, ratio > threshold)
+            )
+
+    return(comparison)
+
+
+def _format_result(result):
+    return(
+        '{:<28} {:>6} tickers  median {:>10.3f} ms  min {:>10.3f} ms  {:>8.2f} us/ticker'.format(
+            result['benchmark'], result['tickers'], result['median_sec']*1e3, result['min_sec']*1e3, result['us_per_ticker'],
+            )
+        )
+
+
+@app.command()
+def main(
+        sizes: str = typer.Option(
+            '10 100 1000 5000', '--sizes',
+            help="The ticker counts to benchmark",
+            ),
+        only: Optional[str] = typer.Option(
+            None, '--only',
+            help="The benchmarks to run (default all: {})".format(', '.join(BENCHMARKS)),
+            ),
+        repeat: int = typer.Option(
+            5, '--repeat',
+            help="Repetitions of each benchmark (the median is reported)",
+            ),
+        periods: int = typer.Option(
+            520, '--periods',
+            help="History length of the analysis and backtest benchmarks (520 is 20 days of 15-minute periods)",
+            ),
+        latency_ms: float = typer.Option(
+            0.0, '--latency-ms',
+            help="Fake get_quotes latency per request",
+            ),
+        per_symbol_us: float = typer.Option(
+            0.0, '--per-symbol-us',
+            help="Fake get_quotes latency per symbol",
+            ),
+        insert_latency_ms: float = typer.Option(
+            0.0, '--insert-latency-ms',
+            help="Fake database latency per insert",
+            ),
+        rate_limit: float = typer.Option(
+            1e9, '--rate-limit',
+            help="get_quotes requests per minute (unpaced by default)",
+            ),
+        output: str = typer.Option(
+            'bench_results.json', '--output', '-o',
+            help="Where to write the results (JSON)",
+            ),
+        baseline: Optional[str] = typer.Option(
+            None, '--baseline', '-b',
+            help="Results (JSON) to compare with; exits with 1 if any benchmark regressed",
+            ),
+        threshold: float = typer.Option(
+            1.25, '--threshold',
+            help="The median time ratio (vs the baseline) counted as a regression",
+            ),
+        ):
+    """
+    Benchmark the quote loop, row transformation, analysis dispatch and
+    backtests against a fake TDA client and a recording database
+    connection (no credentials or database needed).
+
+    """
+
+    names = list(BENCHMARKS) if only is None else only.replace(',', ' ').split()
+    unknown = [x for x in names if x not in BENCHMARKS]
+    if unknown:
+        raise typer.BadParameter(
+            "Unknown benchmark(s) '{}' - the available benchmarks are '{}'".format(
+                "', '".join(unknown), "', '".join(BENCHMARKS),
+                )
+            )
+
+    options = {
+        'periods': periods,
+        'latency_sec': latency_ms/1e3,
+        'per_symbol_sec': per_symbol_us/1e6,
+        'insert_latency_sec': insert_latency_ms/1e3,
+        'rate_limit': rate_limit,
+        }
+
+    results = run_benchmarks(
+        names,
+        [int(x) for x in sizes.replace(',', ' ').split()],
+        repeat,
+        options,
+        progress=lambda x: print(_format_result(x), flush=True),
+        )
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to {}'.format(output))
+
+    if baseline is not None:
+        with open(baseline) as f:
+            comparison = compare(results, json.load(f), threshold)
+        print('\nCompared with {} (regression over {:.2f}x):'.format(baseline, threshold))
+        for name, size, baseSec, sec, ratio, regressed in comparison:
+            print(
+                '{:<28} {:>6} tickers  {:>10.3f} -> {:>10.3f} ms  {:>6.2f}x{}'.format(
+                    name, size, baseSec*1e3, sec*1e3, ratio, '  REGRESSION' if regressed else '',
+                    )
+                )
+        if any(x[-1] for x in comparison):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import string
+import time
+
+import numpy as np
+
+from trade_strat_framework.history import QuoteHistory
+
+
+def fake_tickers(n):
+    """
+    `n` distinct ticker-like symbols ('A', 'B', ..., 'AA', 'AB', ...), in a
+    fixed order.
+
+    """
+
+    tickers = []
+    idx = 0
+    while len(tickers) < n:
+        symbol = ''
+        value = idx
+        while True:
+            symbol = string.ascii_uppercase[value % 26] + symbol
+            value = value//26 - 1
+            if value < 0:
+                break
+        tickers.append(symbol)
+        idx += 1
+
+    return(tickers)
+
+
+class FakeResponse:
+    """ The parts of an httpx response that `Trade` reads. """
+
+    def __init__(self, status_code, data=None, headers=None):
+
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data
+
+    def json(self):
+        return(self._data)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError('HTTP {}'.format(self.status_code))
+
+
+class FakeClient:
+    """ Stand-in for `tda.client.Client` serving generated `get_quotes` JSON.
+
+    Each symbol follows its own seeded random walk, and every call returns
+    the full TDA equity quote (the fields `Trade` stores plus the rest of
+    the payload, so parsing costs are realistic). Quote times are the
+    (fake) clock, less a small per-symbol delay.
+
+    Parameters
+    ----------
+    latency_sec : float
+        Fixed delay of each request.
+    per_symbol_sec : float
+        Extra delay per symbol in the request.
+    jitter_sec : float
+        Uniform random extra delay (0 to `jitter_sec`).
+    throttle_rate : float
+        Fraction of requests answered with a 429 (with a Retry-After of
+        `retry_after_sec`).
+    stale_fraction : float
+        Fraction of symbols (chosen at their first quote) that never trade
+        again, so their quote time stays the same (halted or illiquid).
+    clock : callable
+        Returns the current UTC epoch seconds (e.g. to step simulated time
+        by a period per cycle).
+    seed : int
+
+    """
+
+    def __init__(
+            self,
+            latency_sec=0.0,
+            per_symbol_sec=0.0,
+            jitter_sec=0.0,
+            throttle_rate=0.0,
+            retry_after_sec=0,
+            stale_fraction=0.0,
+            clock=time.time,
+            seed=0,
+            ):
+
+        self.latency_sec = latency_sec
+        self.per_symbol_sec = per_symbol_sec
+        self.jitter_sec = jitter_sec
+        self.throttle_rate = throttle_rate
+        self.retry_after_sec = retry_after_sec
+        self.stale_fraction = stale_fraction
+        self.clock = clock
+
+        self._rng = np.random.default_rng(seed)
+        self._state = {}    # symbol: [last price, total volume, quote delay ms, stale quote time ms]
+        self.requests = 0
+        self.status_codes = collections.Counter()
+
+    def _delay(self, symbols):
+
+        jitter = self._rng.uniform(0, self.jitter_sec) if self.jitter_sec else 0.0
+        return(self.latency_sec + self.per_symbol_sec*len(symbols) + jitter)
+
+    def _quote(self, symbol, nowMs):
+
+        if symbol not in self._state:
+            self._state[symbol] = [
+                float(self._rng.uniform(5, 500)),
+                int(self._rng.integers(1e4, 1e6)),
+                int(self._rng.integers(0, 3000)),
+                nowMs if self._rng.random() < self.stale_fraction else None,
+                ]
+        state = self._state[symbol]
+        if state[3] is None:
+            state[0] = max([0.01, round(state[0]*(1 + self._rng.normal(0, 0.002)), 2)])
+            state[1] += int(self._rng.integers(0, 5000))
+        last = state[0]
+        spread = max([0.01, round(last*0.0005, 2)])
+        quoteMs = nowMs - state[2] if state[3] is None else state[3]
+
+        return(
+            {
+                'assetType': 'EQUITY',
+                'assetMainType': 'EQUITY',
+                'cusip': '000000000',
+                'symbol': symbol,
+                'description': '{} Common Stock'.format(symbol),
+                'bidPrice': round(last - spread/2, 2),
+                'bidSize': 100*int(self._rng.integers(1, 50)),
+                'bidId': 'P',
+                'askPrice': round(last + spread/2, 2),
+                'askSize': 100*int(self._rng.integers(1, 50)),
+                'askId': 'Q',
+                'lastPrice': last,
+                'lastSize': 100,
+                'lastId': 'D',
+                'openPrice': last,
+                'highPrice': last,
+                'lowPrice': last,
+                'bidTick': ' ',
+                'closePrice': last,
+                'netChange': 0.0,
+                'totalVolume': state[1],
+                'quoteTimeInLong': quoteMs,
+                'tradeTimeInLong': quoteMs,
+                'mark': last,
+                'exchange': 'q',
+                'exchangeName': 'NASD',
+                'marginable': True,
+                'shortable': True,
+                'volatility': 0.0123,
+                'digits': 4,
+                '52WkHigh': round(last*1.3, 2),
+                '52WkLow': round(last*0.7, 2),
+                'nAV': 0.0,
+                'peRatio': 21.5,
+                'divAmount': 0.0,
+                'divYield': 0.0,
+                'divDate': '',
+                'securityStatus': 'Normal',
+                'regularMarketLastPrice': last,
+                'regularMarketLastSize': 1,
+                'regularMarketNetChange': 0.0,
+                'regularMarketTradeTimeInLong': quoteMs,
+                'netPercentChangeInDouble': 0.0,
+                'markChangeInDouble': 0.0,
+                'markPercentChangeInDouble': 0.0,
+                'regularMarketPercentChangeInDouble': 0.0,
+                'delayed': False,
+                'realtimeEntitled': True,
+                }
+            )
+
+    def _respond(self, symbols):
+
+        self.requests += 1
+        if self.throttle_rate and self._rng.random() < self.throttle_rate:
+            response = FakeResponse(429, headers={'Retry-After': str(self.retry_after_sec)})
+        else:
+            nowMs = int(self.clock()*1000)
+            response = FakeResponse(200, {x: self._quote(x, nowMs) for x in symbols})
+        self.status_codes[response.status_code] += 1
+
+        return(response)
+
+    def get_quotes(self, symbols):
+
+        symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        delay = self._delay(symbols)
+        if delay > 0:
+            time.sleep(delay)
+
+        return(self._respond(symbols))
+
+
+class FakeAsyncClient(FakeClient):
+    """ Stand-in for `tda.client.AsyncClient` (see `FakeClient`). """
+
+    async def get_quotes(self, symbols):
+
+        symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+        delay = self._delay(symbols)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        return(self._respond(symbols))
+
+
+class RecordingConn:
+    """ Stand-in for `coftc_db_utils.Conn` that records instead of writing.
+
+    Inserts are counted per table (and kept in `inserts` if `keep_rows`),
+    optionally after `insert_latency_sec` to model the database round trip.
+    Queries are recorded and answered from `query_results` (a list of
+    (SQL substring, rows), first match wins), else with no rows.
+
+    """
+
+    def __init__(self, insert_latency_sec=0.0, keep_rows=False, query_results=None):
+
+        self.insert_latency_sec = insert_latency_sec
+        self.keep_rows = keep_rows
+        self.query_results = list(query_results or [])
+
+        self.rows = collections.Counter()           # table name: rows
+        self.insert_calls = collections.Counter()   # table name: calls
+        self.inserts = []                           # (table name, fields, values)
+        self.queries = []
+
+    def insert(self, table_name, fields, values, on_duplicate=None):
+
+        if self.insert_latency_sec:
+            time.sleep(self.insert_latency_sec)
+        self.rows[table_name] += len(values)
+        self.insert_calls[table_name] += 1
+        if self.keep_rows:
+            self.inserts.append((table_name, list(fields), list(values)))
+
+    def query(self, sql):
+
+        self.queries.append(sql)
+        for pattern, rows in self.query_results:
+            if pattern in sql:
+                return(rows)
+
+        return([])
+
+
+def fake_history(tickers, periods, period_minutes=15, start='2021-06-01T09:30', seed=0, missing_rate=0.01):
+    """
+    A `QuoteHistory` of seeded random walks for `tickers` over `periods`
+    consecutive periods, with a fraction `missing_rate` of quotes missing.
+
+    """
+
+    rng = np.random.default_rng(seed)
+    nTicker = len(tickers)
+    times = np.datetime64(start, 's') + np.arange(periods)*np.timedelta64(period_minutes*60, 's')
+
+    returns = rng.normal(0, 0.004, size=(periods, nTicker))
+    price = rng.uniform(5, 500, size=nTicker)*np.exp(np.cumsum(returns, axis=0))
+    price = np.round(price, 2)
+    spread = np.maximum(0.01, np.round(price*0.0005, 2))
+    volume = np.cumsum(rng.integers(0, 5000, size=(periods, nTicker)), axis=0).astype(np.float64)
+
+    missing = rng.random((periods, nTicker)) < missing_rate
+    price, ask, bid = [np.where(missing, np.nan, x) for x in [price, price + spread/2, price - spread/2]]
+    volume = np.where(missing, np.nan, volume)
+
+    return(QuoteHistory(tickers, times, price, ask, bid, volume))
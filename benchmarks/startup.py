@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import typer
+
+# Create typer app
+app = typer.Typer()
+
+# Cold-start commands, each run in a new interpreter
+COMMANDS = {
+    'import': ['-c', 'import trade_strat_framework'],
+    'help': ['-c', 'from trade_strat_framework import run_cli; run_cli()', '--help'],
+    'list_analyses': ['-c', 'from trade_strat_framework import run_cli; run_cli()', '--list-analyses'],
+    }
+
+# Median wall time budget of each command (seconds, including the
+# interpreter's own startup)
+BUDGETS = {
+    'import': 0.3,
+    'help': 0.5,
+    'list_analyses': 0.8,
+    }
+
+# Modules that must not be loaded by the commands that don't use them (the
+# broker, the database and the quote path)
+DEFERRED_MODULES = {
+    'import': [
+        'numpy', 'pendulum', 'requests', 'httpx', 'tda', 'selenium', 'coftc_cred_man', 'coftc_db_utils',
+        'trade_strat_framework.trade', 'trade_strat_framework.analyze',
+        ],
+    'help': [
+        'numpy', 'pendulum', 'requests', 'httpx', 'tda', 'selenium', 'coftc_cred_man', 'coftc_db_utils',
+        'trade_strat_framework.trade', 'trade_strat_framework.analyze',
+        ],
+    'list_analyses': [
+        'requests', 'httpx', 'tda', 'selenium', 'coftc_cred_man', 'coftc_db_utils', 'trade_strat_framework.trade',
+        ],
+    }
+
+# Prints the loaded modules (as JSON, to stderr) when the command exits
+_MODULE_PROBE = 'import atexit, json, sys; atexit.register(lambda: sys.stderr.write(json.dumps(sorted(sys.modules))))\n'
+
+
+def _run(args):
+
+    return(subprocess.run([sys.executable] + args, capture_output=True, text=True))
+
+
+def time_command(name, repeat=10):
+    """
+    Returns
+    -------
+    list
+        Wall seconds of each of `repeat` cold runs of `COMMANDS[name]`.
+
+    """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = _run(COMMANDS[name])
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError('{} failed ({}):\n{}'.format(name, result.returncode, result.stderr))
+
+    return(timings)
+
+
+def loaded_modules(name):
+
+    code, *argv = COMMANDS[name][1:]
+    result = _run(['-c', _MODULE_PROBE + code] + argv)
+
+    return(json.loads(result.stderr.strip().splitlines()[-1]))
+
+
+def slowest_imports(top=10):
+    """
+    Returns
+    -------
+    list
+        (module, cumulative microseconds) of the slowest imports made
+        directly by the top-level imports when importing the package (from
+        `python -X importtime`).
+
+    """
+
+    result = _run(['-X', 'importtime'] + COMMANDS['import'])
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        # Nested imports are indented by two spaces per level
+        if (len(module) - len(module.lstrip()) - 1)//2 != 1:
+            continue
+        imports.append((module.strip(), int(cumulative)))
+
+    return(sorted(imports, key=lambda x: -x[1])[:top])
+
+
+@app.command()
+def main(
+        repeat: int = typer.Option(
+            10, '--repeat',
+            help="Cold runs of each command (the median is compared with the budget)",
+            ),
+        output: str = typer.Option(
+            'startup_results.json', '--output', '-o',
+            help="Where to write the results (JSON)",
+            ),
+        ):
+    """
+    Measure the cold start of importing the package, `--help` and
+    `--list-analyses`, check them against `BUDGETS`, and check that none of
+    `DEFERRED_MODULES` was loaded. Exits with 1 if any check fails.
+
+    """
+
+    results = {'python': sys.version.split()[0], 'commands': {}, 'slowest_imports': slowest_imports()}
+    failed = False
+    for name in COMMANDS:
+        timings = time_command(name, repeat)
+        median = statistics.median(timings)
+        deferred = [x for x in DEFERRED_MODULES[name] if x in set(loaded_modules(name))]
+        overBudget = median > BUDGETS[name]
+        failed = failed or overBudget or bool(deferred)
+        results['commands'][name] = {
+            'median_sec': median,
+            'min_sec': min(timings),
+            'budget_sec': BUDGETS[name],
+            'loaded_deferred_modules': deferred,
+            }
+        print(
+            '{:<16} median {:>7.1f} ms  min {:>7.1f} ms  budget {:>5.0f} ms{}{}'.format(
+                name, median*1e3, min(timings)*1e3, BUDGETS[name]*1e3,
+                '  OVER BUDGET' if overBudget else '',
+                '  loaded {}'.format(', '.join(deferred)) if deferred else '',
+                )
+            )
+
+    print('Slowest imports: {}'.format(', '.join('{} {:.1f} ms'.format(x, us/1e3) for x, us in results['slowest_imports'])))
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gc
+import json
+import math
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pendulum
+import typer
+
+from trade_strat_framework.state import TickerState
+
+from .fakes import fake_tickers
+
+# Create typer app
+app = typer.Typer()
+
+PERIOD_SEC = 15*60
+MAX_IDLE_PERIODS = 4
+
+
+def _cycle_inputs(n, cycles, stale_fraction=0.1, seed=0):
+
+    # Per cycle: the read time, every ticker's quote time (a fixed fraction
+    # of tickers never changing) and delayed flag
+    rng = np.random.default_rng(seed)
+    startSec = 1622554200
+    stale = rng.random(n) < stale_fraction
+    delaySec = rng.integers(0, 3, size=n)
+    inputs = []
+    for cycle in range(cycles):
+        readSec = startSec + cycle*PERIOD_SEC
+        quoteSec = np.where(stale, startSec, readSec - delaySec).astype(np.int64)
+        inputs.append((float(readSec), quoteSec, np.zeros(n, dtype=bool)))
+
+    return(inputs)
+
+
+class DictState:
+    """ The per-ticker state as a dict of dicts (as `Trade` kept it before
+    `TickerState`): one dict per ticker holding the read time as a shared
+    `pendulum.DateTime`, and the rest as Python ints and bools. """
+
+    def __init__(self):
+        self.tickerList = {}
+        self.lastSec = {}
+
+    def cycle(self, symbols, readSec, quoteSec, delayed):
+
+        readDt = pendulum.from_timestamp(readSec, 'America/New_York')
+        tickerList = self.tickerList
+
+        # Unchanged quotes only record the read
+        unchanged = [key for key, sec in zip(symbols, quoteSec.tolist()) if self.lastSec.get(key) == sec]
+        for key in unchanged:
+            if key in tickerList:
+                tickerList[key] = dict(
+                    tickerList[key],
+                    read_dt_ny=readDt,
+                    time_correction_sec=0,
+                    unchanged=tickerList[key].get('unchanged', 0) + 1,
+                    )
+        unchangedSet = set(unchanged)
+        keep = np.fromiter((x not in unchangedSet for x in symbols), dtype=bool, count=len(symbols))
+        changed = [x for x, k in zip(symbols, keep.tolist()) if k]
+        quoteSec, delayed = quoteSec[keep], delayed[keep]
+        self.lastSec.update(zip(changed, quoteSec.tolist()))
+
+        prevSec = np.fromiter(
+            (
+                tickerList[key]['quote_sec'] if key in tickerList and not tickerList[key].get('unchanged') else -1
+                for key in changed
+                ),
+            dtype=np.int64,
+            count=len(changed),
+            )
+        timeCorrection = np.where(prevSec >= 0, quoteSec - (prevSec + PERIOD_SEC), 0).tolist()
+        for key, sec, correction, delay in zip(changed, quoteSec.tolist(), timeCorrection, delayed.tolist()):
+            tickerList[key] = {
+                'read_dt_ny': readDt,
+                'quote_sec': sec,
+                'time_correction_sec': correction,
+                'delayed': delay,
+                'unchanged': 0,
+                }
+
+        # Next deadlines
+        deadlines = []
+        for key in symbols:
+            unchangedCount = tickerList[key].get('unchanged', 0) if key in tickerList else 0
+            periods = max([1, min([MAX_IDLE_PERIODS, 2**min([unchangedCount, 30])])])
+            deadlines.append(readSec + periods*PERIOD_SEC - math.floor(tickerList[key]['time_correction_sec']/2))
+
+        return(deadlines)
+
+
+class ArrayState:
+    """ The per-ticker state as a `TickerState` (as `Trade` keeps it). """
+
+    def __init__(self):
+        self.tickerList = TickerState()
+        self.lastSec = {}
+
+    def cycle(self, symbols, readSec, quoteSec, delayed):
+
+        tickerList = self.tickerList
+
+        unchanged = [key for key, sec in zip(symbols, quoteSec.tolist()) if self.lastSec.get(key) == sec]
+        rows = tickerList.rows(unchanged)
+        rows = rows[rows >= 0]
+        tickerList.update(rows, read_sec=readSec, time_correction_sec=0, unchanged=tickerList['unchanged'][rows] + 1)
+        unchangedSet = set(unchanged)
+        keep = np.fromiter((x not in unchangedSet for x in symbols), dtype=bool, count=len(symbols))
+        changed = [x for x, k in zip(symbols, keep.tolist()) if k]
+        quoteSec, delayed = quoteSec[keep], delayed[keep]
+        self.lastSec.update(zip(changed, quoteSec.tolist()))
+
+        rows = tickerList.add_tickers(changed)
+        prevSec = np.where(tickerList['unchanged'][rows] == 0, tickerList['quote_sec'][rows], -1)
+        timeCorrection = np.where(prevSec >= 0, quoteSec - (prevSec + PERIOD_SEC), 0)
+        tickerList.update(
+            rows, read_sec=readSec, quote_sec=quoteSec, time_correction_sec=timeCorrection, delayed=delayed, unchanged=0,
+            )
+
+        # Next deadlines
+        rows = tickerList.add_tickers(symbols)
+        periods = np.clip(np.left_shift(1, np.minimum(tickerList['unchanged'][rows], 30).astype(np.int64)), 1, MAX_IDLE_PERIODS)
+        deadlines = readSec + periods*PERIOD_SEC - np.floor_divide(tickerList['time_correction_sec'][rows], 2)
+
+        return(deadlines.tolist())
+
+
+LAYOUTS = {'dicts': DictState, 'array': ArrayState}
+
+
+def measure(layout, n, cycles=10):
+    """
+    Returns
+    -------
+    dict
+        'bytes_per_ticker' (Python heap allocated by the state after
+        `cycles` cycles, per ticker) and the median and minimum seconds of
+        a cycle (after the first, which adds the tickers).
+
+    """
+
+    symbols = fake_tickers(n)
+    inputs = _cycle_inputs(n, cycles)
+
+    gc.collect()
+    tracemalloc.start()
+    state = LAYOUTS[layout]()
+    state.cycle(symbols, *inputs[0])
+    for cycleInputs in inputs[1:]:
+        state.cycle(symbols, *cycleInputs)
+    gc.collect()
+    stateBytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # lastSec (the dedup index) is the same in both layouts
+    lastSecBytes = sys.getsizeof(state.lastSec) + sum(sys.getsizeof(x) for x in state.lastSec.values())
+
+    timings = []
+    state = LAYOUTS[layout]()
+    state.cycle(symbols, *inputs[0])
+    for cycleInputs in inputs[1:]:
+        start = time.perf_counter()
+        state.cycle(symbols, *cycleInputs)
+        timings.append(time.perf_counter() - start)
+
+    return(
+        {
+            'bytes_per_ticker': (stateBytes - lastSecBytes)/n,
+            'median_cycle_sec': statistics.median(timings),
+            'min_cycle_sec': min(timings),
+            }
+        )
+
+
+@app.command()
+def main(
+        sizes: str = typer.Option(
+            '100,1000,5000,20000', '--sizes',
+            help="Comma-separated ticker counts",
+            ),
+        cycles: int = typer.Option(
+            10, '--cycles',
+            help="Cycles per measurement (10% of tickers never change, so they back off)",
+            ),
+        output: str = typer.Option(
+            'state_results.json', '--output', '-o',
+            help="Where to write the results (JSON)",
+            ),
+        ):
+    """
+    Compare the memory per ticker and the per-cycle update time (dedup
+    bookkeeping, time corrections, state update and next deadlines) of the
+    quote loop's per-ticker state as a dict of dicts and as a `TickerState`.
+
+    """
+
+    results = {'python': sys.version.split()[0], 'numpy': np.__version__, 'sizes': {}}
+    for n in [int(x) for x in sizes.split(',')]:
+        results['sizes'][n] = {layout: measure(layout, n, cycles) for layout in LAYOUTS}
+        dicts, array = results['sizes'][n]['dicts'], results['sizes'][n]['array']
+        print(
+            '{:>6} tickers  memory {:>6.0f} -> {:>4.0f} B/ticker  cycle {:>8.2f} -> {:>7.2f} ms ({:.1f}x)'.format(
+                n,
+                dicts['bytes_per_ticker'], array['bytes_per_ticker'],
+                dicts['median_cycle_sec']*1e3, array['median_cycle_sec']*1e3,
+                dicts['median_cycle_sec']/array['median_cycle_sec'],
+                )
+            )
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    app()
@@ -3,5 +3,11 @@ USE `algo_trading`;
 CREATE TABLE `analysis` (
   `id` bigint(20) NOT NULL AUTO_INCREMENT,
   `quotes_id` bigint(20) NOT NULL,
-  PRIMARY KEY (`id`)
-) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=latin1;
+  `datetime_newyork` datetime NOT NULL,
+  PRIMARY KEY (`id`,`datetime_newyork`)
+) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=latin1
+/* One partition per New York date, added ahead and dropped after the
+   retention period by `partitions.PartitionMaintenance` */
+PARTITION BY RANGE (TO_DAYS(`datetime_newyork`)) (
+  PARTITION `pmax` VALUES LESS THAN MAXVALUE
+);
@@ -0,0 +1,21 @@
+USE `algo_trading`;
+
+CREATE TABLE `candles` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `ticker` varchar(10) DEFAULT NULL,
+  `timeframe_min` int(11) DEFAULT NULL,
+  `datetime_newyork` datetime NOT NULL,
+  `open` decimal(10,4) DEFAULT NULL,
+  `high` decimal(10,4) DEFAULT NULL,
+  `low` decimal(10,4) DEFAULT NULL,
+  `close` decimal(10,4) DEFAULT NULL,
+  `volume` bigint(20) DEFAULT NULL,
+  `quote_count` int(11) DEFAULT NULL,
+  PRIMARY KEY (`id`,`datetime_newyork`),
+  UNIQUE KEY `idx_ticker_tf_dt` (`ticker`,`timeframe_min`,`datetime_newyork`)
+) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=latin1
+/* One partition per New York date, added ahead and dropped after the
+   retention period by `partitions.PartitionMaintenance` */
+PARTITION BY RANGE (TO_DAYS(`datetime_newyork`)) (
+  PARTITION `pmax` VALUES LESS THAN MAXVALUE
+);
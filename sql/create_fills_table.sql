@@ -0,0 +1,15 @@
+USE `algo_trading`;
+
+CREATE TABLE `fills` (
+  `id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `order_id` bigint(20) DEFAULT NULL,
+  `ticker` varchar(10) DEFAULT NULL,
+  `side` varchar(4) DEFAULT NULL,
+  `quantity` bigint(20) DEFAULT NULL,
+  `price` decimal(10,4) DEFAULT NULL,
+  `commission` decimal(10,4) DEFAULT NULL,
+  `order_type` varchar(10) DEFAULT NULL,
+  `datetime_newyork` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_ticker_dt` (`ticker`,`datetime_newyork`)
+) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=latin1;
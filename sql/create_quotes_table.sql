@@ -10,7 +10,12 @@ CREATE TABLE `quotes` (
   `delayed` bit(1) DEFAULT NULL,
   `time_correction_sec` int(11) DEFAULT NULL,
   `initial` bit(1) DEFAULT NULL,
-  `datetime_newyork` datetime DEFAULT NULL,
-  PRIMARY KEY (`id`),
+  `datetime_newyork` datetime NOT NULL,
+  PRIMARY KEY (`id`,`datetime_newyork`),
   UNIQUE KEY `idx_ticker_dt` (`ticker`,`datetime_newyork`)
-) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=latin1;
+) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=latin1
+/* One partition per New York date, added ahead and dropped after the
+   retention period by `partitions.PartitionMaintenance` */
+PARTITION BY RANGE (TO_DAYS(`datetime_newyork`)) (
+  PARTITION `pmax` VALUES LESS THAN MAXVALUE
+);
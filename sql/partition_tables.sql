@@ -0,0 +1,46 @@
+USE `algo_trading`;
+
+/* Partition existing `quotes`, `candles` and `analysis` tables by New York
+   date (the create_*_table.sql scripts create them partitioned).
+
+   The partitioning column must be in every unique key, so it joins the
+   primary key and can't be NULL: rows without a datetime are deleted
+   first. Each table starts with only `pmax`; the first run of
+   `partitions.PartitionMaintenance` moves the existing rows into
+   `p_history` (a one-off copy) and adds the daily partitions from then on.
+   The ALTERs rebuild the tables, so run this outside market hours. */
+
+DELETE FROM `quotes` WHERE `datetime_newyork` IS NULL;
+ALTER TABLE `quotes`
+  MODIFY `datetime_newyork` datetime NOT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`,`datetime_newyork`);
+ALTER TABLE `quotes`
+  PARTITION BY RANGE (TO_DAYS(`datetime_newyork`)) (
+    PARTITION `pmax` VALUES LESS THAN MAXVALUE
+  );
+
+DELETE FROM `candles` WHERE `datetime_newyork` IS NULL;
+ALTER TABLE `candles`
+  MODIFY `datetime_newyork` datetime NOT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`,`datetime_newyork`);
+ALTER TABLE `candles`
+  PARTITION BY RANGE (TO_DAYS(`datetime_newyork`)) (
+    PARTITION `pmax` VALUES LESS THAN MAXVALUE
+  );
+
+/* `analysis` rows take the datetime of their quote */
+ALTER TABLE `analysis`
+  ADD COLUMN `datetime_newyork` datetime DEFAULT NULL AFTER `quotes_id`;
+UPDATE `analysis` JOIN `quotes` ON `quotes`.`id` = `analysis`.`quotes_id`
+  SET `analysis`.`datetime_newyork` = `quotes`.`datetime_newyork`;
+DELETE FROM `analysis` WHERE `datetime_newyork` IS NULL;
+ALTER TABLE `analysis`
+  MODIFY `datetime_newyork` datetime NOT NULL,
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`,`datetime_newyork`);
+ALTER TABLE `analysis`
+  PARTITION BY RANGE (TO_DAYS(`datetime_newyork`)) (
+    PARTITION `pmax` VALUES LESS THAN MAXVALUE
+  );
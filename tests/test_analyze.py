@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from trade_strat_framework.analyze import ANALYSES, Analyze
+
+
+def _analyzer():
+
+    return(Analyze(None, None, analysis_types=' '.join(sorted(ANALYSES))))
+
+
+def test_analysis_matrices_empty_range():
+
+    analyzer = _analyzer()
+    outputs = analyzer.analysis_matrices(np.empty((0, 3)))
+
+    assert sorted(outputs) == sorted(analyzer.fields + ['{}_signal'.format(x) for x in sorted(ANALYSES)])
+    for key, values in outputs.items():
+        assert values.shape == (0, 3)
+        if key.endswith('_signal'):
+            assert values.dtype == np.int8
+
+    assert analyzer.signal_matrix(np.empty((0, 3))).shape == (0, 3)
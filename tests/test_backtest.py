@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from benchmarks.fakes import fake_history
+from trade_strat_framework.analyze import ANALYSES, Analyze
+from trade_strat_framework.backtest import Backtest
+
+
+@pytest.mark.parametrize('tickers, periods', [(['AAA', 'BBB'], 0), ([], 0), ([], 20)])
+def test_run_empty_history(tickers, periods):
+
+    backtest = Backtest(Analyze(None, None, analysis_types=' '.join(sorted(ANALYSES))), initial_cash=1000.0)
+    result = backtest.run(fake_history(tickers, periods))
+
+    assert len(result.trades) == 0
+    np.testing.assert_array_equal(result.equity, np.full(periods, 1000.0))
+    assert result.daily['pnl'].sum() == 0
+    assert result.summary()['pnl'] == 0
+    assert result.summary()['trades'] == 0
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+from trade_strat_framework.indicators import Indicator, SMA, EMA, RSI, MACD, Bollinger
+
+INDICATORS = {
+    'sma': lambda: SMA(window=5),
+    'ema': lambda: EMA(window=5),
+    'rsi': lambda: RSI(window=5),
+    'macd': lambda: MACD(fast=3, slow=6, signal=4),
+    'bollinger': lambda: Bollinger(window=5),
+    }
+
+# Split points between the backfilled history and the streamed updates:
+# none backfilled, less than a window, about a window, and more
+SPLITS = [0, 1, 3, 5, 9, 40]
+
+
+def _prices(n=60, seed=0):
+
+    rng = np.random.default_rng(seed)
+    return(np.round(100*np.exp(np.cumsum(rng.normal(0, 0.01, size=n))), 2))
+
+
+@pytest.mark.parametrize('split', SPLITS)
+@pytest.mark.parametrize('name', sorted(INDICATORS))
+def test_streaming_matches_backfill(name, split):
+
+    prices = _prices()
+    expected = INDICATORS[name]().backfill(prices)
+
+    indicator = INDICATORS[name]()
+    head = indicator.backfill(prices[:split])
+    tail = np.array([indicator.update(x) for x in prices[split:]], dtype=np.float64)
+    streamed = np.concatenate([head.reshape(split, len(indicator.fields)), tail])
+
+    assert streamed.shape == expected.shape
+    np.testing.assert_array_equal(np.isnan(streamed), np.isnan(expected))
+    np.testing.assert_allclose(streamed, expected, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize('name', sorted(INDICATORS))
+def test_backfill_matches_compute(name):
+
+    prices = _prices()
+    indicator = INDICATORS[name]()
+
+    np.testing.assert_allclose(
+        indicator.backfill(prices),
+        np.stack(INDICATORS[name]().compute(prices), axis=1),
+        rtol=1e-12,
+        equal_nan=True,
+        )
+
+
+def test_indicator_requires_implementation():
+
+    class Partial(Indicator):
+
+        fields = ('partial',)
+
+        def update(self, value):
+            return((value,))
+
+    with pytest.raises(TypeError):
+        Partial()
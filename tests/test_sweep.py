@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+
+from benchmarks.fakes import fake_history
+from trade_strat_framework.sweep import ParameterSweep, grid_points, point_key
+
+
+def test_run_after_interrupted_line(tmp_path):
+
+    points = grid_points({'analysis_types': ['sma'], 'sma.window': [5, 10]})
+    resultsPath = tmp_path / 'results.jsonl'
+
+    # The first point finished; the run was interrupted writing the second
+    finished = {'key': point_key(points[0]), 'point': points[0], 'summary': {'pnl': 0.0}}
+    resultsPath.write_text(json.dumps(finished) + '\n' + '{"key": "{\\"analysis')
+
+    sweep = ParameterSweep(fake_history(['AAA', 'BBB'], 100), resultsPath, processes=1)
+    sweep.run(points)
+
+    lines = resultsPath.read_text().splitlines()
+    assert [json.loads(x)['key'] for x in lines] == [point_key(x) for x in points]
+    assert sorted(sweep.results()) == sorted(point_key(x) for x in points)
@@ -1,23 +1,54 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
-from pathlib import Path
 import os
-import pendulum
-import importlib
-import requests
-import math
-import time
+import importlib.resources
+from functools import partial
 from typing import Optional
 
 import typer
-import coftc_cred_man
-import coftc_db_utils
 import coftc_logging
-from tda import auth, client
 
-from . import trade, analyze
+# The submodules (and the TDA client, database and numpy behind them) are
+# imported on first use, so importing the package or running `--help` stays
+# cheap. These names are still available from the package (PEP 562)
+_LAZY_ATTRIBUTES = {
+    'trade': ('.trade', None),
+    'analyze': ('.analyze', None),
+    'QuoteArchive': ('.archive', 'QuoteArchive'),
+    'Backtest': ('.backtest', 'Backtest'),
+    'load_quotes': ('.history', 'load_quotes'),
+    'ShardSupervisor': ('.supervisor', 'ShardSupervisor'),
+    }
+
+
+def __getattr__(name):
+    
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    
+    moduleName, attribute = _LAZY_ATTRIBUTES[name]
+    value = importlib.import_module(moduleName, __name__)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    
+    return(value)
+
+
+def _list_analyses(value):
+    
+    # Eager option callback: print the registered analyses and exit before
+    # the profiles are required (or anything connects)
+    if not value:
+        return
+    
+    from .analyze import ANALYSES
+    
+    for name, spec in sorted(ANALYSES.items()):
+        typer.echo('{:<12} lookback {:<4} fields {}'.format(name, spec.lookback, ', '.join(spec.fields)))
+    raise typer.Exit()
+
 
 # Create typer app
 app = typer.Typer()
@@ -55,44 +86,102 @@ class AlgoTrade:
             analysis_types: Optional[str] = typer.Option(
                 None, '--analysis',
                 help="List of analysis types to use when determining buy/sell signals"),
+            async_mode: bool = typer.Option(
+                False, '--async', show_default=False,
+                help="Use the asynchronous TDA client (concurrent, batched quote requests)"),
             interactive: bool = typer.Option(
                 False, '--interactive', '-i', show_default=False,
                 help="Run the script interactively (rather than automated)"),
             dev: bool = typer.Option(
                 False, '--dev', show_default=False,
                 help="Specify that the package is in 'development mode'"),
+            list_analyses: bool = typer.Option(
+                False, '--list-analyses', show_default=False,
+                callback=_list_analyses, is_eager=True, expose_value=False,
+                help="List the available analysis types and exit"),
             ):
 
         # If this is run in an interpreter, set the optional Options to their
         # defaults so the user doesn't have to
         self.period_minutes = period_minutes.default if isinstance(period_minutes, typer.models.OptionInfo) else period_minutes    
         self.analysis_types = analysis_types.default if isinstance(analysis_types, typer.models.OptionInfo) else analysis_types    
+        self.async_mode = async_mode.default if isinstance(async_mode, typer.models.OptionInfo) else async_mode
         self.interactive = interactive.default if isinstance(interactive, typer.models.OptionInfo) else interactive    
         self.dev = dev.default if isinstance(dev, typer.models.OptionInfo) else dev
-        
+        self.redirect_uri = redirect_uri.default if isinstance(redirect_uri, typer.models.OptionInfo) else redirect_uri
+
         # Set paths based on 'dev mode'
         if not self.dev:
             self.package_path = importlib.resources.files('trade_framework')
         else:
             self.package_path = os.getcwd()
 
-        # Set credential manager
-        self.cred = coftc_cred_man.Cred(tda_profile)
+        self.tda_profile = tda_profile
         self.db_profile = db_profile
-        
-        self.connect(redirect_uri)
-        
+
+        # The credentials, TDA client and database connection are set up on
+        # first use (see `cred`, `client` and `conn`), so commands that
+        # don't need them don't wait on the token load, login or database
+        self._cred = None
+        self._client = None
+        self._conn = None
+
         if self.interactive:
             self.run()
-        
+
+    @property
+    def cred(self):
+
+        if self._cred is None:
+            import coftc_cred_man
+            self._cred = coftc_cred_man.Cred(self.tda_profile)
+
+        return(self._cred)
+
+    @property
+    def client(self):
+
+        if self._client is None:
+            self._client = self._connect_tda(self.redirect_uri)
+
+        return(self._client)
+
+    @property
+    def conn(self):
+
+        if self._conn is None:
+            import coftc_db_utils
+            # Connect to `algo_trading` database
+            self._conn = coftc_db_utils.Conn(self.db_profile)
+
+        return(self._conn)
+
     @coftc_logging.exceptions()
-    def connect(self, redirect_uri):
-        
+    def connect(self, redirect_uri=None):
+        """
+        Connect to TD Ameritrade and the database now, rather than on first
+        use.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if redirect_uri is not None:
+            self.redirect_uri = redirect_uri
+        self.client
+        self.conn
+
+    def _connect_tda(self, redirect_uri):
+
+        from tda import auth
+
         # Connect to TD Ameritrade
         token_path = os.path.expanduser('~/.tdatoken.pickle')
 
         try:
-            self._client = auth.client_from_token_file(token_path, self.cred.password())
+            return(auth.client_from_token_file(token_path, self.cred.password(), asyncio=self.async_mode))
         except FileNotFoundError:
             from selenium import webdriver
             # TODO: Test this try-catch block; may or may not work when using on a non-GUI OS
@@ -104,23 +193,129 @@ class AlgoTrade:
                             'chromedriver.exe',
                             )
                         ) as driver:
-                    self._client = auth.client_from_login_flow(
+                    return(auth.client_from_login_flow(
                         driver,
                         self.cred.password(),
                         redirect_uri,
-                        token_path
-                        )
+                        token_path,
+                        asyncio=self.async_mode,
+                        ))
             except:
-                self._client = auth.client_from_manual_flow(
+                return(auth.client_from_manual_flow(
                     self.cred.password(),
                     redirect_uri,
                     token_path,
-                    asyncio=False,
+                    asyncio=self.async_mode,
                     token_write_func=None
-                    )
+                    ))
+        
+    @coftc_logging.exceptions()
+    def supervise(self, tickers, shards=4, rate_limit=110, report_sec=60):
+        """
+        Store quotes for `tickers` across `shards` worker processes (see
+        `supervisor.ShardSupervisor`), sharing one budget of `rate_limit`
+        requests per minute, until interrupted. Each worker reads the saved
+        TDA token (created here by logging in, if there isn't one yet).
 
-        # Connect to `algo_trading` database
-        self._conn = coftc_db_utils.Conn(self.db_profile)
+        Returns
+        -------
+        None.
+
+        """
+        
+        from .supervisor import ShardSupervisor
+        
+        self.client
+        ShardSupervisor(
+            partial(_connect_worker, self.tda_profile, self.db_profile, self.async_mode),
+            tickers,
+            shards=shards,
+            rate_limit=rate_limit,
+            async_mode=self.async_mode,
+            trade_options={'period_minutes': self.period_minutes, 'dev': self.dev},
+            ).run(report_sec=report_sec)
+        
+    @coftc_logging.exceptions()
+    def sync_archive(self, archive_path, batch_rows=100000):
+        """
+        Copy the new `quotes` rows into the local archive at `archive_path`
+        (see `archive.QuoteArchive`), for research off the live database.
+
+        Returns
+        -------
+        int
+            The number of rows read.
+
+        """
+        
+        from .archive import QuoteArchive
+        
+        return(QuoteArchive(archive_path).sync(self.conn, batch_rows=batch_rows))
+        
+    @coftc_logging.exceptions()
+    def maintain_partitions(self, quotes_days=30, candles_days=None, analysis_days=30, compact_minutes=(60,), days_ahead=7):
+        """
+        The daily maintenance of the date-partitioned tables (see
+        `partitions.PartitionMaintenance`): add the coming days'
+        partitions, roll quotes older than `quotes_days` up into candles of
+        `compact_minutes`, and drop expired partitions (None keeps a table's
+        partitions).
+        
+        Returns
+        -------
+        dict
+            The partitions added and dropped, and the candles written.
+        
+        """
+        
+        from .partitions import PartitionMaintenance
+        
+        return(
+            PartitionMaintenance(
+                self.conn,
+                retention_days={'quotes': quotes_days, 'candles': candles_days, 'analysis': analysis_days},
+                compact_minutes=compact_minutes,
+                days_ahead=days_ahead,
+                ).run()
+            )
+        
+    @coftc_logging.exceptions()
+    def backtest(self, tickers, start, end, slippage_bps=0.0, commission=0.0, allow_short=False, archive_path=None):
+        """
+        Replay the selected analyses over the stored quotes of `tickers`
+        between `start` and `end` (New York time), with simulated fills.
+        Quotes are read from the local archive at `archive_path` if given,
+        else from the `quotes` table (neither TDA nor the database is
+        connected to when backtesting from the archive).
+
+        Returns
+        -------
+        backtest.BacktestResult
+            Per-trade and per-day P&L.
+
+        """
+        
+        from .analyze import Analyze
+        from .archive import QuoteArchive
+        from .backtest import Backtest
+        from .history import load_quotes
+        
+        if archive_path is not None:
+            history = QuoteArchive(archive_path).load_history(tickers, start, end, self.period_minutes)
+            conn = None
+        else:
+            history = load_quotes(self.conn, tickers, start, end, self.period_minutes)
+            conn = self.conn
+        analyzer = Analyze(None, conn, analysis_types=self.analysis_types, dev=self.dev)
+        
+        return(
+            Backtest(
+                analyzer,
+                slippage_bps=slippage_bps,
+                commission=commission,
+                allow_short=allow_short,
+                ).run(history)
+            )
         
     @coftc_logging.exceptions()
     def run(self):
@@ -134,15 +329,34 @@ class AlgoTrade:
         """
         
         # TODO: Set up stock screener to automatically feed Trade. For now,
-        # use a manual TOML file to feed tickers. Like the eventual screener
-        # feed, the script should check for a new file periodically, and be
-        # able to filter out invalid tickers (and post to exceptions log).
+        # tickers are fed from a manual TOML file (`Trade --watchlist`, see
+        # `watchlist.Watchlist`), which is checked for changes periodically;
+        # invalid tickers are filtered out and posted to the notifications
+        # log. The screener feed should work the same way.
         
-        # TODO: Set up market open/close reading (something like scraping
-        # https://www.tradinghours.com/open). For now, use a weekday 0900-1630
-        # (New York time) 
+        # Market hours come from resources/market_calendar.json (holidays
+        # and early closes included; see `market.MarketCalendar`): the quote
+        # loop sleeps until the next session opens. TODO: Extend the
+        # calendar's range as exchanges publish their holidays
         
 
+def _connect_worker(tda_profile, db_profile, async_mode):
+    
+    # The TDA client and database connection of a supervisor worker (from
+    # the saved token only; the login flows need the supervisor's console)
+    import coftc_cred_man
+    import coftc_db_utils
+    from tda import auth
+    
+    tdaClient = auth.client_from_token_file(
+        os.path.expanduser('~/.tdatoken.pickle'),
+        coftc_cred_man.Cred(tda_profile).password(),
+        asyncio=async_mode,
+        )
+    
+    return(tdaClient, coftc_db_utils.Conn(db_profile))
+
+
 def run_cli():
     app()
 
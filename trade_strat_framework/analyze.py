@@ -1,24 +1,99 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
-from pathlib import Path
 import os
 import pendulum
 import importlib
-import requests
 import math
 import time
+from http import HTTPStatus
 from typing import Optional
+from collections import namedtuple
+from functools import partial
 import typer
 
-import coftc_cred_man
-import coftc_db_utils
 import coftc_logging
+import numpy as np
+
+from .history import ticker_list, range_predicate, lookback_start
+from .indicators import IndicatorEngine, field_name, SMA, EMA, RSI, MACD, Bollinger
 
 # Create typer app
 app = typer.Typer()
 
+# A registered analysis:
+#   name        the `--analysis` name
+#   indicator   callable returning a new indicators.Indicator (keyword
+#               arguments are the analysis' parameters, e.g. `window`)
+#   lookback    the number of quotes needed before the first output
+#   fields      the output fields (columns in the `analysis` table)
+#   signal      signal(price, outputs) -> 1 (buy), -1 (sell) or 0 (hold);
+#               `outputs` maps each field to its value(s), and must work on
+#               scalars and arrays alike
+AnalysisSpec = namedtuple('AnalysisSpec', ['name', 'indicator', 'lookback', 'fields', 'signal'])
+
+# Registered analyses, by name
+ANALYSES = {}
+
+
+def register_analysis(name, indicator):
+    """
+    Register the decorated function as the signal of analysis `name`,
+    computed from the outputs of `indicator` (a callable returning a new
+    indicators.Indicator, taking the analysis' parameters as keyword
+    arguments). The lookback and output fields are taken from the indicator
+    with its default parameters.
+
+    """
+    
+    def decorator(signal):
+        template = indicator()
+        ANALYSES[name] = AnalysisSpec(
+            name=name,
+            indicator=indicator,
+            lookback=template.lookback,
+            fields=[field_name(name, x) for x in template.fields],
+            signal=signal,
+            )
+        return(signal)
+    
+    return(decorator)
+
+
+@register_analysis('sma', lambda window=20: SMA(window))
+def _sma_signal(price, outputs):
+    
+    # Price above/below its moving average
+    return(np.where(price > outputs['sma'], 1, np.where(price < outputs['sma'], -1, 0)))
+
+
+@register_analysis('ema', lambda window=20: EMA(window))
+def _ema_signal(price, outputs):
+    
+    return(np.where(price > outputs['ema'], 1, np.where(price < outputs['ema'], -1, 0)))
+
+
+@register_analysis('rsi', lambda window=14: RSI(window))
+def _rsi_signal(price, outputs):
+    
+    # Oversold (<30) / overbought (>70)
+    return(np.where(outputs['rsi'] < 30, 1, np.where(outputs['rsi'] > 70, -1, 0)))
+
+
+@register_analysis('macd', lambda fast=12, slow=26, signal=9: MACD(fast, slow, signal))
+def _macd_signal(price, outputs):
+    
+    # MACD above/below its signal line
+    return(np.where(outputs['macd_histogram'] > 0, 1, np.where(outputs['macd_histogram'] < 0, -1, 0)))
+
+
+@register_analysis('bollinger', lambda window=20, width=2: Bollinger(window, width))
+def _bollinger_signal(price, outputs):
+    
+    # Price outside the bands
+    return(np.where(price < outputs['bollinger_lower'], 1, np.where(price > outputs['bollinger_upper'], -1, 0)))
+
+
 @app.command()
 class Analyze:
     
@@ -41,9 +116,10 @@ class Analyze:
                 help="Specify that the package is in 'development mode'"),
             ):
         
-        # TODO: add this to tests:
-        # Note that any non-analysis functions must be preceded by at least
-        # one underscore
+        # If this is run in an interpreter, set the optional Options to their
+        # defaults so the user doesn't have to
+        analysis_types = analysis_types.default if isinstance(analysis_types, typer.models.OptionInfo) else analysis_types
+        dev = dev.default if isinstance(dev, typer.models.OptionInfo) else dev
         
         if not dev:
             self.package_path = importlib.resources.files('trade_strat_framework')
@@ -53,6 +129,10 @@ class Analyze:
         # Set connects (matches the attribute names in __init__)
         self._conn = db_conn
         self._client = tda_client
+        
+        # Recent quotes (store.QuoteStore, e.g. `Trade.quote_store`). Set
+        # this to read history from memory rather than the `quotes` table
+        self.quote_store = None
 
         self._parse_analysis_types(analysis_types)
         
@@ -60,7 +140,8 @@ class Analyze:
     @coftc_logging.exceptions()
     def _parse_analysis_types(self, analysis_types):
         """
-        Parse the analysis types input and ensure the proper fields are in the
+        Parse the analysis types input, resolve them against the registered
+        analyses (`ANALYSES`) and ensure the proper fields are in the
         database.
 
         Returns
@@ -70,14 +151,14 @@ class Analyze:
         """
         
         # Split the analysis types, convert to lowercase, and ensure the
-        # corresponding function exist in this class
-        self.analysis_list = analysis_types.lower().replace(',','').split(' ')
+        # corresponding analyses are registered
+        self.analysis_list = [] if analysis_types is None else analysis_types.lower().replace(',',' ').split()
         
         checkList = []
         for itm in self.analysis_list:
-            checkList.append(hasattr(self,itm))
+            checkList.append(itm in ANALYSES)
         if not all(checkList):
-            if len(checkList)==1:
+            if checkList.count(False)==1:
                 pluralStr = "analysis hasn't"
             else:
                 pluralStr = "analyses haven't"
@@ -87,22 +168,324 @@ class Analyze:
                     plur=pluralStr,
                     lst="', '".join(self.analysis_list[idx] for idx,x in enumerate(checkList) if not x)),
                 "The available analyses are '{}'".format(
-                    "', '".join(
-                        x for x in dir(self) if not x.startswith('_')
-                        )
+                    "', '".join(sorted(ANALYSES))
                     ),
                 )
+        
+        self.configure()
 
-        # Ensure the proper fields are in the `analysis` table
-        for itm in self.analysis_list:
-            
+        # Ensure the proper fields are in the `analysis` table (skipped when
+        # running offline, e.g. in parameter sweeps)
+        if self._conn is not None:
+            self._sync_analysis_table()
+    
+    def configure(self, params=None):
+        """
+        Resolve the selected analyses once into the dispatch list
+        (duplicates dropped, order kept), and the history needed for all of
+        them together.
+
+        Parameters
+        ----------
+        params : dict, optional
+            Analysis name: keyword arguments for its indicator (e.g.
+            `{'rsi': {'window': 10}}`). Unspecified parameters use the
+            registered defaults.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        params = params or {}
+        
+        self._dispatch = []
+        for itm in dict.fromkeys(self.analysis_list):
+            spec = ANALYSES[itm]
+            if params.get(itm):
+                indicator = partial(spec.indicator, **params[itm])
+                spec = spec._replace(indicator=indicator, lookback=indicator().lookback)
+            self._dispatch.append(spec)
+        
+        self.lookback = max([x.lookback for x in self._dispatch], default=0)
+        self.fields = [field for spec in self._dispatch for field in spec.fields]
+        self.indicators = IndicatorEngine({x.name: x.indicator for x in self._dispatch})
+        
+    @coftc_logging.exceptions()
+    def _sync_analysis_table(self):
+        """
+        Add any missing output fields (and '<name>_signal' fields) of the
+        selected analyses to the `analysis` table, in one ALTER TABLE.
+
+        Returns
+        -------
+        None.
+
+        """
+        
+        if not self._dispatch:
+            return
+        
+        existing = {
+            row[0] for row in self._conn.query(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'analysis'"
+                )
+            }
+        
+        columnList = []
+        for spec in self._dispatch:
+            columnList += ['`{}` double DEFAULT NULL'.format(x) for x in spec.fields if x not in existing]
+            if '{}_signal'.format(spec.name) not in existing:
+                columnList.append('`{}_signal` tinyint(4) DEFAULT NULL'.format(spec.name))
+        
+        if columnList:
+            self._conn.query(
+                'ALTER TABLE `analysis` {}'.format(
+                    ', '.join('ADD COLUMN {}'.format(x) for x in columnList)
+                    )
+                )
+    
+    def _signals(self, price, outputs):
+        """
+        Evaluate the selected analyses' signals.
+
+        Parameters
+        ----------
+        price : float or numpy.ndarray
+        outputs : dict
+            Output field: value(s), for at least the selected analyses'
+            fields.
+
+        Returns
+        -------
+        dict
+            '<name>_signal': 1 (buy), -1 (sell) or 0 (hold).
+
+        """
+        
+        return(
+            {
+                '{}_signal'.format(spec.name): spec.signal(price, outputs) for spec in self._dispatch
+                }
+            )
+    
+    @coftc_logging.exceptions()
+    def warm(self, ticker, prices):
+        """
+        Warm the selected analyses of `ticker` from its price history (oldest
+        first; at least `self.lookback` values for outputs at the end).
+
+        Returns
+        -------
+        dict
+            Output field: array of values for every price, including the
+            signals.
+
+        """
+        
+        prices = np.asarray(prices, dtype=np.float64)
+        outputs = self.indicators.backfill(ticker, prices)
+        outputs.update(self._signals(prices, outputs))
         
+        return(outputs)
+    
+    @coftc_logging.exceptions()
+    def analysis_matrices(self, prices):
+        """
+        Compute the selected analyses for every ticker at once.
+
+        Each column is treated as its own series starting at its first
+        quote: missing (NaN) quotes after that carry the last price forward,
+        so outputs match running the ticker alone over its forward-filled
+        prices. Outputs are NaN before a ticker has enough history, and the
+        signal is 0 (hold) wherever the quote itself is missing.
+
+        Parameters
+        ----------
+        prices : numpy.ndarray
+            (time x ticker) prices, oldest first, NaN where missing.
+
+        Returns
+        -------
+        dict
+            Output field (including '<name>_signal'): (time x ticker) array.
+
+        """
+
+        prices = np.asarray(prices, dtype=np.float64)
+        if prices.ndim != 2:
+            raise ValueError('prices must be a (time x ticker) matrix, not {}D'.format(prices.ndim))
+
+        nTime, nTicker = prices.shape
+        if nTime == 0:
+            # An empty range (e.g. no quotes between the backtest dates)
+            outputs = {field: np.empty((0, nTicker)) for field in self.fields}
+            outputs.update(
+                {'{}_signal'.format(spec.name): np.zeros((0, nTicker), dtype=np.int8) for spec in self._dispatch}
+                )
+            return(outputs)
+
+        missing = np.isnan(prices)
+        timeIdx = np.arange(nTime)[:, np.newaxis]
+        columns = np.arange(nTicker)[np.newaxis, :]
+
+        # Carry the last quote forward (leading NaNs stay NaN)
+        lastValid = np.where(missing, 0, timeIdx)
+        np.maximum.accumulate(lastValid, axis=0, out=lastValid)
+        filled = prices[lastValid, columns]
+
+        # Shift each column up so it starts at its first quote (the tail is
+        # padded with the last row and discarded when shifting back)
+        first = np.where(missing.all(axis=0), nTime, np.argmax(~missing, axis=0))
+        shifted = filled[np.minimum(timeIdx + first, nTime - 1), columns]
+        unshift = timeIdx - first
+        valid = unshift >= 0
+        unshift = np.clip(unshift, 0, nTime - 1)
+
+        outputs = {}
+        for spec in self._dispatch:
+            for field, values in zip(spec.fields, spec.indicator().compute(shifted)):
+                outputs[field] = np.where(valid, values[unshift, columns], np.nan)
+
+        for key, signal in self._signals(filled, outputs).items():
+            outputs[key] = np.where(missing, 0, signal).astype(np.int8)
+
+        return(outputs)
+
+    @coftc_logging.exceptions()
+    def signal_matrix(self, prices):
+        """
+        The combined buy/sell/hold signal of the selected analyses for every
+        ticker at once (see `analysis_matrices` for the NaN handling).
+
+        Returns
+        -------
+        numpy.ndarray
+            (time x ticker) int8: 1 (buy) where more of the selected analyses
+            signal buy than sell, -1 (sell) for the reverse, otherwise 0
+            (hold).
+
+        """
+
+        outputs = self.analysis_matrices(prices)
+        votes = sum(
+            [outputs['{}_signal'.format(spec.name)].astype(np.int64) for spec in self._dispatch],
+            np.zeros(np.shape(prices), dtype=np.int64),
+            )
+
+        return(np.sign(votes).astype(np.int8))
+
+    @coftc_logging.exceptions()
+    def warm_from_db(self, tickers, period_minutes=15):
+        """
+        Warm the selected analyses of every ticker from the `quotes` table,
+        fetching the last `self.lookback` quotes of all tickers in a single
+        query. Only the date partitions that can hold `self.lookback`
+        periods of `period_minutes` are read (see `history.lookback_start`).
+
+        Returns
+        -------
+        dict
+            Ticker: the output of `warm`.
+
+        """
+
+        if not self._dispatch or not tickers:
+            return({})
+
+        rows = self._conn.query(
+            "SELECT `ticker`, `price` FROM ("
+            "SELECT `ticker`, `price`, `datetime_newyork`, ROW_NUMBER() OVER "
+            "(PARTITION BY `ticker` ORDER BY `datetime_newyork` DESC) AS `rn` "
+            "FROM `quotes` WHERE `initial` = 0 AND `ticker` IN ({tickers}) AND {dates}"
+            ") AS `recent` WHERE `rn` <= {lookback} "
+            "ORDER BY `ticker`, `datetime_newyork`".format(
+                tickers=ticker_list(tickers),
+                dates=range_predicate(lookback_start(self.lookback, period_minutes), '9999-12-31'),
+                lookback=int(self.lookback),
+                )
+            )
+
+        priceDict = {}
+        for ticker, price in rows:
+            priceDict.setdefault(ticker, []).append(float(price))
+
+        return({ticker: self.warm(ticker, prices) for ticker, prices in priceDict.items()})
+
+    @coftc_logging.exceptions()
+    def evaluate(self, ticker, price):
+        """
+        Update the selected analyses of `ticker` with a new price (O(1) per
+        analysis).
+
+        Returns
+        -------
+        dict
+            Output field: latest value, including the signals.
+
+        """
+        
+        outputs = self.indicators.update(ticker, price)
+        outputs.update({key: int(value) for key, value in self._signals(price, outputs).items()})
+
+        return(outputs)
+
+    @coftc_logging.exceptions()
+    def signal_batch(self, tickers, prices):
+        """
+        Update the selected analyses with one new price per ticker, and
+        combine their signals as in `signal_matrix` (the signals are
+        evaluated for the whole batch at once).
+
+        Returns
+        -------
+        numpy.ndarray
+            int8 signal of each ticker: 1 (buy), -1 (sell) or 0 (hold).
+
+        """
+
+        prices = np.asarray(prices, dtype=np.float64)
+        if not self._dispatch or len(prices) == 0:
+            return(np.zeros(len(prices), dtype=np.int8))
+
+        updates = self.indicators.update_batch(tickers, prices)
+        outputs = {
+            field: np.fromiter((updates[x][field] for x in tickers), dtype=np.float64, count=len(prices))
+            for field in self.fields
+            }
+        votes = sum(
+            [np.asarray(x, dtype=np.int64) for x in self._signals(prices, outputs).values()],
+            np.zeros(len(prices), dtype=np.int64),
+            )
+
+        return(np.sign(votes).astype(np.int8))
+    
+    def _history(self, ticker, n, fields=None):
+        """
+        The last `n` quotes of `ticker` from `self.quote_store`, oldest
+        first.
+
+        Returns
+        -------
+        dict
+            Field: read-only array view (no copy is made). Fewer than `n`
+            quotes are returned if fewer are stored.
+
+        """
+        
+        if self.quote_store is None or ticker not in self.quote_store:
+            raise KeyError("No quotes in memory for '{}'".format(ticker))
+        
+        return(self.quote_store.last(ticker, n, fields))
+
 
     @coftc_logging.exceptions()
     def json_quotes(self, ticker):
         
         r = self.client.get_quotes(ticker)
-        assert r.status_code == requests.codes.okay, r.raise_for_status()
+        assert r.status_code == HTTPStatus.OK, r.raise_for_status()
         
         return(r.json())
     
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pendulum
+
+from .history import QuoteHistory
+
+# The archived `quotes` columns. `epoch_sec` is the (naive) New York
+# `datetime_newyork` as epoch seconds
+ARCHIVE_FIELDS = {
+    'epoch_sec': np.int64,
+    'price': np.float64,
+    'ask': np.float64,
+    'bid': np.float64,
+    'volume': np.int64,
+    'delayed': bool,
+    'time_correction_sec': np.int32,
+    'initial': bool,
+    }
+
+# The `quotes` columns selected for each field (returning plain numbers, so
+# the columns convert to arrays without per-value parsing)
+_SELECT = {
+    'epoch_sec': "TIMESTAMPDIFF(SECOND, '1970-01-01', `datetime_newyork`)",
+    'price': "`price` + 0e0",
+    'ask': "`ask` + 0e0",
+    'bid': "`bid` + 0e0",
+    'volume': "IFNULL(`volume`, 0)",
+    'delayed': "IFNULL(`delayed` + 0, 0)",
+    'time_correction_sec': "IFNULL(`time_correction_sec`, 0)",
+    'initial': "IFNULL(`initial` + 0, 0)",
+    }
+
+
+def _local_sec(value):
+
+    # New York time (str or datetime) as naive epoch seconds
+    return(int(np.datetime64(pendulum.parse(str(value)).format('YYYY-MM-DDTHH:mm:ss'), 's').astype(np.int64)))
+
+
+class QuoteArchive:
+    """ Local columnar archive of the `quotes` table.
+
+    One directory per New York date, holding append-only segments: each a
+    directory with one `.npy` file per column (`ARCHIVE_FIELDS`) and an
+    index (`tickers.json`). A segment's rows are sorted by (ticker,
+    datetime) like `idx_ticker_dt`, so each ticker's quotes in it are a
+    contiguous range, and a time slice of it is a zero-copy view of the
+    memory-mapped column. A sync only writes its new rows, as a new segment
+    of each date they fall on; a date's segments are merged into one once
+    there are more than `max_segments`.
+
+    """
+
+    def __init__(self, path, max_segments=8):
+
+        self.path = Path(path)
+        self.max_segments = max_segments
+
+    def _partition_path(self, date):
+
+        return(self.path / str(date))
+
+    def _segments(self, date):
+
+        # The segment directories of a date, oldest first
+        path = self._partition_path(date)
+        if not path.exists():
+            return([])
+
+        return(sorted(x for x in path.iterdir() if x.is_dir() and '.' not in x.name))
+
+    def dates(self, start=None, end=None):
+        """
+        Returns
+        -------
+        list of numpy.datetime64
+            The archived dates, between `start` (inclusive) and `end`
+            (exclusive) New York times if given.
+
+        """
+
+        if not self.path.exists():
+            return([])
+
+        dates = sorted(np.datetime64(x.name, 'D') for x in self.path.iterdir() if x.is_dir() and '.' not in x.name)
+        first = None if start is None else np.datetime64(_local_sec(start), 's').astype('datetime64[D]')
+        last = None if end is None else np.datetime64(_local_sec(end) - 1, 's').astype('datetime64[D]')
+
+        return([x for x in dates if (first is None or x >= first) and (last is None or x <= last)])
+
+    def _open(self, path, mmap_mode='r'):
+
+        with open(path / 'tickers.json') as f:
+            index = json.load(f)
+        columns = {x: np.load(path / (x + '.npy'), mmap_mode=mmap_mode) for x in ARCHIVE_FIELDS}
+
+        return(index, columns)
+
+    def _write(self, path, tickers, columns):
+
+        # Write to a temporary directory and rename it into place, so a
+        # reader never sees a partial segment
+        tmpPath = path.with_name(path.name + '.tmp')
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        tmpPath.mkdir(parents=True)
+
+        for field, dtype in ARCHIVE_FIELDS.items():
+            np.save(tmpPath / (field + '.npy'), np.asarray(columns[field], dtype=dtype))
+
+        tickerCol = columns['ticker']
+        starts = np.flatnonzero(np.append(True, tickerCol[1:] != tickerCol[:-1])) if len(tickerCol) else np.zeros(0, dtype=np.int64)
+        with open(tmpPath / 'tickers.json', 'w') as f:
+            json.dump(
+                {
+                    'tickers': [tickers[x] for x in tickerCol[starts].tolist()],
+                    'offsets': starts.tolist() + [len(tickerCol)],
+                    },
+                f,
+                )
+
+        os.replace(tmpPath, path)
+
+    def _merge(self, segments, rows):
+
+        # Combine segments (paths) and new rows into one sorted segment (the
+        # latest wins on a duplicate (ticker, datetime))
+        tickers = []
+        code = {}
+        columns = {x: [] for x in ['ticker'] + list(ARCHIVE_FIELDS)}
+        for path in segments:
+            index, archived = self._open(path, mmap_mode=None)
+            for x in index['tickers']:
+                if x not in code:
+                    code[x] = len(tickers)
+                    tickers.append(x)
+            counts = np.diff(index['offsets'])
+            columns['ticker'].append(np.repeat(np.array([code[x] for x in index['tickers']], dtype=np.int64), counts))
+            for field in ARCHIVE_FIELDS:
+                columns[field].append(archived[field])
+
+        for x in dict.fromkeys(row[0] for row in rows):
+            if x not in code:
+                code[x] = len(tickers)
+                tickers.append(x)
+
+        newColumns = list(zip(*rows)) if rows else [()]*(1 + len(ARCHIVE_FIELDS))
+        columns['ticker'].append(np.fromiter((code[x] for x in newColumns[0]), dtype=np.int64, count=len(rows)))
+        for field, values in zip(ARCHIVE_FIELDS, newColumns[1:]):
+            columns[field].append(np.array(values, dtype=np.float64 if ARCHIVE_FIELDS[field] == np.float64 else np.int64))
+        columns = {x: np.concatenate(values) for x, values in columns.items()}
+
+        # Sort by ticker name then time, keeping the last of each key
+        rank = np.argsort(np.argsort(np.array(tickers, dtype=object)))
+        tickerRank = rank[columns['ticker']] if len(tickers) else columns['ticker']
+        order = np.lexsort((np.arange(len(tickerRank)), columns['epoch_sec'], tickerRank))
+        key = np.stack([tickerRank[order], columns['epoch_sec'][order]])
+        keep = order[np.append((key[:, 1:] != key[:, :-1]).any(axis=0), True)] if len(order) else order
+
+        return(tickers, {x: values[keep] for x, values in columns.items()})
+
+    def _append(self, date, rows):
+
+        # Write `rows` as the date's next segment, then merge the date's
+        # segments if there are too many
+        segments = self._segments(date)
+        nextNumber = int(segments[-1].name) + 1 if segments else 0
+        tickers, columns = self._merge([], rows)
+        self._write(self._partition_path(date) / '{:06d}'.format(nextNumber), tickers, columns)
+
+        if len(segments) + 1 > self.max_segments:
+            segments = self._segments(date)
+            tickers, columns = self._merge(segments, [])
+            self._write(self._partition_path(date) / '{:06d}'.format(nextNumber + 1), tickers, columns)
+            for path in segments:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def sync(self, conn, batch_rows=100000):
+        """
+        Copy the `quotes` rows that are new since the last sync, in `id`
+        (insert) order, so rows stored late with an older datetime are
+        copied too. Rows are read `batch_rows` at a time and appended to
+        the dates they fall on, and the last `id` copied is saved after
+        each batch, so an interrupted sync resumes.
+
+        Parameters
+        ----------
+        conn : coftc_db_utils.Conn
+
+        Returns
+        -------
+        int
+            The number of rows read.
+
+        """
+
+        statePath = self.path / 'sync.json'
+        lastId = 0
+        if statePath.exists():
+            with open(statePath) as f:
+                state = json.load(f)
+            if 'last_id' not in state:
+                raise ValueError('{} was synced by date, not id: sync into a new archive'.format(self.path))
+            lastId = state['last_id']
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        total = 0
+        while True:
+            rows = conn.query(
+                "SELECT `id`, `ticker`, {fields} FROM `quotes` WHERE `id` > {last_id} "
+                "ORDER BY `id` LIMIT {limit}".format(
+                    fields=', '.join(_SELECT[x] for x in ARCHIVE_FIELDS),
+                    last_id=int(lastId),
+                    limit=int(batch_rows),
+                    )
+                )
+            if not rows:
+                break
+
+            # Split the batch by New York date (`epoch_sec` is the third
+            # column)
+            dates = np.array([x[2] for x in rows], dtype=np.int64).astype('datetime64[s]').astype('datetime64[D]')
+            for date in np.unique(dates).tolist():
+                date = np.datetime64(date, 'D')
+                self._append(date, [row[1:] for row, x in zip(rows, dates == date) if x])
+
+            total += len(rows)
+            lastId = max([x[0] for x in rows])
+            with open(statePath, 'w') as f:
+                json.dump({'last_id': int(lastId)}, f)
+            if len(rows) < batch_rows:
+                break
+
+        return(total)
+
+    def read(self, tickers, start, end, fields=('price', 'ask', 'bid', 'volume')):
+        """
+        Read the archived quotes of `tickers` between `start` (inclusive)
+        and `end` (exclusive) New York times. Only the needed ranges of the
+        memory-mapped columns are touched.
+
+        Returns
+        -------
+        dict
+            Ticker: {field: array} (including `epoch_sec`). Read-only views
+            when the range is within one segment, else copies.
+
+        """
+
+        startSec = _local_sec(start)
+        endSec = _local_sec(end)
+        fields = ['epoch_sec'] + [x for x in fields if x != 'epoch_sec']
+
+        parts = {x: {field: [] for field in fields} for x in tickers}
+        for date in self.dates(start, end):
+            for path in self._segments(date):
+                index, columns = self._open(path)
+                position = {x: idx for idx, x in enumerate(index['tickers'])}
+                for ticker in tickers:
+                    if ticker not in position:
+                        continue
+                    first, last = index['offsets'][position[ticker]:position[ticker] + 2]
+                    epochSec = columns['epoch_sec'][first:last]
+                    lo = first + int(np.searchsorted(epochSec, startSec, side='left'))
+                    hi = first + int(np.searchsorted(epochSec, endSec, side='left'))
+                    for field in fields:
+                        parts[ticker][field].append(columns[field][lo:hi])
+
+        result = {}
+        for ticker, columns in parts.items():
+            if len(columns['epoch_sec']) == 1:
+                result[ticker] = {field: values[0] for field, values in columns.items()}
+                continue
+            if not columns['epoch_sec']:
+                result[ticker] = {field: np.zeros(0, dtype=ARCHIVE_FIELDS[field]) for field in columns}
+                continue
+
+            # Segments of a date can overlap in time (late rows), so the
+            # parts are put in time order, the latest copy of a time kept
+            merged = {field: np.concatenate(values) for field, values in columns.items()}
+            order = np.argsort(merged['epoch_sec'], kind='stable')
+            epochSec = merged['epoch_sec'][order]
+            keep = order[np.append(epochSec[1:] != epochSec[:-1], True)]
+            result[ticker] = {field: values[keep] for field, values in merged.items()}
+
+        return(result)
+
+    def load_history(self, tickers, start, end, period_minutes):
+        """
+        The archive equivalent of `history.load_quotes` (`initial` rows are
+        skipped).
+
+        Returns
+        -------
+        history.QuoteHistory
+
+        """
+
+        data = self.read(tickers, start, end, fields=('price', 'ask', 'bid', 'volume', 'initial'))
+        keep = {x: ~columns['initial'] for x, columns in data.items()}
+
+        return(
+            QuoteHistory.from_columns(
+                np.repeat(np.array(list(tickers), dtype=object), [int(keep[x].sum()) for x in tickers]),
+                np.concatenate([data[x]['epoch_sec'][keep[x]] for x in tickers] or [np.zeros(0, dtype=np.int64)]).astype('datetime64[s]'),
+                *[
+                    np.concatenate([data[x][field][keep[x]] for x in tickers] or [np.zeros(0)])
+                    for field in ['price', 'ask', 'bid', 'volume']
+                    ],
+                period_minutes,
+                tickers=list(tickers),
+                )
+            )
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+TRADE_DTYPE = np.dtype([
+    ('ticker', 'U10'),
+    ('side', np.int8),              # 1 long, -1 short
+    ('quantity', np.int64),
+    ('entry_time', 'datetime64[s]'),
+    ('entry_price', np.float64),
+    ('exit_time', 'datetime64[s]'),
+    ('exit_price', np.float64),     # the last price if still open
+    ('pnl', np.float64),            # net of commission
+    ('open', bool),
+    ])
+
+DAILY_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('pnl', np.float64),
+    ('equity', np.float64),
+    ])
+
+
+def _carry_forward(values):
+
+    # Forward-fill NaNs along the time axis (leading NaNs stay NaN)
+    timeIdx = np.arange(values.shape[0])[:, np.newaxis]
+    lastValid = np.where(np.isnan(values), 0, timeIdx)
+    np.maximum.accumulate(lastValid, axis=0, out=lastValid)
+
+    return(values[lastValid, np.arange(values.shape[1])[np.newaxis, :]])
+
+
+class BacktestResult:
+
+    def __init__(self, trades, daily, equity):
+
+        self.trades = trades    # TRADE_DTYPE array
+        self.daily = daily      # DAILY_DTYPE array
+        self.equity = equity    # total equity after each period
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict
+            Total P&L, trade count, win rate and maximum drawdown.
+
+        """
+
+        closed = self.trades[~self.trades['open']]
+        drawdown = np.maximum.accumulate(self.equity) - self.equity if len(self.equity) else np.zeros(1)
+
+        return(
+            {
+                'pnl': float(self.daily['pnl'].sum()),
+                'trades': int(len(self.trades)),
+                'win_rate': float((closed['pnl'] > 0).mean()) if len(closed) else float('nan'),
+                'max_drawdown': float(drawdown.max()),
+                }
+            )
+
+
+class Backtest:
+    """ Vectorized backtest of `Analyze` signals over a `history.QuoteHistory`.
+
+    Signals are computed for the whole range at once. A buy (sell) signal
+    opens a long (closes it, or goes short if `allow_short`); a hold keeps
+    the position. Orders fill on the period after the signal (no
+    look-ahead): buys at the ask and sells at the bid, each moved
+    `slippage_bps` against the trade, with `commission` per order. Each
+    position is sized to `position_value` at entry.
+
+    """
+
+    def __init__(
+            self,
+            analyzer,
+            slippage_bps=0.0,
+            commission=0.0,
+            position_value=10000.0,
+            allow_short=False,
+            initial_cash=0.0,
+            ):
+
+        self.analyzer = analyzer
+        self.slippage_bps = slippage_bps
+        self.commission = commission
+        self.position_value = position_value
+        self.allow_short = allow_short
+        self.initial_cash = initial_cash
+
+    def run(self, history):
+        """
+        Returns
+        -------
+        BacktestResult
+
+        """
+
+        if len(history) == 0 or not history.tickers:
+            # Nothing to trade (e.g. no quotes in the range): no trades and
+            # flat equity
+            equity = np.full(len(history), self.initial_cash, dtype=np.float64)
+            return(BacktestResult(np.zeros(0, dtype=TRADE_DTYPE), self._daily(history, equity), equity))
+
+        return(self.simulate(history, self.analyzer.signal_matrix(history.price)))
+
+    def simulate(self, history, signals):
+        """
+        Simulate the fills of a (time x ticker) signal matrix.
+
+        Returns
+        -------
+        BacktestResult
+
+        """
+
+        nTime, nTicker = signals.shape
+        timeIdx = np.arange(nTime)[:, np.newaxis]
+        columns = np.arange(nTicker)[np.newaxis, :]
+
+        ask = _carry_forward(history.ask)
+        bid = _carry_forward(history.bid)
+        last = _carry_forward(history.price)
+
+        # The position follows the last buy/sell signal, and is entered on
+        # the next period
+        lastSignal = np.where(signals != 0, timeIdx, -1)
+        np.maximum.accumulate(lastSignal, axis=0, out=lastSignal)
+        held = np.where(lastSignal >= 0, signals[np.maximum(lastSignal, 0), columns], 0).astype(np.int64)
+        if not self.allow_short:
+            held = np.maximum(held, 0)
+
+        side = np.zeros_like(held)
+        side[1:] = held[:-1]
+        side[np.isnan(ask) | np.isnan(bid)] = 0    # no quote yet
+
+        prevSide = np.zeros_like(side)
+        prevSide[1:] = side[:-1]
+        change = side != prevSide
+
+        slip = self.slippage_bps/1e4
+        fillPrice = np.where(side > prevSide, ask*(1 + slip), bid*(1 - slip))
+
+        # Size at entry, and carry the quantity through the holding
+        entry = change & (side != 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            entryQty = np.where(entry, np.floor(self.position_value/fillPrice), 0)
+        lastEntry = np.where(entry, timeIdx, -1)
+        np.maximum.accumulate(lastEntry, axis=0, out=lastEntry)
+        quantity = np.where(side != 0, entryQty[np.maximum(lastEntry, 0), columns], 0).astype(np.int64)
+        shares = side*quantity
+
+        prevShares = np.zeros_like(shares)
+        prevShares[1:] = shares[:-1]
+
+        # A reversal is two orders (close, then open)
+        orders = (change & (prevSide != 0)).astype(np.int64) + entry.astype(np.int64)
+        cashFlow = np.where(change, -(shares - prevShares)*fillPrice, 0) - self.commission*orders
+
+        markValue = np.where(shares != 0, shares*last, 0)
+        equity = self.initial_cash + (np.cumsum(cashFlow, axis=0) + markValue).sum(axis=1)
+
+        return(
+            BacktestResult(
+                self._trades(history, side, quantity, change, fillPrice, last),
+                self._daily(history, equity),
+                equity,
+                )
+            )
+
+    def _trades(self, history, side, quantity, change, fillPrice, last):
+
+        # Position changes in (ticker, time) order; each change to a non-zero
+        # position opens a trade that ends at the ticker's next change
+        eventCol, eventTime = np.nonzero(change.T)
+        sameNext = np.append(eventCol[1:] == eventCol[:-1], False)
+        starts = np.flatnonzero(side[eventTime, eventCol] != 0)
+
+        col = eventCol[starts]
+        entryTime = eventTime[starts]
+        closed = sameNext[starts]
+        exitTime = np.where(closed, eventTime[np.minimum(starts + 1, len(eventTime) - 1)], len(side) - 1)
+
+        tradeSide = side[entryTime, col]
+        tradeQty = quantity[entryTime, col]
+        entryPrice = fillPrice[entryTime, col]
+        exitPrice = np.where(closed, fillPrice[exitTime, col], last[exitTime, col])
+
+        trades = np.zeros(len(starts), dtype=TRADE_DTYPE)
+        trades['ticker'] = np.asarray(history.tickers, dtype='U10')[col] if len(col) else []
+        trades['side'] = tradeSide
+        trades['quantity'] = tradeQty
+        trades['entry_time'] = history.times[entryTime]
+        trades['entry_price'] = entryPrice
+        trades['exit_time'] = history.times[exitTime]
+        trades['exit_price'] = exitPrice
+        trades['pnl'] = tradeSide*tradeQty*(exitPrice - entryPrice) - self.commission*(1 + closed)
+        trades['open'] = ~closed
+
+        return(trades)
+
+    def _daily(self, history, equity):
+
+        dates = history.times.astype('datetime64[D]')
+        if len(dates) == 0:
+            return(np.zeros(0, dtype=DAILY_DTYPE))
+
+        # The equity at the end of each day
+        dayEnd = np.append(np.flatnonzero(dates[1:] != dates[:-1]), len(dates) - 1)
+
+        daily = np.zeros(len(dayEnd), dtype=DAILY_DTYPE)
+        daily['date'] = dates[dayEnd]
+        daily['equity'] = equity[dayEnd]
+        daily['pnl'] = np.diff(equity[dayEnd], prepend=self.initial_cash)
+
+        return(daily)
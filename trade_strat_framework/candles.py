@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# The `candles` fields, in insert order
+CANDLES_FIELDS = [
+    'ticker',
+    'timeframe_min',
+    'datetime_newyork',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'quote_count',
+    ]
+
+
+class CandleBuilder:
+    """ Streaming OHLCV candle aggregator.
+
+    Keeps the open candle of every ticker for each timeframe (multiples of
+    `period_minutes`) in NumPy arrays, so each quote is an O(1) update and a
+    whole `transform.QuoteBatch` is applied with array operations. Candles
+    are aligned to New York wall-clock time.
+
+    `totalVolume` is the cumulative daily volume, so a candle's volume is the
+    change in `totalVolume` from the end of the previous candle.
+
+    """
+
+    def __init__(self, period_minutes, multiples=(1,), grace_sec=60):
+
+        self.timeframes = sorted({period_minutes*x for x in multiples})
+        self.grace_sec = grace_sec
+
+        self._index = {}    # ticker: row
+        self._symbols = []
+        self._state = {tf: self._new_state(0) for tf in self.timeframes}
+
+        # Quotes that arrived after their candle was finished (counted per
+        # timeframe)
+        self.late_dropped = 0
+
+    @staticmethod
+    def _new_state(size):
+
+        return(
+            {
+                'bucket': np.full(size, -1, dtype=np.int64),
+                'open': np.full(size, np.nan),
+                'high': np.full(size, np.nan),
+                'low': np.full(size, np.nan),
+                'close': np.full(size, np.nan),
+                'vol_start': np.zeros(size, dtype=np.int64),
+                'vol_last': np.full(size, -1, dtype=np.int64),
+                'count': np.zeros(size, dtype=np.int64),
+                }
+            )
+
+    def _rows(self, tickers):
+
+        for ticker in tickers:
+            if ticker not in self._index:
+                self._index[ticker] = len(self._symbols)
+                self._symbols.append(ticker)
+
+        # Grow geometrically
+        size = len(self._state[self.timeframes[0]]['bucket'])
+        if len(self._symbols) > size:
+            allocated = max([len(self._symbols), 2*size])
+            for tf in self.timeframes:
+                grown = self._new_state(allocated)
+                for key, values in self._state[tf].items():
+                    grown[key][:size] = values
+                self._state[tf] = grown
+
+        return(np.fromiter((self._index[x] for x in tickers), dtype=np.int64, count=len(tickers)))
+
+    def update(self, batch, time_correction_sec, initial=False):
+        """
+        Apply a batch of quotes.
+
+        Parameters
+        ----------
+        batch : transform.QuoteBatch
+        time_correction_sec : sequence of int
+            The time correction of each quote (in batch order). A quote that
+            arrived late (positive correction) is placed at its expected
+            time.
+        initial : bool
+            Whether these are `initial` rows (skipped).
+
+        Returns
+        -------
+        list
+            Finished candles, as rows in the order of `CANDLES_FIELDS`.
+
+        """
+
+        if initial or len(batch) == 0:
+            return([])
+
+        rows = self._rows(batch.symbols)
+        localSec = batch.datetime_ny.astype(np.int64)
+        placedSec = localSec - np.maximum(np.asarray(time_correction_sec, dtype=np.int64), 0)
+
+        finished = []
+        for tf in self.timeframes:
+            finished += self._update_timeframe(tf, rows, placedSec, batch.price, batch.volume)
+
+        return(finished)
+
+    def _update_timeframe(self, tf, rows, placedSec, price, volume):
+
+        state = self._state[tf]
+        bucket = placedSec // (tf*60)
+        current = state['bucket'][rows]
+        isOpen = state['count'][rows] > 0
+
+        # Older than the current candle, or for a candle already finished
+        late = (bucket < current) | ((bucket == current) & ~isOpen)
+        self.late_dropped += int(late.sum())
+
+        # A later bucket finishes the open candle and starts a new one
+        roll = bucket > current
+        finished = self._emit(tf, rows[roll & isOpen])
+
+        newRows = rows[roll]
+        newVolume = volume[roll]
+        prevVolume = state['vol_last'][newRows]
+        # Volume is counted from the end of the previous candle. With no
+        # previous quote, count from this quote; after the daily reset,
+        # count from zero
+        state['vol_start'][newRows] = np.where(
+            prevVolume < 0,
+            newVolume,
+            np.where(newVolume < prevVolume, 0, prevVolume),
+            )
+        state['bucket'][newRows] = bucket[roll]
+        for key in ['open', 'high', 'low']:
+            state[key][newRows] = price[roll]
+
+        # Update the open candles
+        use = ~late
+        useRows = rows[use]
+        usePrice = price[use]
+        state['high'][useRows] = np.maximum(state['high'][useRows], usePrice)
+        state['low'][useRows] = np.minimum(state['low'][useRows], usePrice)
+        state['close'][useRows] = usePrice
+        state['vol_last'][useRows] = volume[use]
+        state['count'][useRows] += 1
+
+        return(finished)
+
+    def _emit(self, tf, rows):
+
+        state = self._state[tf]
+        if len(rows) == 0:
+            return([])
+
+        candleDt = (state['bucket'][rows]*tf*60).astype('datetime64[s]').tolist()
+        candleVolume = np.maximum(state['vol_last'][rows] - state['vol_start'][rows], 0)
+        finished = [
+            list(row) for row in zip(
+                [self._symbols[x] for x in rows.tolist()],
+                [tf]*len(rows),
+                candleDt,
+                state['open'][rows].tolist(),
+                state['high'][rows].tolist(),
+                state['low'][rows].tolist(),
+                state['close'][rows].tolist(),
+                candleVolume.tolist(),
+                state['count'][rows].tolist(),
+                )
+            ]
+
+        # Mark as finished (the bucket is kept to reject late quotes)
+        state['count'][rows] = 0
+
+        return(finished)
+
+    def close_due(self, now_local_sec):
+        """
+        Finish every open candle that ended at least `grace_sec` before
+        `now_local_sec` (New York wall-clock epoch seconds, as from
+        `transform.ny_local_seconds`).
+
+        Returns
+        -------
+        list
+            Finished candles, as rows in the order of `CANDLES_FIELDS`.
+
+        """
+
+        finished = []
+        for tf in self.timeframes:
+            state = self._state[tf]
+            size = len(self._symbols)
+            due = (state['count'][:size] > 0) & (
+                (state['bucket'][:size] + 1)*tf*60 + self.grace_sec <= now_local_sec
+                )
+            finished += self._emit(tf, np.flatnonzero(due))
+
+        return(finished)
+
+    def remove_tickers(self, tickers):
+        """
+        Stop building candles for `tickers`, finishing their open candles.
+
+        Returns
+        -------
+        list
+            Finished candles, as rows in the order of `CANDLES_FIELDS`.
+
+        """
+
+        removed = [x for x in dict.fromkeys(tickers) if x in self._index]
+        if not removed:
+            return([])
+
+        rows = np.fromiter((self._index[x] for x in removed), dtype=np.int64, count=len(removed))
+        finished = []
+        for tf in self.timeframes:
+            finished += self._emit(tf, rows[self._state[tf]['count'][rows] > 0])
+
+        removed = set(removed)
+        keep = [x for x in self._symbols if x not in removed]
+        keepRows = np.fromiter((self._index[x] for x in keep), dtype=np.int64, count=len(keep))
+        for tf in self.timeframes:
+            self._state[tf] = {key: values[keepRows] for key, values in self._state[tf].items()}
+        self._symbols = keep
+        self._index = {x: idx for idx, x in enumerate(keep)}
+
+        return(finished)
+
+    def close_all(self):
+        """
+        Finish every open candle (e.g. at the end of a session).
+
+        Returns
+        -------
+        list
+            Finished candles, as rows in the order of `CANDLES_FIELDS`.
+
+        """
+
+        finished = []
+        for tf in self.timeframes:
+            size = len(self._symbols)
+            finished += self._emit(tf, np.flatnonzero(self._state[tf]['count'][:size] > 0))
+
+        return(finished)
+
+
+def downsample(ticker, local_sec, price, volume, timeframe_min):
+    """
+    Roll stored quotes up into candles of `timeframe_min`, the same way
+    `CandleBuilder` builds them: aligned to New York wall-clock time, with
+    the volume counted from the last quote of the previous candle.
+
+    Parameters
+    ----------
+    ticker : numpy.ndarray
+    local_sec : numpy.ndarray
+        New York wall-clock epoch seconds of each quote.
+    price, volume : numpy.ndarray
+        The quotes, sorted by ticker then time.
+
+    Returns
+    -------
+    list
+        Candles, as rows in the order of `CANDLES_FIELDS`.
+
+    """
+
+    if len(ticker) == 0:
+        return([])
+
+    ticker = np.asarray(ticker)
+    volume = np.asarray(volume, dtype=np.int64)
+    bucket = np.asarray(local_sec, dtype=np.int64) // (timeframe_min*60)
+
+    # The first and last quote of each (ticker, bucket) run
+    newTicker = np.append(True, ticker[1:] != ticker[:-1])
+    first = np.flatnonzero(newTicker | np.append(True, bucket[1:] != bucket[:-1]))
+    last = np.append(first[1:], len(ticker)) - 1
+
+    # As in `CandleBuilder`: count from the first quote of the ticker, and
+    # from zero after the daily reset
+    firstVolume = volume[first]
+    prevVolume = volume[np.maximum(first - 1, 0)]
+    volStart = np.where(
+        newTicker[first],
+        firstVolume,
+        np.where(firstVolume < prevVolume, 0, prevVolume),
+        )
+
+    candleDt = (bucket[first]*timeframe_min*60).astype('datetime64[s]').tolist()
+    return(
+        [
+            list(row) for row in zip(
+                ticker[first].tolist(),
+                [timeframe_min]*len(first),
+                candleDt,
+                price[first].tolist(),
+                np.maximum.reduceat(price, first).tolist(),
+                np.minimum.reduceat(price, first).tolist(),
+                price[last].tolist(),
+                np.maximum(volume[last] - volStart, 0).tolist(),
+                (last - first + 1).tolist(),
+                )
+            ]
+        )
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import zipfile
+
+import numpy as np
+
+from .state import TickerState
+
+CHECKPOINT_VERSION = 1
+
+
+class LoopCheckpoint:
+    """ Checkpoint of the quote loop's per-ticker state on local disk.
+
+    Holds what the loop needs to carry on after a restart as if it hadn't
+    stopped: the columns of its `state.TickerState`, each ticker's next
+    deadline (as wall-clock epoch seconds, since monotonic time doesn't
+    survive a restart) and the adapted batch size. The state is written as
+    one uncompressed .npz (a few milliseconds for thousands of tickers) to a
+    temporary file that replaces the checkpoint, so a crash mid-write
+    leaves the previous checkpoint intact.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+    period_minutes : int
+        The loop's period. A checkpoint from a different period is ignored.
+    max_late_sec : float, optional
+        Tickers whose deadline passed more than this long ago aren't resumed
+        (default half a period: the time correction of a later read would
+        throw off their cadence, so they need a fresh initial read).
+
+    """
+
+    def __init__(self, path, period_minutes, max_late_sec=None):
+
+        self.path = str(path)
+        self.period_minutes = period_minutes
+        self.max_late_sec = period_minutes*30 if max_late_sec is None else max_late_sec
+
+    def save(self, tickerList, deadlines, batch_size, now_sec=None):
+        """
+        Parameters
+        ----------
+        tickerList : state.TickerState
+            The loop's per-ticker state.
+        deadlines : dict
+            Ticker: next run (wall-clock epoch seconds).
+        batch_size : int
+            The batch planner's current batch size.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        tickers = tickerList.tickers
+
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            np.savez(
+                f,
+                version=CHECKPOINT_VERSION,
+                saved_sec=time.time() if now_sec is None else now_sec,
+                period_minutes=self.period_minutes,
+                batch_size=batch_size,
+                tickers=np.array(tickers, dtype=str),
+                deadline_sec=np.fromiter((deadlines.get(x, np.nan) for x in tickers), dtype=np.float64, count=len(tickers)),
+                **tickerList.columns(),
+                )
+        os.replace(tmpPath, self.path)
+
+    def load(self, now_sec=None):
+        """
+        Returns
+        -------
+        dict or None
+            'saved_sec', 'batch_size', 'tickerList' (a `state.TickerState`)
+            and 'deadlines' (ticker: wall-clock epoch seconds, of the
+            tickers that were scheduled and are at most `max_late_sec`
+            late), or None if there is no usable checkpoint (missing,
+            unreadable or from another period).
+
+        """
+
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                data = {key: data[key] for key in data.files}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return(None)
+
+        if int(data.get('version', -1)) != CHECKPOINT_VERSION or int(data['period_minutes']) != self.period_minutes:
+            return(None)
+        earliestSec = (time.time() if now_sec is None else now_sec) - self.max_late_sec
+
+        tickers = data['tickers'].tolist()
+        deadlines = {
+            ticker: deadline for ticker, deadline in zip(tickers, data['deadline_sec'].tolist())
+            if deadline >= earliestSec
+            }
+
+        return(
+            {
+                'saved_sec': float(data['saved_sec']),
+                'batch_size': int(data['batch_size']),
+                'tickerList': TickerState.from_columns(tickers, data),
+                'deadlines': deadlines,
+                }
+            )
+
+    def clear(self):
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import re
+
+import numpy as np
+import pendulum
+
+
+class QuoteHistory:
+    """ Quotes for a set of tickers aligned on a (time x ticker) grid.
+
+    `times` are the start of each period (naive New York datetime64[s]), and
+    each field is a (time x ticker) float array holding the last quote of the
+    period (NaN where a ticker has no quote).
+
+    """
+
+    def __init__(self, tickers, times, price, ask, bid, volume):
+
+        self.tickers = list(tickers)
+        self.times = times
+        self.price = price
+        self.ask = ask
+        self.bid = bid
+        self.volume = volume
+
+    def __len__(self):
+        return(len(self.times))
+
+    @classmethod
+    def from_columns(cls, ticker, datetime_ny, price, ask, bid, volume, period_minutes, tickers=None):
+        """
+        Pivot columnar quotes onto the (time x ticker) grid.
+
+        Parameters
+        ----------
+        ticker : sequence of str
+        datetime_ny : numpy.ndarray
+            datetime64 New York times.
+        price, ask, bid, volume : numpy.ndarray
+        period_minutes : int
+            The grid spacing. Quotes are assigned to the period they fall in
+            (the last one wins).
+        tickers : list, optional
+            The column order (default sorted).
+
+        Returns
+        -------
+        QuoteHistory
+
+        """
+
+        ticker = np.asarray(ticker)
+        if tickers is None:
+            tickers = sorted(set(ticker.tolist()))
+        column = {x: idx for idx, x in enumerate(tickers)}
+
+        # Keep the quotes of the requested tickers
+        colIdx = np.fromiter((column.get(x, -1) for x in ticker.tolist()), dtype=np.int64, count=len(ticker))
+        keep = colIdx >= 0
+        periodSec = period_minutes*60
+        bucket = np.asarray(datetime_ny, dtype='datetime64[s]').astype(np.int64)[keep] // periodSec
+        colIdx = colIdx[keep]
+
+        times, rowIdx = np.unique(bucket, return_inverse=True)
+
+        # Keep the last quote of each ticker in each period
+        order = np.argsort(np.asarray(datetime_ny, dtype='datetime64[s]')[keep], kind='stable')
+        cell = (rowIdx.reshape(-1)*len(tickers) + colIdx)[order]
+        _, lastIdx = np.unique(cell[::-1], return_index=True)
+        use = order[len(cell) - 1 - lastIdx]
+        rowIdx = rowIdx.reshape(-1)[use]
+        colIdx = colIdx[use]
+
+        matrices = []
+        for values in [price, ask, bid, volume]:
+            matrix = np.full((len(times), len(tickers)), np.nan)
+            matrix[rowIdx, colIdx] = np.asarray(values, dtype=np.float64)[keep][use]
+            matrices.append(matrix)
+
+        return(cls(tickers, (times*periodSec).astype('datetime64[s]'), *matrices))
+
+    def resample(self, period_minutes):
+        """
+        Re-grid onto a coarser `period_minutes` (a multiple of the current
+        spacing), keeping the last quote of each ticker in each period.
+
+        Returns
+        -------
+        QuoteHistory
+
+        """
+
+        periodSec = period_minutes*60
+        bucket = self.times.astype(np.int64) // periodSec
+        if len(bucket) == 0:
+            return(self)
+
+        # The last row of each new period, and the last row of each column
+        # holding a quote up to there
+        periodEnd = np.append(np.flatnonzero(bucket[1:] != bucket[:-1]), len(bucket) - 1)
+        periodStart = np.insert(periodEnd[:-1] + 1, 0, 0)
+        timeIdx = np.arange(len(self.times))[:, np.newaxis]
+        columns = np.arange(len(self.tickers))[np.newaxis, :]
+        lastValid = np.where(np.isnan(self.price), -1, timeIdx)
+        np.maximum.accumulate(lastValid, axis=0, out=lastValid)
+        lastValid = lastValid[periodEnd]
+        inPeriod = lastValid >= periodStart[:, np.newaxis]
+        rows = np.maximum(lastValid, 0)
+
+        matrices = [
+            np.where(inPeriod, values[rows, columns], np.nan)
+            for values in [self.price, self.ask, self.bid, self.volume]
+            ]
+
+        return(QuoteHistory(self.tickers, (bucket[periodEnd]*periodSec).astype('datetime64[s]'), *matrices))
+
+    def select(self, tickers):
+        """
+        Returns
+        -------
+        QuoteHistory
+            The columns of `tickers` only.
+
+        """
+
+        column = {x: idx for idx, x in enumerate(self.tickers)}
+        cols = [column[x] for x in tickers]
+
+        return(
+            QuoteHistory(
+                tickers,
+                self.times,
+                *[values[:, cols] for values in [self.price, self.ask, self.bid, self.volume]],
+                )
+            )
+
+
+# A ticker symbol (e.g. 'AAPL', 'BRK.B', 'BF/B', '$SPX.X', '^VIX')
+TICKER_PATTERN = re.compile(r'^[A-Z0-9./$^-]+$')
+
+
+def ticker_list(tickers):
+    """
+    `tickers` as an SQL list of strings (e.g. "'AAPL', 'BRK.B'"). Queries
+    are built as strings, so only symbols matching `TICKER_PATTERN` (none
+    of which need escaping) are accepted.
+
+    Returns
+    -------
+    str
+
+    """
+
+    invalid = [x for x in tickers if not isinstance(x, str) or not TICKER_PATTERN.match(x)]
+    if invalid:
+        raise ValueError('Invalid ticker symbols: {}'.format(', '.join(repr(x) for x in invalid)))
+
+    return(', '.join("'{}'".format(x) for x in tickers))
+
+
+def range_predicate(start, end, column='datetime_newyork'):
+    """
+    The SQL condition `start` <= `column` < `end` (New York times). It's
+    written on the bare column, so MySQL reads only the date partitions the
+    range overlaps (a function applied to the column would read them all).
+
+    Returns
+    -------
+    str
+
+    """
+
+    return(
+        "`{column}` >= '{start}' AND `{column}` < '{end}'".format(
+            column=column,
+            start=pendulum.parse(str(start)).format('YYYY-MM-DD HH:mm:ss'),
+            end=pendulum.parse(str(end)).format('YYYY-MM-DD HH:mm:ss'),
+            )
+        )
+
+
+def lookback_start(lookback, period_minutes, end=None):
+    """
+    A New York time far enough before `end` (by default now) to hold the
+    last `lookback` periods of quotes, so a query for them can be bounded
+    to the partitions since. Periods are counted in regular sessions
+    (6.5 hours a day, five days a week), with a few days to spare for
+    holidays.
+
+    Returns
+    -------
+    pendulum.DateTime
+
+    """
+
+    end = pendulum.now('America/New_York') if end is None else pendulum.parse(str(end), tz='America/New_York')
+    tradingDays = math.ceil(lookback*period_minutes/390) + 1
+
+    return(end.subtract(days=tradingDays*7//5 + 4).start_of('day'))
+
+
+def explain_partitions(conn, sql):
+    """
+    The partitions MySQL reads to run the SELECT `sql` (from `EXPLAIN`), to
+    check that a query is pruned.
+
+    Returns
+    -------
+    list
+
+    """
+
+    # `partitions` is the fourth column of EXPLAIN's (traditional) output
+    names = []
+    for row in conn.query('EXPLAIN ' + sql):
+        if row[3]:
+            names += [x for x in row[3].split(',') if x not in names]
+
+    return(names)
+
+
+def load_quotes(conn, tickers, start, end, period_minutes):
+    """
+    Load the `quotes` of `tickers` between `start` (inclusive) and `end`
+    (exclusive) in a single query, which reads only the date partitions of
+    that range. `initial` rows are skipped.
+
+    Parameters
+    ----------
+    conn : coftc_db_utils.Conn
+    tickers : list
+    start, end : str or datetime
+        New York times.
+    period_minutes : int
+        The grid spacing of the result.
+
+    Returns
+    -------
+    QuoteHistory
+
+    """
+
+    # Return the datetime as (naive) epoch seconds and the decimals as
+    # doubles, so the columns convert to arrays without per-value parsing
+    rows = conn.query(
+        "SELECT `ticker`, TIMESTAMPDIFF(SECOND, '1970-01-01', `datetime_newyork`), "
+        "`price` + 0e0, `ask` + 0e0, `bid` + 0e0, `volume` "
+        "FROM `quotes` WHERE `initial` = 0 AND `ticker` IN ({tickers}) AND {dates}".format(
+            tickers=ticker_list(tickers),
+            dates=range_predicate(start, end),
+            )
+        )
+
+    # Split the rows into columns in one pass
+    if rows:
+        ticker, epochSec, price, ask, bid, volume = zip(*rows)
+    else:
+        ticker, epochSec, price, ask, bid, volume = [()]*6
+
+    return(
+        QuoteHistory.from_columns(
+            ticker,
+            np.array(epochSec, dtype=np.int64).astype('datetime64[s]'),
+            np.array(price, dtype=np.float64),
+            np.array(ask, dtype=np.float64),
+            np.array(bid, dtype=np.float64),
+            np.array(volume, dtype=np.float64),
+            period_minutes,
+            tickers=list(tickers),
+            )
+        )
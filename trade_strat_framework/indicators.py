@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import abc
+from collections import deque
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def ema_filter(values, alpha, init):
+    """
+    Apply y[j] = y[j-1] + alpha*(values[j] - y[j-1]) with y[-1] = `init`
+    along the first axis, without a Python loop over the values.
+
+    Within a block of length k the recursion has the closed form
+    y[j] = r**(j+1)*init + alpha*sum(r**(j-i)*values[i]), r = 1 - alpha, which
+    is evaluated with a cumulative sum. Blocks are kept short enough that
+    r**-k can't overflow.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        1D, or 2D (time x series).
+    alpha : float
+    init : float or numpy.ndarray
+        The value before the first (one per series for 2D values).
+
+    Returns
+    -------
+    numpy.ndarray
+
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    if len(values) == 0:
+        return(out)
+
+    decay = 1 - alpha
+    if decay <= 0:
+        out[:] = values
+        return(out)
+
+    blockLen = max([1, int(150/-math.log10(decay))]) if decay < 1 else len(values)
+    powers = decay**np.arange(1, min([blockLen, len(values)]) + 1)
+    powers = powers.reshape((-1,) + (1,)*(values.ndim - 1))
+
+    last = init
+    for start in range(0, len(values), blockLen):
+        block = values[start:start+blockLen]
+        p = powers[:len(block)]
+        out[start:start+len(block)] = p*(last + alpha*np.cumsum(block/p, axis=0))
+        last = out[start+len(block)-1]
+
+    return(out)
+
+
+def field_name(name, field):
+    """
+    The output name of an indicator field: `name` for a field with the same
+    name as the indicator (e.g. 'rsi'), otherwise '<name>_<field>' (e.g.
+    'macd_histogram').
+
+    """
+
+    return(name if field == name else '{}_{}'.format(name, field))
+
+
+class Indicator(abc.ABC):
+    """ Base class for streaming indicators.
+
+    `update` applies one value in constant time. `backfill` applies a whole
+    history with array operations and leaves the indicator in the same state
+    as the equivalent `update` calls would (it's only vectorized on a fresh
+    indicator; otherwise it falls back to `update`). `compute` is the
+    stateless vectorized calculation, over one series or many (time x
+    series) at once.
+
+    All of them return every field in `fields` (NaN until the indicator has
+    enough history).
+
+    """
+
+    fields = ()
+
+    def __init__(self):
+        self.count = 0
+
+    @property
+    @abc.abstractmethod
+    def lookback(self):
+        # The number of values needed before the first output
+        pass
+
+    @abc.abstractmethod
+    def update(self, value):
+        pass
+
+    @abc.abstractmethod
+    def compute(self, values):
+        """
+        Parameters
+        ----------
+        values : numpy.ndarray
+            1D, or 2D (time x series) with the series in columns.
+
+        Returns
+        -------
+        list
+            One array per field, each shaped like `values`.
+
+        """
+
+    def backfill(self, values):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            (len(values) x len(fields)) outputs.
+
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        if self.count:
+            return(np.array([self.update(x) for x in values], dtype=np.float64).reshape(len(values), len(self.fields)))
+
+        out = np.stack(self.compute(values), axis=1)
+        self._set_state(values, out)
+        self.count = len(values)
+
+        return(out)
+
+    @abc.abstractmethod
+    def _set_state(self, values, out):
+        # Set the streaming state as if `values` had been applied by `update`
+        pass
+
+
+class SMA(Indicator):
+
+    fields = ('sma',)
+
+    def __init__(self, window=20):
+
+        super().__init__()
+        self.window = window
+        self._buffer = deque(maxlen=window)
+        self._total = 0.0
+
+    @property
+    def lookback(self):
+        return(self.window)
+
+    def update(self, value):
+
+        self.count += 1
+        if len(self._buffer) == self.window:
+            self._total -= self._buffer[0]
+        self._buffer.append(value)
+        self._total += value
+
+        # Resum once per window (amortized O(1)) to stop rounding drift
+        if self.count % self.window == 0:
+            self._total = math.fsum(self._buffer)
+
+        if len(self._buffer) < self.window:
+            return((math.nan,))
+
+        return((self._total/self.window,))
+
+    def compute(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(values.shape, np.nan)
+        if len(values) >= self.window:
+            out[self.window-1:] = sliding_window_view(values, self.window, axis=0).mean(axis=-1)
+
+        return([out])
+
+    def _set_state(self, values, out):
+
+        self._buffer.extend(values[-self.window:].tolist())
+        self._total = math.fsum(self._buffer)
+
+
+class EMA(Indicator):
+    """ Exponential moving average (alpha = 2/(window+1)), seeded with the
+    simple average of the first `window` values.
+
+    """
+
+    fields = ('ema',)
+
+    def __init__(self, window=20):
+
+        super().__init__()
+        self.window = window
+        self.alpha = 2/(window + 1)
+        self.value = math.nan
+        self._seed = 0.0
+
+    @property
+    def lookback(self):
+        return(self.window)
+
+    def update(self, value):
+
+        self.count += 1
+        if self.count < self.window:
+            self._seed += value
+        elif self.count == self.window:
+            self.value = (self._seed + value)/self.window
+        else:
+            self.value += self.alpha*(value - self.value)
+
+        return((self.value,))
+
+    def compute(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(values.shape, np.nan)
+        if len(values) >= self.window:
+            seed = values[:self.window].mean(axis=0)
+            out[self.window-1] = seed
+            out[self.window:] = ema_filter(values[self.window:], self.alpha, seed)
+
+        return([out])
+
+    def _set_state(self, values, out):
+
+        if len(values) < self.window:
+            self._seed = float(values.sum())
+        else:
+            self.value = float(out[-1, 0])
+
+
+class RSI(Indicator):
+    """ Wilder's relative strength index.
+
+    """
+
+    fields = ('rsi',)
+
+    def __init__(self, window=14):
+
+        super().__init__()
+        self.window = window
+        self._prev = math.nan
+        self._gain = 0.0
+        self._loss = 0.0
+
+    @property
+    def lookback(self):
+        return(self.window + 1)
+
+    @staticmethod
+    def _rsi(gain, loss):
+
+        # 100 - 100/(1 + gain/loss), without dividing by a zero loss
+        total = gain + loss
+        return(50.0 if total == 0 else 100*gain/total)
+
+    def update(self, value):
+
+        self.count += 1
+        prev, self._prev = self._prev, value
+        if self.count == 1:
+            return((math.nan,))
+
+        change = value - prev
+        gain = max([change, 0.0])
+        loss = max([-change, 0.0])
+
+        # The first average is the simple average of `window` changes
+        changes = self.count - 1
+        if changes <= self.window:
+            self._gain += gain
+            self._loss += loss
+            if changes < self.window:
+                return((math.nan,))
+            self._gain /= self.window
+            self._loss /= self.window
+        else:
+            self._gain += (gain - self._gain)/self.window
+            self._loss += (loss - self._loss)/self.window
+
+        return((self._rsi(self._gain, self._loss),))
+
+    def _averages(self, values):
+
+        # Wilder's average gain and loss after each change (the first is
+        # the simple average of `window` changes)
+        changes = np.diff(values, axis=0)
+        gains = np.maximum(changes, 0)
+        losses = np.maximum(-changes, 0)
+        if len(changes) < self.window:
+            return(gains, losses, None, None)
+
+        avgGain = np.concatenate([
+            gains[:self.window].mean(axis=0)[np.newaxis],
+            ema_filter(gains[self.window:], 1/self.window, gains[:self.window].mean(axis=0)),
+            ])
+        avgLoss = np.concatenate([
+            losses[:self.window].mean(axis=0)[np.newaxis],
+            ema_filter(losses[self.window:], 1/self.window, losses[:self.window].mean(axis=0)),
+            ])
+
+        return(gains, losses, avgGain, avgLoss)
+
+    def compute(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(values.shape, np.nan)
+        _, _, avgGain, avgLoss = self._averages(values)
+        if avgGain is not None:
+            total = avgGain + avgLoss
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[self.window:] = np.where(total == 0, 50.0, 100*avgGain/total)
+
+        return([out])
+
+    def _set_state(self, values, out):
+
+        if len(values) == 0:
+            return
+
+        self._prev = float(values[-1])
+        gains, losses, avgGain, avgLoss = self._averages(values)
+        if avgGain is None:
+            self._gain = float(gains.sum())
+            self._loss = float(losses.sum())
+        else:
+            self._gain = float(avgGain[-1])
+            self._loss = float(avgLoss[-1])
+
+
+class MACD(Indicator):
+
+    fields = ('macd', 'signal_line', 'histogram')
+
+    def __init__(self, fast=12, slow=26, signal=9):
+
+        super().__init__()
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._signal = EMA(signal)
+
+    @property
+    def lookback(self):
+        return(max([self._fast.window, self._slow.window]) + self._signal.window - 1)
+
+    def update(self, value):
+
+        self.count += 1
+        fast = self._fast.update(value)[0]
+        slow = self._slow.update(value)[0]
+        if math.isnan(fast) or math.isnan(slow):
+            return((math.nan, math.nan, math.nan))
+
+        macd = fast - slow
+        signal = self._signal.update(macd)[0]
+
+        return((macd, signal, macd - signal))
+
+    def compute(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        macd = self._fast.compute(values)[0] - self._slow.compute(values)[0]
+
+        signal = np.full(values.shape, np.nan)
+        start = max([self._fast.window, self._slow.window]) - 1
+        if len(values) > start:
+            signal[start:] = self._signal.compute(macd[start:])[0]
+
+        return([macd, signal, macd - signal])
+
+    def _set_state(self, values, out):
+
+        for ema in [self._fast, self._slow]:
+            ema.backfill(values)
+
+        start = max([self._fast.window, self._slow.window]) - 1
+        if len(values) > start:
+            self._signal.backfill(out[start:, 0])
+
+
+class Bollinger(Indicator):
+    """ Bollinger bands: the simple moving average -/+ `width` population
+    standard deviations.
+
+    """
+
+    fields = ('middle', 'upper', 'lower')
+
+    def __init__(self, window=20, width=2):
+
+        super().__init__()
+        self.window = window
+        self.width = width
+        self._buffer = deque(maxlen=window)
+        self._mean = 0.0
+        self._m2 = 0.0      # sum of squared deviations from the mean
+
+    @property
+    def lookback(self):
+        return(self.window)
+
+    def _resum(self):
+
+        self._mean = math.fsum(self._buffer)/len(self._buffer)
+        self._m2 = math.fsum((x - self._mean)**2 for x in self._buffer)
+
+    def update(self, value):
+
+        self.count += 1
+        if len(self._buffer) < self.window:
+            # Welford's update while filling the window
+            self._buffer.append(value)
+            delta = value - self._mean
+            self._mean += delta/len(self._buffer)
+            self._m2 += delta*(value - self._mean)
+        else:
+            # Replace the oldest value
+            old = self._buffer[0]
+            self._buffer.append(value)
+            prevMean = self._mean
+            self._mean += (value - old)/self.window
+            self._m2 += (value - old)*(value - self._mean + old - prevMean)
+
+        # Resum once per window (amortized O(1)) to stop rounding drift
+        if self.count % self.window == 0:
+            self._resum()
+
+        if len(self._buffer) < self.window:
+            return((math.nan, math.nan, math.nan))
+
+        std = math.sqrt(max([self._m2/self.window, 0.0]))
+
+        return((self._mean, self._mean + self.width*std, self._mean - self.width*std))
+
+    def compute(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        out = [np.full(values.shape, np.nan) for _ in self.fields]
+        if len(values) >= self.window:
+            windows = sliding_window_view(values, self.window, axis=0)
+            mean = windows.mean(axis=-1)
+            std = windows.std(axis=-1)
+            out[0][self.window-1:] = mean
+            out[1][self.window-1:] = mean + self.width*std
+            out[2][self.window-1:] = mean - self.width*std
+
+        return(out)
+
+    def _set_state(self, values, out):
+
+        self._buffer.extend(values[-self.window:].tolist())
+        if self._buffer:
+            self._resum()
+
+
+class IndicatorEngine:
+    """ A set of named indicators per ticker.
+
+    Parameters
+    ----------
+    factories : dict
+        Name: callable returning a new `Indicator` (e.g.
+        `{'rsi': lambda: RSI(14)}`).
+
+    """
+
+    def __init__(self, factories):
+
+        self.factories = dict(factories)
+        self._indicators = {}   # ticker: {name: Indicator}
+
+    def _get(self, ticker):
+
+        if ticker not in self._indicators:
+            self._indicators[ticker] = {name: factory() for name, factory in self.factories.items()}
+
+        return(self._indicators[ticker])
+
+    def remove(self, ticker):
+        self._indicators.pop(ticker, None)
+
+    def update(self, ticker, value):
+        """
+        Apply one new value (quote price or candle close) for `ticker`.
+
+        Returns
+        -------
+        dict
+            Output name (see `field_name`): latest value.
+
+        """
+
+        out = {}
+        for name, indicator in self._get(ticker).items():
+            for field, result in zip(indicator.fields, indicator.update(float(value))):
+                out[field_name(name, field)] = result
+
+        return(out)
+
+    def update_batch(self, tickers, values):
+        """
+        Apply one new value for each ticker.
+
+        Returns
+        -------
+        dict
+            Ticker: the output of `update`.
+
+        """
+
+        return({ticker: self.update(ticker, value) for ticker, value in zip(tickers, values)})
+
+    def backfill(self, ticker, values):
+        """
+        Warm the indicators of `ticker` from its history (oldest first).
+
+        Returns
+        -------
+        dict
+            Output name (see `field_name`): array of outputs for every
+            value.
+
+        """
+
+        out = {}
+        for name, indicator in self._get(ticker).items():
+            result = indicator.backfill(values)
+            for idx, field in enumerate(indicator.fields):
+                out[field_name(name, field)] = result[:, idx]
+
+        return(out)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import importlib.resources
+import json
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pendulum
+
+DAY_SEC = 86400
+
+
+def _hour_minute(hhmm):
+
+    hour, minute = hhmm.split(':')
+    return((int(hour), int(minute)))
+
+
+def _noon_offsets(localMidnight, timezone):
+
+    # The UTC offset (seconds) at noon of each day. Offsets change only a
+    # few times a year, so they're looked up four weeks apart, and day by
+    # day only between lookups that differ
+    def offset(idx):
+        day = datetime.date(1970, 1, 1) + datetime.timedelta(seconds=int(localMidnight[idx]))
+        return(pendulum.datetime(day.year, day.month, day.day, 12, tz=timezone).offset)
+
+    offsets = np.empty(len(localMidnight), dtype=np.int64)
+    samples = list(range(0, len(localMidnight), 28)) + [len(localMidnight) - 1]
+    offsets[samples] = [offset(x) for x in samples]
+    for start, end in zip(samples[:-1], samples[1:]):
+        if offsets[start] == offsets[end]:
+            offsets[start:end] = offsets[start]
+        else:
+            offsets[start + 1:end] = [offset(x) for x in range(start + 1, end)]
+
+    return(offsets)
+
+
+class MarketCalendar:
+    """ The market's trading sessions, precomputed for every day in a range.
+
+    Built once from a calendar spec (see `resources/market_calendar.json`:
+    session hours, holidays and early closes over a range of days) into
+    per-day arrays of the session open and close (UTC epoch seconds) and
+    the next trading day, so `is_open` and `next_open` are a few array
+    reads, however long the range. Times outside the range count as open,
+    since the calendar says nothing about them (see `covers`).
+
+    Parameters
+    ----------
+    spec : dict
+        The parsed calendar file.
+    session : str
+        'regular', or 'extended' (pre-market and after hours as well).
+
+    """
+
+    def __init__(self, spec, session='regular'):
+
+        if session not in spec['sessions']:
+            raise ValueError("Unknown session '{}' (the calendar has {})".format(session, ', '.join(spec['sessions'])))
+
+        self.session = session
+        self.timezone = spec['timezone']
+        self.holidays = dict(spec['holidays'])
+        self.early_closes = dict(spec['early_closes'])
+
+        openAt, closeAt = [_hour_minute(x) for x in spec['sessions'][session]]
+        earlyCloseAt = _hour_minute(spec['early_close'][session])
+        days = np.arange(
+            np.datetime64(spec['first_day'], 'D'),
+            np.datetime64(spec['last_day'], 'D') + np.timedelta64(2, 'D'),
+            )
+
+        # Local midnight of each day (and of the day after the last), as
+        # UTC epoch seconds. The noon offset is used for the whole day: on a
+        # DST change, midnight is an hour out, but no session is near it
+        localMidnight = days.astype('datetime64[s]').astype(np.int64)
+        offsets = _noon_offsets(localMidnight, self.timezone)
+        self._dayStart = localMidnight - offsets
+
+        # Each day's session (open == close == 0 when closed)
+        dayNames = days[:-1].astype(str)
+        trading = (
+            ((days[:-1].astype(np.int64) + 3) % 7 < 5)      # Monday to Friday (1970-01-01 was a Thursday)
+            & ~np.isin(dayNames, list(self.holidays))
+            )
+        closeSec = np.where(
+            np.isin(dayNames, list(self.early_closes)),
+            earlyCloseAt[0]*3600 + earlyCloseAt[1]*60,
+            closeAt[0]*3600 + closeAt[1]*60,
+            )
+        self._open = np.where(trading, self._dayStart[:-1] + openAt[0]*3600 + openAt[1]*60, 0)
+        self._close = np.where(trading, self._dayStart[:-1] + closeSec, 0)
+
+        # The first trading day on or after each day (the day count if none)
+        dayCount = len(self._open)
+        self._nextTradingDay = np.full(dayCount + 1, dayCount, dtype=np.int64)
+        for idx in range(dayCount - 1, -1, -1):
+            self._nextTradingDay[idx] = idx if trading[idx] else self._nextTradingDay[idx + 1]
+
+    @property
+    def first_sec(self):
+        return(int(self._dayStart[0]))
+
+    @property
+    def last_sec(self):
+        return(int(self._dayStart[-1]))
+
+    def covers(self, sec):
+        return(self._dayStart[0] <= sec < self._dayStart[-1])
+
+    def _day(self, sec):
+
+        # Days are 23 or 25 hours long on DST changes, which shifts the
+        # estimate by at most one day
+        idx = int((sec - self._dayStart[0])//DAY_SEC)
+        if sec >= self._dayStart[idx + 1]:
+            idx += 1
+        elif sec < self._dayStart[idx]:
+            idx -= 1
+
+        return(idx)
+
+    def is_open(self, sec):
+        """
+        Returns
+        -------
+        bool
+            Whether the market is open at `sec` (UTC epoch seconds).
+
+        """
+
+        if not self.covers(sec):
+            return(True)
+
+        idx = self._day(sec)
+        return(bool(self._open[idx] <= sec < self._close[idx]))
+
+    def next_open(self, sec):
+        """
+        Returns
+        -------
+        float
+            The first time at or after `sec` (UTC epoch seconds) that the
+            market is open: `sec` itself if it's open then.
+
+        """
+
+        if not self.covers(sec):
+            return(float(sec))
+
+        idx = self._day(sec)
+        if sec < self._close[idx]:
+            return(float(max([sec, self._open[idx]])))
+
+        nextIdx = self._nextTradingDay[idx + 1]
+        if nextIdx == len(self._open):
+            return(float(self._dayStart[-1]))
+
+        return(float(self._open[nextIdx]))
+
+
+@lru_cache(maxsize=None)
+def load_calendar(path=None, session='regular'):
+    """
+    The calendar in `path` (by default the bundled
+    `resources/market_calendar.json`), loaded once per path and session.
+
+    Returns
+    -------
+    MarketCalendar
+
+    """
+
+    if path is None:
+        path = importlib.resources.files('trade_strat_framework') / 'resources' / 'market_calendar.json'
+
+    return(MarketCalendar(json.loads(Path(path).read_text() if isinstance(path, str) else path.read_text()), session))
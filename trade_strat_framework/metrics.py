@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class Histogram:
+    """ Log-bucketed histogram of non-negative values (e.g. seconds).
+
+    Buckets are `per_octave` per power of two between 2**`min_exp` and
+    2**`max_exp` (about 9% wide by default), so recording is a log and an
+    increment, and quantiles are accurate to a bucket. Each histogram should
+    be recorded from one thread.
+
+    """
+
+    def __init__(self, per_octave=8, min_exp=-20, max_exp=20):
+
+        self.per_octave = per_octave
+        self.min_exp = min_exp
+        self.max_exp = max_exp
+        self._offset = -min_exp*per_octave + 1
+        self._lowest = 2.0**min_exp
+
+        # Bucket 0 holds values below 2**min_exp (including 0), the last
+        # values from 2**max_exp up. A list, as single increments are
+        # faster than on an array
+        self._last = (max_exp - min_exp)*per_octave + 1
+        self._counts = [0]*(self._last + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+
+        value = abs(value)
+        if value < self._lowest:
+            idx = 0
+        else:
+            idx = int(math.log2(value)*self.per_octave) + self._offset
+            if idx > self._last:
+                idx = self._last
+        self._counts[idx] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def observe_many(self, values):
+
+        values = np.abs(np.asarray(values, dtype=np.float64))
+        if len(values) == 0:
+            return
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            buckets = np.floor(np.log2(values)*self.per_octave).astype(np.int64) + self._offset
+        buckets = np.where(values < self._lowest, 0, np.clip(buckets, 1, self._last))
+        self._counts = (np.asarray(self._counts) + np.bincount(buckets, minlength=len(self._counts))).tolist()
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.max = max([self.max, float(values.max())])
+
+    def quantile(self, q):
+        """
+        Returns
+        -------
+        float
+            The (geometric) middle of the bucket holding quantile `q` (0 if
+            empty).
+
+        """
+
+        if self.count == 0:
+            return(0.0)
+
+        idx = int(np.searchsorted(np.cumsum(self._counts), q*self.count, side='left'))
+        if idx == 0:
+            return(min([self.max, self._lowest]))
+
+        return(min([self.max, 2.0**((idx - self._offset + 0.5)/self.per_octave)]))
+
+
+class Metrics:
+    """ Low-overhead instrumentation of the quote loop.
+
+    Holds named histograms and counters, the latest value per ticker of
+    per-ticker measures (e.g. time correction drift), and the stage each
+    thread is in (see `stage`, read by `SamplingProfiler`). The metrics can
+    be printed with `summary` or served over HTTP with `serve`.
+
+    """
+
+    def __init__(self):
+
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.per_ticker = {}    # name: {ticker: value}
+        self.started = time.time()
+
+        self._stage = {}    # thread id: stage name
+
+    def histogram(self, name):
+
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+
+        return(self.histograms[name])
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def observe_many(self, name, values):
+        self.histogram(name).observe_many(values)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def set_per_ticker(self, name, tickers, values):
+
+        self.per_ticker.setdefault(name, {}).update(zip(tickers, values))
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the block into the `<name>_sec` histogram, and mark the thread
+        as in stage `name` while it runs.
+
+        """
+
+        threadId = threading.get_ident()
+        previous = self._stage.get(threadId)
+        self._stage[threadId] = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name + '_sec').observe(time.perf_counter() - start)
+            self._stage[threadId] = previous
+
+    def current_stage(self, thread_id):
+        return(self._stage.get(thread_id))
+
+    def summary(self, top=5):
+        """
+        Returns
+        -------
+        str
+            Counts and p50/p90/p99/max of every histogram, the counters, and
+            the tickers with the largest per-ticker values.
+
+        """
+
+        lines = ['Metrics over {:.0f} sec'.format(time.time() - self.started)]
+        for name, hist in sorted(self.histograms.items()):
+            lines.append(
+                '  {:<28} n={:<8} p50={:<10.4g} p90={:<10.4g} p99={:<10.4g} max={:.4g}'.format(
+                    name, hist.count, hist.quantile(0.5), hist.quantile(0.9), hist.quantile(0.99), hist.max,
+                    )
+                )
+        for name, value in sorted(self.counters.items()):
+            lines.append('  {:<28} {}'.format(name, value))
+        for name, values in sorted(self.per_ticker.items()):
+            worst = sorted(values.items(), key=lambda x: -abs(x[1]))[:top]
+            lines.append('  {:<28} {}'.format(name, ', '.join('{} {:.4g}'.format(*x) for x in worst)))
+
+        return('\n'.join(lines))
+
+    def prometheus(self):
+        """
+        Returns
+        -------
+        str
+            The metrics in the Prometheus text format (histograms as
+            summaries with 0.5, 0.9 and 0.99 quantiles).
+
+        """
+
+        lines = []
+        for name, hist in sorted(self.histograms.items()):
+            lines.append('# TYPE trade_{} summary'.format(name))
+            for q in [0.5, 0.9, 0.99]:
+                lines.append('trade_{}{{quantile="{}"}} {}'.format(name, q, hist.quantile(q)))
+            lines.append('trade_{}_sum {}'.format(name, hist.sum))
+            lines.append('trade_{}_count {}'.format(name, hist.count))
+        for name, value in sorted(self.counters.items()):
+            lines.append('# TYPE trade_{}_total counter'.format(name))
+            lines.append('trade_{}_total {}'.format(name, value))
+        for name, values in sorted(self.per_ticker.items()):
+            lines.append('# TYPE trade_{} gauge'.format(name))
+            for ticker, value in sorted(values.items()):
+                lines.append('trade_{}{{ticker="{}"}} {}'.format(name, ticker, value))
+
+        return('\n'.join(lines) + '\n')
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serve `prometheus` (and `summary` at /summary) on a local port from
+        a daemon thread.
+
+        Returns
+        -------
+        http.server.ThreadingHTTPServer
+            Call `shutdown()` to stop it.
+
+        """
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = (metrics.summary() + '\n' if self.path == '/summary' else metrics.prometheus()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+
+        return(server)
+
+
+class SamplingProfiler:
+    """ Sample what a thread is doing every `interval_sec`.
+
+    Counts the stage (see `Metrics.stage`) and the innermost function of the
+    sampled thread, to show which stage the loop spends its time in as it
+    approaches saturation. Sampling runs in a daemon thread; its overhead is
+    one stack lookup per sample.
+
+    """
+
+    def __init__(self, metrics, interval_sec=0.005, thread_id=None):
+
+        self.metrics = metrics
+        self.interval_sec = interval_sec
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stages = collections.Counter()
+        self.functions = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+        return(self)
+
+    def stop(self):
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+
+        while not self._stop.wait(self.interval_sec):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stages[self.metrics.current_stage(self.thread_id) or 'idle'] += 1
+            code = frame.f_code
+            self.functions['{}:{} ({})'.format(os.path.basename(code.co_filename), frame.f_lineno, code.co_name)] += 1
+
+    def summary(self, top=10):
+
+        total = max([1, sum(self.stages.values())])
+        lines = ['Profile ({} samples)'.format(sum(self.stages.values()))]
+        lines += ['  {:<28} {:.1%}'.format(name, n/total) for name, n in self.stages.most_common()]
+        lines += ['  {:<48} {:.1%}'.format(name, n/total) for name, n in self.functions.most_common(top)]
+
+        return('\n'.join(lines))
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import numpy as np
+
+# The `fills` fields, in insert order
+FILLS_FIELDS = [
+    'order_id',
+    'ticker',
+    'side',
+    'quantity',
+    'price',
+    'commission',
+    'order_type',
+    'datetime_newyork',
+    ]
+
+
+class Ledger:
+    """ Positions, cash and P&L of a paper account.
+
+    Per-ticker values are kept in preallocated NumPy arrays (one row per
+    ticker), so a fill is an O(1) update of one row, and marks and
+    unrealized P&L are array operations over every ticker at once.
+
+    """
+
+    def __init__(self, initial_cash=0.0):
+
+        self.initial_cash = initial_cash
+        self.cash = initial_cash
+
+        self._index = {}    # ticker: row
+        self._symbols = []
+        self.position = np.zeros(0, dtype=np.int64)     # signed shares
+        self.avg_cost = np.zeros(0)
+        self.realized = np.zeros(0)     # net of commission
+        self.last = np.full(0, np.nan)
+        self.ask = np.full(0, np.nan)
+        self.bid = np.full(0, np.nan)
+
+    def __len__(self):
+        return(len(self._symbols))
+
+    def rows(self, tickers):
+        """
+        The row of each ticker (rows are added for new tickers).
+
+        Returns
+        -------
+        numpy.ndarray
+
+        """
+
+        for ticker in tickers:
+            if ticker not in self._index:
+                self._index[ticker] = len(self._symbols)
+                self._symbols.append(ticker)
+
+        # Grow geometrically
+        size = len(self.position)
+        if len(self._symbols) > size:
+            allocated = max([len(self._symbols), 2*size])
+            for key, fill in [('position', 0), ('avg_cost', 0.0), ('realized', 0.0), ('last', np.nan), ('ask', np.nan), ('bid', np.nan)]:
+                values = getattr(self, key)
+                grown = np.full(allocated, fill, dtype=values.dtype)
+                grown[:size] = values
+                setattr(self, key, grown)
+
+        return(np.fromiter((self._index[x] for x in tickers), dtype=np.int64, count=len(tickers)))
+
+    def fill(self, row, quantity, price, commission=0.0):
+        """
+        Apply a fill of `quantity` shares (negative to sell) at `price`.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        pos = int(self.position[row])
+        avg = float(self.avg_cost[row])
+        new = pos + quantity
+
+        if pos == 0 or (pos > 0) == (quantity > 0):
+            # Opening or adding
+            avg = (avg*abs(pos) + price*abs(quantity))/abs(new)
+        else:
+            # Reducing, closing or reversing
+            closed = min([abs(quantity), abs(pos)])
+            self.realized[row] += closed*(price - avg)*(1 if pos > 0 else -1)
+            if new == 0:
+                avg = 0.0
+            elif (new > 0) != (pos > 0):
+                avg = price
+
+        self.position[row] = new
+        self.avg_cost[row] = avg
+        self.realized[row] -= commission
+        self.cash -= quantity*price + commission
+
+    def mark(self, rows, price, ask, bid):
+        """
+        Update the latest quotes of `rows`.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.last[rows] = price
+        self.ask[rows] = ask
+        self.bid[rows] = bid
+
+    def unrealized(self):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            The unrealized P&L of each row at the latest price.
+
+        """
+
+        size = len(self._symbols)
+        position = self.position[:size]
+
+        return(np.where(position != 0, position*(self.last[:size] - self.avg_cost[:size]), 0.0))
+
+    def equity(self):
+
+        size = len(self._symbols)
+        position = self.position[:size]
+
+        return(self.cash + float(np.where(position != 0, position*self.last[:size], 0.0).sum()))
+
+    def positions(self):
+        """
+        Returns
+        -------
+        dict
+            Ticker: {'position', 'avg_cost', 'realized', 'unrealized'}, for
+            every ticker traded.
+
+        """
+
+        unrealized = self.unrealized()
+
+        return(
+            {
+                ticker: {
+                    'position': int(self.position[row]),
+                    'avg_cost': float(self.avg_cost[row]),
+                    'realized': float(self.realized[row]),
+                    'unrealized': float(unrealized[row]),
+                    }
+                for ticker, row in self._index.items()
+                }
+            )
+
+
+class PaperTrader:
+    """ Simulated execution of `Analyze` signals against the latest quotes.
+
+    Market orders fill immediately at the latest ask (buys) or bid (sells),
+    moved `slippage_bps` against the order. Limit orders fill at the quote
+    once it crosses the limit (buys when ask <= limit, sells when bid >=
+    limit), checked for every open order at once on each batch of quotes.
+
+    Signals follow `backtest.Backtest`: a buy opens a long sized to
+    `position_value`, a sell closes it (or goes short if `allow_short`),
+    and a hold keeps the position.
+
+    Every method that fills returns the fills as rows in the order of
+    `FILLS_FIELDS`, for the caller to persist in batches.
+
+    """
+
+    def __init__(
+            self,
+            quote_store,
+            slippage_bps=0.0,
+            commission=0.0,
+            position_value=10000.0,
+            allow_short=False,
+            initial_cash=0.0,
+            ):
+
+        self.quote_store = quote_store
+        self.slippage_bps = slippage_bps
+        self.commission = commission
+        self.position_value = position_value
+        self.allow_short = allow_short
+        self.ledger = Ledger(initial_cash)
+
+        self._orderIds = itertools.count(1)
+
+        # Open limit orders, in parallel arrays (`_slot` maps an order id to
+        # its position; cancelled and filled orders are swapped out)
+        self._slot = {}
+        self._open = 0
+        self._orderId = np.zeros(0, dtype=np.int64)
+        self._orderRow = np.zeros(0, dtype=np.int64)
+        self._orderQty = np.zeros(0, dtype=np.int64)
+        self._orderLimit = np.zeros(0)
+
+    def on_quotes(self, tickers, dt):
+        """
+        Mark the ledger with the latest quotes of `tickers` (from the store)
+        and fill any limit orders they cross.
+
+        Parameters
+        ----------
+        tickers : list
+        dt : datetime
+            The fill time (New York).
+
+        Returns
+        -------
+        list
+            Fills.
+
+        """
+
+        if len(tickers) == 0:
+            return([])
+
+        latest = self.quote_store.latest(tickers, ['price', 'ask', 'bid'])
+        self.ledger.mark(self.ledger.rows(tickers), latest['price'], latest['ask'], latest['bid'])
+
+        if self._open == 0:
+            return([])
+
+        n = self._open
+        rows = self._orderRow[:n]
+        qty = self._orderQty[:n]
+        limit = self._orderLimit[:n]
+        ask = self.ledger.ask[rows]
+        bid = self.ledger.bid[rows]
+        crossed = np.where(qty > 0, (ask > 0) & (ask <= limit), (bid > 0) & (bid >= limit))
+
+        fills = []
+        for orderId, row, quantity, price in zip(
+                self._orderId[:n][crossed].tolist(),
+                rows[crossed].tolist(),
+                qty[crossed].tolist(),
+                np.where(qty > 0, ask, bid)[crossed].tolist(),
+                ):
+            self._remove(orderId)
+            fills.append(self._fill(orderId, row, quantity, price, 'limit', dt))
+
+        return(fills)
+
+    def on_signals(self, tickers, signals, dt):
+        """
+        Trade toward the positions implied by `signals` (1 buy, -1 sell, 0
+        hold) with market orders. Call after `on_quotes` for the same
+        tickers.
+
+        Returns
+        -------
+        list
+            Fills.
+
+        """
+
+        rows = self.ledger.rows(tickers)
+        signals = np.asarray(signals)
+        position = self.ledger.position[rows]
+        ask = self.ledger.ask[rows]
+        bid = self.ledger.bid[rows]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            size = np.where(ask > 0, np.floor(self.position_value/ask), 0).astype(np.int64)
+            shortSize = np.where(bid > 0, np.floor(self.position_value/bid), 0).astype(np.int64)
+
+        target = np.where(
+            signals > 0,
+            np.where(position > 0, position, size),
+            np.where(
+                signals < 0,
+                np.where(position < 0, position, -shortSize if self.allow_short else 0),
+                position,
+                ),
+            )
+        order = target - position
+
+        fills = []
+        for idx in np.flatnonzero(order).tolist():
+            fill = self.market_order(tickers[idx], int(order[idx]), dt)
+            if fill is not None:
+                fills.append(fill)
+
+        return(fills)
+
+    def market_order(self, ticker, quantity, dt):
+        """
+        Fill `quantity` shares (negative to sell) of `ticker` at its latest
+        quote.
+
+        Returns
+        -------
+        list or None
+            The fill, or None if there is no quote to fill against.
+
+        """
+
+        row = int(self.ledger.rows([ticker])[0])
+        slip = self.slippage_bps/1e4
+        if quantity > 0:
+            price = float(self.ledger.ask[row])*(1 + slip)
+        else:
+            price = float(self.ledger.bid[row])*(1 - slip)
+        if not price > 0:
+            return(None)
+
+        return(self._fill(next(self._orderIds), row, quantity, price, 'market', dt))
+
+    def limit_order(self, ticker, quantity, limit):
+        """
+        Place a limit order for `quantity` shares (negative to sell). It is
+        checked against the quotes from the next `on_quotes`.
+
+        Returns
+        -------
+        int
+            The order id.
+
+        """
+
+        orderId = next(self._orderIds)
+        row = int(self.ledger.rows([ticker])[0])
+
+        n = self._open
+        if n == len(self._orderId):
+            allocated = max([16, 2*n])
+            for key in ['_orderId', '_orderRow', '_orderQty', '_orderLimit']:
+                values = getattr(self, key)
+                grown = np.zeros(allocated, dtype=values.dtype)
+                grown[:n] = values[:n]
+                setattr(self, key, grown)
+
+        self._orderId[n] = orderId
+        self._orderRow[n] = row
+        self._orderQty[n] = quantity
+        self._orderLimit[n] = limit
+        self._slot[orderId] = n
+        self._open += 1
+
+        return(orderId)
+
+    def cancel(self, order_id):
+        """
+        Cancel an open limit order.
+
+        Returns
+        -------
+        bool
+            Whether the order was open.
+
+        """
+
+        if order_id not in self._slot:
+            return(False)
+        self._remove(order_id)
+
+        return(True)
+
+    def open_orders(self):
+        """
+        Returns
+        -------
+        dict
+            Order id: (ticker, quantity, limit).
+
+        """
+
+        return(
+            {
+                int(orderId): (self.ledger._symbols[row], int(qty), float(limit))
+                for orderId, row, qty, limit in zip(
+                    self._orderId[:self._open], self._orderRow[:self._open],
+                    self._orderQty[:self._open], self._orderLimit[:self._open],
+                    )
+                }
+            )
+
+    def _remove(self, orderId):
+
+        # Move the last open order into the freed slot
+        slot = self._slot.pop(orderId)
+        last = self._open - 1
+        if slot != last:
+            for values in [self._orderId, self._orderRow, self._orderQty, self._orderLimit]:
+                values[slot] = values[last]
+            self._slot[int(self._orderId[slot])] = slot
+        self._open = last
+
+    def _fill(self, orderId, row, quantity, price, orderType, dt):
+
+        self.ledger.fill(row, quantity, price, self.commission)
+
+        return(
+            [
+                orderId,
+                self.ledger._symbols[row],
+                'buy' if quantity > 0 else 'sell',
+                abs(quantity),
+                price,
+                self.commission,
+                orderType,
+                dt,
+                ]
+            )
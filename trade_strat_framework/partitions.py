@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pendulum
+
+from .candles import CANDLES_FIELDS, downsample
+from .history import range_predicate
+
+# The tables partitioned by New York date (see sql/)
+PARTITIONED_TABLES = ('quotes', 'candles', 'analysis')
+
+# TO_DAYS('1970-01-01'): partition bounds are stored as TO_DAYS values
+_TO_DAYS_EPOCH = 719528
+
+
+def _ny_date(date=None):
+
+    # `date` (str or datetime) as datetime64[D], by default today's New
+    # York date
+    if date is None:
+        date = pendulum.now('America/New_York').format('YYYY-MM-DD')
+
+    return(np.datetime64(str(date)[:10], 'D'))
+
+
+def partition_name(date):
+    """
+    The name of the partition holding the New York date `date` (e.g.
+    'p20240105').
+
+    Returns
+    -------
+    str
+
+    """
+
+    return('p' + str(np.datetime64(date, 'D')).replace('-', ''))
+
+
+class PartitionMaintenance:
+    """ Keeps the date partitions of `quotes`, `candles` and `analysis`.
+
+    Each table has a partition per New York date, with `pmax` (kept empty)
+    after them. `run` is the daily maintenance:
+
+    - the partitions for the next `days_ahead` days are split off `pmax`
+      (an empty partition, so no rows are copied);
+    - each day of raw quotes older than the `quotes` retention is rolled up
+      into candles of `compact_minutes` in `candles`, then its partition is
+      dropped;
+    - the `candles` and `analysis` partitions older than their retention
+      are dropped.
+
+    Dropping a partition removes a day of rows as a metadata change, where a
+    DELETE would lock, scan and log every row and leave the table
+    fragmented.
+
+    Parameters
+    ----------
+    conn : coftc_db_utils.Conn
+    retention_days : dict
+        Table: days of partitions to keep (None keeps them all). Missing
+        tables keep the defaults (30 days of quotes and analysis, and every
+        candle).
+    compact_minutes : sequence of int
+        The timeframes that expiring quotes are rolled up into.
+    days_ahead : int
+
+    """
+
+    def __init__(self, conn, retention_days=None, compact_minutes=(60,), days_ahead=7):
+
+        self._conn = conn
+        self.retention_days = dict({'quotes': 30, 'candles': None, 'analysis': 30}, **(retention_days or {}))
+        self.compact_minutes = sorted(set(compact_minutes))
+        self.days_ahead = days_ahead
+
+        # Compacted candles are written to the dates they cover, so those
+        # partitions must outlive the quotes'
+        quoteDays, candleDays = self.retention_days['quotes'], self.retention_days['candles']
+        if candleDays is not None and (quoteDays is None or candleDays < quoteDays):
+            raise ValueError("Candles must be kept at least as long as quotes ({} days)".format(quoteDays))
+
+    def partitions(self, table):
+        """
+        Returns
+        -------
+        list
+            (name, end) of each partition of `table`, in order. `end` is the
+            first date after the partition (datetime64[D]), None for `pmax`.
+
+        """
+
+        rows = self._conn.query(
+            "SELECT `PARTITION_NAME`, `PARTITION_DESCRIPTION` FROM `information_schema`.`PARTITIONS` "
+            "WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = '{}' AND `PARTITION_NAME` IS NOT NULL "
+            "ORDER BY `PARTITION_ORDINAL_POSITION`".format(table)
+            )
+
+        return(
+            [
+                (name, None if end == 'MAXVALUE' else np.datetime64('1970-01-01', 'D') + (int(end) - _TO_DAYS_EPOCH))
+                for name, end in rows
+                ]
+            )
+
+    def add_partitions(self, table, through, today=None):
+        """
+        Add a partition for each date up to and including `through` that
+        doesn't have one. A table that has only `pmax` (as created, or just
+        partitioned) gets partitions from `today` (by default, today's New
+        York date) on, and `p_history` for everything before.
+
+        Returns
+        -------
+        list
+            The names of the partitions added.
+
+        """
+
+        parts = self.partitions(table)
+        if not parts or parts[-1] != ('pmax', None):
+            raise ValueError("`{}` isn't partitioned by date (see sql/partition_tables.sql)".format(table))
+
+        through = np.datetime64(through, 'D')
+        ends = [end for _, end in parts[:-1]]
+        if ends:
+            first = max(ends)
+            added = []
+        else:
+            first = _ny_date(today)
+            added = [('p_history', first)]
+        added += [(partition_name(x), x + 1) for x in np.arange(first, through + 1)]
+        if not added:
+            return([])
+
+        self._conn.query(
+            "ALTER TABLE `{table}` REORGANIZE PARTITION `pmax` INTO ({parts}, "
+            "PARTITION `pmax` VALUES LESS THAN MAXVALUE)".format(
+                table=table,
+                parts=', '.join(
+                    "PARTITION `{}` VALUES LESS THAN (TO_DAYS('{}'))".format(name, end) for name, end in added
+                    ),
+                )
+            )
+
+        return([name for name, _ in added])
+
+    def drop_partitions(self, table, before):
+        """
+        Drop the partitions of `table` that hold only dates before `before`.
+
+        Returns
+        -------
+        list
+            The names of the partitions dropped.
+
+        """
+
+        before = np.datetime64(before, 'D')
+        names = [name for name, end in self.partitions(table) if end is not None and end <= before]
+        if names:
+            self._conn.query(
+                "ALTER TABLE `{}` DROP PARTITION {}".format(table, ', '.join('`{}`'.format(x) for x in names))
+                )
+
+        return(names)
+
+    def compact_day(self, date):
+        """
+        Roll the raw quotes of the New York date `date` up into candles of
+        each of `compact_minutes` (existing candles are kept). The query
+        reads only that date's partition.
+
+        Returns
+        -------
+        int
+            The number of candles written.
+
+        """
+
+        date = np.datetime64(date, 'D')
+        rows = self._conn.query(
+            "SELECT `ticker`, TIMESTAMPDIFF(SECOND, '1970-01-01', `datetime_newyork`), `price` + 0e0, `volume` "
+            "FROM `quotes` WHERE `initial` = 0 AND `price` IS NOT NULL AND {dates} "
+            "ORDER BY `ticker`, `datetime_newyork`".format(dates=range_predicate(date, date + 1))
+            )
+        if not rows:
+            return(0)
+
+        ticker, localSec, price, volume = zip(*rows)
+        ticker = np.array(ticker, dtype=object)
+        localSec = np.array(localSec, dtype=np.int64)
+        price = np.array(price, dtype=np.float64)
+        volume = np.nan_to_num(np.array(volume, dtype=np.float64)).astype(np.int64)
+
+        candles = []
+        for tf in self.compact_minutes:
+            candles += downsample(ticker, localSec, price, volume, tf)
+        if candles:
+            self._conn.insert(
+                table_name='candles',
+                fields=CANDLES_FIELDS,
+                values=candles,
+                on_duplicate='ignore',
+                )
+
+        return(len(candles))
+
+    def compact(self, before):
+        """
+        Compact (see `compact_day`) and drop the `quotes` partitions that
+        hold only dates before `before`, oldest first. A partition is only
+        dropped once all its days are compacted.
+
+        Returns
+        -------
+        tuple
+            The number of candles written, and the names of the partitions
+            dropped.
+
+        """
+
+        before = np.datetime64(before, 'D')
+        candleCount = 0
+        dropped = []
+        start = None
+        for name, end in self.partitions('quotes'):
+            if end is None or end > before:
+                break
+
+            # The first partition (e.g. `p_history`) starts at its oldest
+            # quote; the rest start where the previous one ended
+            if start is None:
+                first = self._conn.query(
+                    "SELECT TIMESTAMPDIFF(SECOND, '1970-01-01', MIN(`datetime_newyork`)) "
+                    "FROM `quotes` PARTITION (`{}`)".format(name)
+                    )
+                start = end if not first or first[0][0] is None else np.datetime64(int(first[0][0]), 's').astype('datetime64[D]')
+            for date in np.arange(start, end):
+                candleCount += self.compact_day(date)
+
+            self._conn.query("ALTER TABLE `quotes` DROP PARTITION `{}`".format(name))
+            dropped.append(name)
+            start = end
+
+        return((candleCount, dropped))
+
+    def run(self, today=None):
+        """
+        The daily maintenance (see the class docstring).
+
+        Parameters
+        ----------
+        today : str or datetime, optional
+            The current New York date (by default, today's).
+
+        Returns
+        -------
+        dict
+            'added' and 'dropped' (table: partition names) and 'candles'
+            (the number written by compaction).
+
+        """
+
+        today = _ny_date(today)
+        summary = {'added': {}, 'dropped': {}, 'candles': 0}
+
+        for table in PARTITIONED_TABLES:
+            summary['added'][table] = self.add_partitions(table, today + self.days_ahead, today=today)
+
+        for table in PARTITIONED_TABLES:
+            days = self.retention_days[table]
+            if days is None:
+                summary['dropped'][table] = []
+            elif table == 'quotes':
+                summary['candles'], summary['dropped'][table] = self.compact(today - days)
+            else:
+                summary['dropped'][table] = self.drop_partitions(table, today - days)
+
+        return(summary)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import multiprocessing
+import random
+import threading
+import time
+from urllib.parse import quote
+
+
+class TokenBucket:
+    """ Token bucket request pacer.
+
+    Tokens refill at `rate` per second up to `capacity`. A request takes a
+    token, or reserves the next one and waits for it, so requests made
+    together (threads or tasks) are spaced out rather than sent as a burst.
+
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._pausedUntil = 0.0
+
+        # Seconds spent waiting (for reporting)
+        self.waited_sec = 0.0
+
+    def reserve(self, n=1):
+        """
+        Take `n` tokens, going into debt if there aren't enough.
+
+        Returns
+        -------
+        float
+            The seconds to wait before sending.
+
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._tokens = min([self.capacity, self._tokens + (now - self._updated)*self.rate])
+            self._updated = now
+            self._tokens -= n
+
+            wait = max([0.0, self._pausedUntil - now])
+            if self._tokens < 0:
+                wait = max([wait, -self._tokens/self.rate])
+            self.waited_sec += wait
+
+        return(wait)
+
+    def acquire(self, n=1):
+
+        wait = self.reserve(n)
+        if wait > 0:
+            self._sleep(wait)
+
+        return(wait)
+
+    async def acquire_async(self, n=1):
+
+        wait = self.reserve(n)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        return(wait)
+
+    def pause(self, seconds):
+        """
+        Hold every request for `seconds` (e.g. after a 429), and drop any
+        saved-up burst.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._pausedUntil = max([self._pausedUntil, now + seconds])
+            self._tokens = min([self._tokens, 0.0])
+
+
+class SharedTokenBucket(TokenBucket):
+    """ A `TokenBucket` shared by several processes (one global budget).
+
+    The bucket state is kept in shared memory, so pass the bucket to each
+    process when it is created. The monotonic clock is system-wide, so the
+    refill is consistent across processes.
+
+    """
+
+    def __init__(self, rate, capacity=1):
+
+        self._state = multiprocessing.Array('d', [float(capacity), time.monotonic(), 0.0])
+        super().__init__(rate, capacity)
+        self._lock = self._state.get_lock()
+
+    @property
+    def _tokens(self):
+        return(self._state[0])
+
+    @_tokens.setter
+    def _tokens(self, value):
+        self._state[0] = value
+
+    @property
+    def _updated(self):
+        return(self._state[1])
+
+    @_updated.setter
+    def _updated(self, value):
+        self._state[1] = value
+
+    @property
+    def _pausedUntil(self):
+        return(self._state[2])
+
+    @_pausedUntil.setter
+    def _pausedUntil(self, value):
+        self._state[2] = value
+
+
+def retry_after_sec(response, attempt, cap_sec=60):
+    """
+    The back-off before retrying a throttled request: the `Retry-After`
+    header if given, else exponential (with jitter) in the attempt number.
+
+    """
+
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return(min([cap_sec, float(headers['Retry-After'])]))
+    except (KeyError, TypeError, ValueError):
+        return(min([cap_sec, 2**attempt])*random.uniform(0.5, 1.0))
+
+
+class BatchPlanner:
+    """ Split tickers into `get_quotes` batches, adapting the batch size.
+
+    Batches hold at most `batch_size` tickers and `max_url_chars` of
+    encoded symbols. Larger batches mean fewer requests per cycle (fresher
+    quotes under the same rate limit), so the size grows while requests
+    succeed within `target_latency_sec`, and shrinks when they are slow or
+    fail (additive increase, multiplicative decrease).
+
+    """
+
+    def __init__(self, max_batch=100, min_batch=5, target_latency_sec=1.0, max_url_chars=2000):
+
+        self.max_batch = max_batch
+        self.min_batch = min([min_batch, max_batch])
+        self.target_latency_sec = target_latency_sec
+        self.max_url_chars = max_url_chars
+        self.batch_size = max_batch
+
+    def plan(self, tickers):
+        """
+        Returns
+        -------
+        list of list
+            The batches, in ticker order.
+
+        """
+
+        batches = []
+        batch = []
+        chars = 0
+        for ticker in tickers:
+            # The encoded symbol and its separator ('%2C')
+            cost = len(quote(ticker)) + 3
+            if batch and (len(batch) >= self.batch_size or chars + cost > self.max_url_chars):
+                batches.append(batch)
+                batch = []
+                chars = 0
+            batch.append(ticker)
+            chars += cost
+        if batch:
+            batches.append(batch)
+
+        return(batches)
+
+    def record(self, size, latency_sec, ok):
+        """
+        Adapt the batch size to the outcome of a request of `size` tickers.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if not ok:
+            self.batch_size = max([self.min_batch, self.batch_size//2])
+        elif latency_sec > self.target_latency_sec:
+            self.batch_size = max([self.min_batch, int(self.batch_size*0.8)])
+        elif size >= self.batch_size:
+            self.batch_size = min([self.max_batch, self.batch_size + max([1, self.batch_size//10])])
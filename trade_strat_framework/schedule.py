@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import time
+
+
+class DeadlineScheduler:
+    """ Per-ticker deadline scheduler backed by a binary heap.
+
+    Deadlines are in `time.monotonic()` seconds, so wall-clock adjustments
+    (NTP, DST) don't move the schedule. Rescheduling a ticker is O(log N);
+    the superseded heap entry is skipped lazily when it reaches the top.
+
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+
+        self._clock = clock
+        self._sleep = sleep
+        self._heap = []
+        self._deadline = {}     # ticker: current deadline
+        self._seq = itertools.count()   # tie-breaker (keeps FIFO order)
+
+        # Lateness (in seconds) of each ticker's most recent run. Negative
+        # values mean the ticker was coalesced into an earlier batch.
+        self.lateness = {}
+        self.max_lateness = {}
+
+    def __len__(self):
+        return(len(self._deadline))
+
+    def __contains__(self, ticker):
+        return(ticker in self._deadline)
+
+    def now(self):
+        return(self._clock())
+
+    def schedule(self, ticker, deadline):
+        """
+        Schedule (or reschedule) `ticker` to run at `deadline` (monotonic
+        seconds).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._deadline[ticker] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._seq), ticker))
+
+    def schedule_many(self, tickers, deadlines):
+        """
+        Schedule (or reschedule) each of `tickers` at the matching deadline
+        (see `schedule`). A batch at least as large as the heap is added
+        with one O(N) heapify rather than a push per ticker.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        entries = [(deadline, next(self._seq), ticker) for ticker, deadline in zip(tickers, deadlines)]
+        self._deadline.update((ticker, deadline) for deadline, _, ticker in entries)
+        if len(entries) >= len(self._heap):
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+    def deadlines(self):
+        """
+        Returns
+        -------
+        dict
+            Ticker: deadline (monotonic seconds) of every scheduled ticker.
+
+        """
+
+        return(dict(self._deadline))
+
+    def remove(self, ticker):
+
+        # Unschedule and forget the ticker's lateness (the heap entry is
+        # dropped lazily)
+        self._deadline.pop(ticker, None)
+        self.lateness.pop(ticker, None)
+        self.max_lateness.pop(ticker, None)
+
+    def _prune(self):
+
+        # Drop heap entries that were rescheduled or removed
+        while self._heap:
+            deadline, _, ticker = self._heap[0]
+            if self._deadline.get(ticker) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """
+        Returns
+        -------
+        float or None
+            The earliest deadline, or None if nothing is scheduled.
+
+        """
+
+        self._prune()
+        return(self._heap[0][0] if self._heap else None)
+
+    def pop_due(self, window_sec=0, max_size=None):
+        """
+        Pop the tickers that are due, coalescing any whose deadline falls
+        within `window_sec` of now into the same batch.
+
+        Parameters
+        ----------
+        window_sec : float
+            Tickers due within this many seconds are included in the batch.
+        max_size : int, optional
+            The maximum number of tickers to return (the rest stay scheduled
+            and are returned by the next call).
+
+        Returns
+        -------
+        list
+            The tickers to run, earliest deadline first.
+
+        """
+
+        now = self._clock()
+        batch = []
+        while max_size is None or len(batch) < max_size:
+            self._prune()
+            if not self._heap or self._heap[0][0] > now + window_sec:
+                break
+
+            deadline, _, ticker = heapq.heappop(self._heap)
+            del self._deadline[ticker]
+
+            self.lateness[ticker] = now - deadline
+            self.max_lateness[ticker] = max(
+                self.max_lateness.get(ticker, self.lateness[ticker]),
+                self.lateness[ticker],
+                )
+            batch.append(ticker)
+
+        return(batch)
+
+    def pop_all(self):
+        """
+        Pop every scheduled ticker (earliest deadline first), without
+        recording lateness (e.g. to start over after the market reopens).
+
+        Returns
+        -------
+        list
+
+        """
+
+        batch = sorted(self._deadline, key=self._deadline.get)
+        self._deadline.clear()
+        self._heap.clear()
+
+        return(batch)
+
+    def pause_seconds(self):
+        """
+        Returns
+        -------
+        float
+            Seconds until the earliest deadline (0 if it's already due or
+            nothing is scheduled).
+
+        """
+
+        deadline = self.next_deadline()
+        if deadline is None:
+            return(0)
+
+        return(max([0, deadline - self._clock()]))
+
+    def sleep_until_due(self, step_sec=None):
+        """
+        Sleep until the earliest deadline.
+
+        Parameters
+        ----------
+        step_sec : float, optional
+            Sleep in increments of at most this many seconds (to allow
+            KeyboardInterrupt, and to pick up deadlines added meanwhile).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        while True:
+            pauseSeconds = self.pause_seconds()
+            if pauseSeconds <= 0:
+                return
+            self._sleep(pauseSeconds if step_sec is None else min([pauseSeconds, step_sec]))
+
+    def sleep_for(self, seconds, step_sec=None):
+        """
+        Sleep for `seconds` (e.g. until the market opens), in increments of
+        at most `step_sec` if given.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        wakeAt = self._clock() + seconds
+        while True:
+            pauseSeconds = wakeAt - self._clock()
+            if pauseSeconds <= 0:
+                return
+            self._sleep(pauseSeconds if step_sec is None else min([pauseSeconds, step_sec]))
+
+    def worst_lateness(self):
+        """
+        Returns
+        -------
+        tuple
+            (ticker, seconds) of the latest ticker in the most recent runs, or
+            (None, 0) if nothing has run yet.
+
+        """
+
+        if not self.lateness:
+            return((None, 0))
+
+        ticker = max(self.lateness, key=self.lateness.get)
+        return((ticker, self.lateness[ticker]))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# The quote loop's per-ticker state (times are UTC epoch seconds)
+STATE_DTYPE = np.dtype([
+    ('read_sec', np.float64),           # the last read of the ticker
+    ('quote_sec', np.int64),            # the last stored quote time (-1 until read)
+    ('time_correction_sec', np.int64),  # quote time less the expected time, at the last read
+    ('delayed', bool),
+    ('unchanged', np.int32),            # reads in a row that returned the stored quote
+    ('next_cycle', np.int64),           # the next cycle to poll the ticker in (async loop)
+    ])
+
+# The value of each field for a ticker that hasn't been read
+_DEFAULTS = {'quote_sec': -1}
+
+
+class TickerState:
+    """ Per-ticker state of the quote loop as one structured array.
+
+    Each ticker has a row of `STATE_DTYPE` (found through a ticker: row
+    map), so the loop reads and updates a whole batch with array operations
+    rather than one dict per ticker. Fields are read with `state[field]`
+    (a view of the rows in use) and written with `update`.
+
+    """
+
+    def __init__(self, tickers=()):
+
+        self._index = {}    # ticker: row
+        self._data = np.zeros(0, dtype=STATE_DTYPE)
+
+        self.add_tickers(tickers)
+
+    def __len__(self):
+        return(len(self._index))
+
+    def __contains__(self, ticker):
+        return(ticker in self._index)
+
+    def __getitem__(self, field):
+        return(self._data[field][:len(self._index)])
+
+    @property
+    def tickers(self):
+        return(list(self._index.keys()))
+
+    @property
+    def nbytes(self):
+        return(self._data.nbytes)
+
+    def add_tickers(self, tickers):
+        """
+        Add rows (with the unread defaults) for any tickers not already in
+        the state.
+
+        Returns
+        -------
+        numpy.ndarray
+            The row of each ticker.
+
+        """
+
+        newTickers = [x for x in dict.fromkeys(tickers) if x not in self._index]
+        if newTickers:
+            rows = len(self._index)
+            for idx, ticker in enumerate(newTickers):
+                self._index[ticker] = rows + idx
+
+            # Grow geometrically so adding tickers a few at a time stays cheap
+            needed = rows + len(newTickers)
+            if needed > len(self._data):
+                grown = np.zeros(max([needed, 2*len(self._data)]), dtype=STATE_DTYPE)
+                grown[:rows] = self._data[:rows]
+                self._data = grown
+            for field, value in _DEFAULTS.items():
+                self._data[field][rows:needed] = value
+
+        return(self.rows(tickers))
+
+    def remove_tickers(self, tickers):
+        """
+        Drop the rows of `tickers` (the others keep their order).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        removed = {x for x in tickers if x in self._index}
+        if not removed:
+            return
+
+        keep = [x for x in self._index if x not in removed]
+        self._data = self._data[self.rows(keep)]
+        self._index = {x: idx for idx, x in enumerate(keep)}
+
+    def rows(self, tickers):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            The row of each ticker (-1 for tickers not in the state).
+
+        """
+
+        index = self._index
+        return(np.fromiter((index.get(x, -1) for x in tickers), dtype=np.int64, count=len(tickers)))
+
+    def values(self, field, rows, missing=0):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            `field` at each of `rows`, and `missing` where the row is -1.
+
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(self._index) == 0:
+            return(np.full(len(rows), missing, dtype=STATE_DTYPE[field]))
+
+        return(np.where(rows >= 0, self[field][np.maximum(rows, 0)], missing))
+
+    def update(self, rows, **fields):
+        """
+        Set fields (scalars or one value per row) at `rows`.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for field, values in fields.items():
+            self._data[field][rows] = values
+
+    def get(self, ticker):
+        """
+        Returns
+        -------
+        dict or None
+            The state of `ticker` (None if it isn't in the state).
+
+        """
+
+        if ticker not in self._index:
+            return(None)
+
+        row = self._data[self._index[ticker]]
+        return({field: row[field].item() for field in STATE_DTYPE.names})
+
+    def select(self, tickers):
+        """
+        Returns
+        -------
+        TickerState
+            A copy holding the state of `tickers` (those in the state).
+
+        """
+
+        tickers = [x for x in dict.fromkeys(tickers) if x in self._index]
+        selected = TickerState()
+        selected._index = {x: idx for idx, x in enumerate(tickers)}
+        selected._data = self._data[self.rows(tickers)]
+
+        return(selected)
+
+    def columns(self):
+        """
+        Returns
+        -------
+        dict
+            Field: a copy of the values of every ticker (in `tickers` order).
+
+        """
+
+        return({field: self[field].copy() for field in STATE_DTYPE.names})
+
+    @classmethod
+    def from_columns(cls, tickers, columns):
+        """
+        Build the state from `columns` (see `columns`). Missing fields take
+        the unread defaults.
+
+        Returns
+        -------
+        TickerState
+
+        """
+
+        state = cls(tickers)
+        rows = state.rows(tickers)
+        for field in STATE_DTYPE.names:
+            if field in columns:
+                state.update(rows, **{field: columns[field]})
+
+        return(state)
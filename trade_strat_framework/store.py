@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# Column name: dtype
+STORE_FIELDS = {
+    'price': np.float64,
+    'ask': np.float64,
+    'bid': np.float64,
+    'volume': np.int64,
+    'epoch_sec': np.int64,
+    }
+
+
+class QuoteStore:
+    """ In-memory ring buffer of the most recent quotes of each ticker.
+
+    Each field is a preallocated (tickers x 2*capacity) array. Every value is
+    written twice, at `pos` and `pos + capacity`, so the last N quotes of a
+    ticker are always a contiguous slice and `last()` can return views
+    rather than copies.
+
+    """
+
+    def __init__(self, capacity=256, tickers=()):
+
+        self.capacity = capacity
+
+        self._index = {}    # ticker: row
+        self._head = np.zeros(0, dtype=np.int64)    # next write position
+        self._count = np.zeros(0, dtype=np.int64)
+        self._columns = {
+            field: np.zeros((0, 2*capacity), dtype=dtype) for field, dtype in STORE_FIELDS.items()
+            }
+
+        self.add_tickers(tickers)
+
+    def __len__(self):
+        return(len(self._index))
+
+    def __contains__(self, ticker):
+        return(ticker in self._index)
+
+    @property
+    def tickers(self):
+        return(list(self._index.keys()))
+
+    def add_tickers(self, tickers):
+        """
+        Allocate buffers for any tickers not already stored.
+
+        Returns
+        -------
+        numpy.ndarray
+            The row of each ticker.
+
+        """
+
+        newTickers = [x for x in dict.fromkeys(tickers) if x not in self._index]
+        if newTickers:
+            rows = len(self._index)
+            for idx, ticker in enumerate(newTickers):
+                self._index[ticker] = rows + idx
+
+            # Grow geometrically so adding tickers one at a time stays cheap
+            needed = rows + len(newTickers)
+            if needed > len(self._head):
+                allocated = max([needed, 2*len(self._head)])
+                self._head = np.resize(self._head, allocated)
+                self._count = np.resize(self._count, allocated)
+                self._head[rows:] = 0
+                self._count[rows:] = 0
+                for field, column in self._columns.items():
+                    grown = np.zeros((allocated, 2*self.capacity), dtype=column.dtype)
+                    grown[:rows] = column[:rows]
+                    self._columns[field] = grown
+
+        return(np.fromiter((self._index[x] for x in tickers), dtype=np.int64, count=len(tickers)))
+
+    def remove_tickers(self, tickers):
+        """
+        Free the buffers of `tickers` (the others keep their quotes).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        removed = {x for x in tickers if x in self._index}
+        if not removed:
+            return
+
+        keep = [x for x in self._index if x not in removed]
+        keepRows = np.fromiter((self._index[x] for x in keep), dtype=np.int64, count=len(keep))
+        self._head = self._head[keepRows]
+        self._count = self._count[keepRows]
+        for field, column in self._columns.items():
+            self._columns[field] = column[keepRows]
+        self._index = {x: idx for idx, x in enumerate(keep)}
+
+    def append(self, tickers, price, ask, bid, volume, epoch_sec):
+        """
+        Append one quote per ticker (each ticker at most once per call).
+
+        Returns
+        -------
+        None.
+
+        """
+
+        rows = self.add_tickers(list(tickers))
+        if len(rows) == 0:
+            return
+
+        pos = self._head[rows]
+        for field, values in zip(
+                ['price', 'ask', 'bid', 'volume', 'epoch_sec'],
+                [price, ask, bid, volume, epoch_sec],
+                ):
+            self._columns[field][rows, pos] = values
+            self._columns[field][rows, pos + self.capacity] = values
+
+        self._head[rows] = (pos + 1) % self.capacity
+        self._count[rows] = np.minimum(self._count[rows] + 1, self.capacity)
+
+    def append_batch(self, batch):
+        """
+        Append a `transform.QuoteBatch`.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.append(batch.symbols, batch.price, batch.ask, batch.bid, batch.volume, batch.epoch_sec)
+
+    def count(self, ticker):
+        return(int(self._count[self._index[ticker]]) if ticker in self._index else 0)
+
+    def latest(self, tickers, fields=None):
+        """
+        The latest quote of each of `tickers` (which must be stored).
+
+        Returns
+        -------
+        dict
+            Field: array (in the order of `tickers`).
+
+        """
+
+        rows = np.fromiter((self._index[x] for x in tickers), dtype=np.int64, count=len(tickers))
+        pos = self._head[rows] - 1 + self.capacity
+
+        return({field: self._columns[field][rows, pos] for field in (STORE_FIELDS if fields is None else fields)})
+
+    def last(self, ticker, n=None, fields=None):
+        """
+        The last `n` quotes of `ticker`, oldest first.
+
+        Parameters
+        ----------
+        ticker : str
+        n : int, optional
+            The number of quotes (default all stored). Fewer are returned if
+            fewer are stored.
+        fields : list, optional
+            The fields to return (default all of `STORE_FIELDS`).
+
+        Returns
+        -------
+        dict
+            Field: read-only view into the buffer. The views are only valid
+            until `capacity` more quotes are appended for the ticker.
+
+        """
+
+        row = self._index[ticker]
+        available = int(self._count[row])
+        n = available if n is None else min([n, available])
+
+        # The window ending at the latest write is contiguous in the
+        # doubled buffer
+        end = int(self._head[row]) + self.capacity
+        out = {}
+        for field in (STORE_FIELDS if fields is None else fields):
+            view = self._columns[field][row, end-n:end]
+            view.flags.writeable = False
+            out[field] = view
+
+        return(out)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import time
+
+# Level-one equity stream field: `get_quotes` key (the fields subscribed to,
+# and how they map onto the polling path)
+LEVEL_ONE_FIELDS = {
+    'LAST_PRICE': 'lastPrice',
+    'ASK_PRICE': 'askPrice',
+    'BID_PRICE': 'bidPrice',
+    'TOTAL_VOLUME': 'totalVolume',
+    'QUOTE_TIME_IN_LONG': 'quoteTimeInLong',
+    }
+
+
+class LevelOneMerger:
+    """ Merge level-one stream updates into `get_quotes`-shaped quotes.
+
+    The stream only sends the fields that changed, so the latest value of
+    every field is kept per symbol, and each update returns the full quotes
+    of the symbols it touched (ready for `transform.QuoteBatch`).
+
+    """
+
+    def __init__(self):
+
+        self._quotes = {}   # symbol: quote
+
+    def apply(self, content):
+        """
+        Parameters
+        ----------
+        content : list
+            The `content` of a level-one (`QUOTE` service) message: one dict
+            per symbol, keyed by `key` (the symbol), `delayed` and the
+            `LEVEL_ONE_FIELDS` that changed.
+
+        Returns
+        -------
+        dict
+            Symbol: quote, for the symbols with a complete quote.
+
+        """
+
+        quoteDict = {}
+        for update in content:
+            symbol = update['key']
+            quote = self._quotes.setdefault(symbol, {'symbol': symbol, 'delayed': False})
+            if 'delayed' in update:
+                quote['delayed'] = update['delayed']
+            for field, key in LEVEL_ONE_FIELDS.items():
+                if field in update:
+                    quote[key] = update[field]
+
+            if all(key in quote for key in LEVEL_ONE_FIELDS.values()):
+                quoteDict[symbol] = dict(quote)
+
+        return(quoteDict)
+
+
+async def tda_level_one(client, tickers, account_id=None):
+    """
+    Level-one equity messages from TDA's streaming API (an async
+    generator).
+
+    Parameters
+    ----------
+    client : tda.client.AsyncClient
+    tickers : list
+    account_id : int, optional
+        Passed to `tda.streaming.StreamClient` (default the first linked
+        account).
+
+    """
+
+    from tda.streaming import StreamClient
+
+    stream = StreamClient(client, account_id=account_id)
+    received = asyncio.Queue()
+
+    await stream.login()
+    await stream.quality_of_service(StreamClient.QOSLevel.EXPRESS)
+    stream.add_level_one_equity_handler(received.put_nowait)
+    await stream.level_one_equity_subs(
+        tickers,
+        fields=[StreamClient.LevelOneEquityFields.SYMBOL] + [
+            getattr(StreamClient.LevelOneEquityFields, x) for x in LEVEL_ONE_FIELDS
+            ],
+        )
+
+    while True:
+        await stream.handle_message()
+        while not received.empty():
+            yield(received.get_nowait())
+
+
+async def replay_level_one(url):
+    """
+    Level-one messages from a replay server (see `serve_replay`), as an
+    async generator ending with the recording.
+
+    """
+
+    import websockets
+
+    async with websockets.connect(url, max_size=None) as websocket:
+        async for message in websocket:
+            yield(json.loads(message))
+
+
+async def record_level_one(source, path):
+    """
+    Write the messages of `source` (e.g. `tda_level_one`) to `path`, one
+    JSON line per message with its receive time, for `serve_replay`.
+
+    Returns
+    -------
+    int
+        The number of messages recorded.
+
+    """
+
+    count = 0
+    with open(path, 'a') as f:
+        async for message in source:
+            f.write(json.dumps({'received': time.time(), 'message': message}) + '\n')
+            f.flush()
+            count += 1
+
+    return(count)
+
+
+async def serve_replay(path, host='localhost', port=8765, speed=1.0):
+    """
+    Serve a recording (see `record_level_one`) over a local websocket. Each
+    connection is sent the whole recording, keeping the recorded gaps
+    between messages divided by `speed` (0 sends as fast as possible, for
+    load tests). Runs until cancelled.
+
+    """
+
+    import websockets
+
+    with open(path) as f:
+        recording = [json.loads(line) for line in f if line.strip()]
+
+    async def play(websocket, *args):
+        start = time.monotonic()
+        first = recording[0]['received'] if recording else 0
+        for item in recording:
+            if speed > 0:
+                delay = (item['received'] - first)/speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await websocket.send(json.dumps(item['message']))
+
+    async with websockets.serve(play, host, port, max_size=None):
+        await asyncio.Future()
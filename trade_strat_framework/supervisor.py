@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+import pendulum
+
+import coftc_logging
+
+from .ratelimit import SharedTokenBucket
+
+
+class ConsistentHashRing:
+    """ Consistent hashing of tickers onto shards.
+
+    Each shard is placed at `replicas` points on a hash ring, and a ticker
+    belongs to the first shard point after its own hash. Adding or removing
+    a shard only moves the tickers between it and its neighbours (about
+    1/shards of them).
+
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+
+        self.replicas = replicas
+        self._points = []   # sorted hashes
+        self._nodes = []    # the shard at each point
+
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return(int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big'))
+
+    @property
+    def nodes(self):
+        return(sorted(set(self._nodes)))
+
+    def add(self, node):
+
+        for idx in range(self.replicas):
+            point = self._hash('{}#{}'.format(node, idx))
+            position = bisect.bisect(self._points, point)
+            self._points.insert(position, point)
+            self._nodes.insert(position, node)
+
+    def remove(self, node):
+
+        keep = [idx for idx, x in enumerate(self._nodes) if x != node]
+        self._points = [self._points[idx] for idx in keep]
+        self._nodes = [self._nodes[idx] for idx in keep]
+
+    def node(self, ticker):
+
+        if not self._points:
+            raise ValueError("No shards to assign '{}' to (the ring is empty)".format(ticker))
+
+        return(self._nodes[bisect.bisect(self._points, self._hash(ticker)) % len(self._points)])
+
+    def assign(self, tickers):
+        """
+        Returns
+        -------
+        dict
+            Shard: list of tickers (every shard is included).
+
+        """
+
+        assignment = {x: [] for x in self.nodes}
+        for ticker in tickers:
+            assignment[self.node(ticker)].append(ticker)
+
+        return(assignment)
+
+
+def _run_shard(shard, tickers, connect, rate_limiter, reports, async_mode, trade_options):
+
+    # Imported here, so the supervisor itself doesn't load the quote path
+    from .trade import Trade
+
+    # Let the supervisor stop the shard with SIGINT (queued rows are
+    # flushed on KeyboardInterrupt)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    client, conn = connect()
+    trader = Trade(client, conn, interactive=False, **trade_options)
+    trader.rate_limiter = rate_limiter
+    trader.cycle_hooks.append(
+        lambda stats: reports.put((shard, os.getpid(), time.time(), stats))
+        )
+
+    try:
+        if async_mode:
+            trader.store_quotes_async(tickers)
+        else:
+            trader.store_quotes(tickers)
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardSupervisor:
+    """ Run the quote collection across several worker processes.
+
+    Tickers are assigned to `shards` workers by consistent hashing, each
+    with its own `Trade` loop (and TDA client and database connection, from
+    `connect`), sharing one rate budget of `rate_limit` requests per minute.
+    Workers that exit are restarted (with a growing delay if they keep
+    failing), and report their lag after every cycle.
+
+    Parameters
+    ----------
+    connect : callable
+        Returns a new (TDA client, database connection) in the worker. It is
+        passed to the worker process, so it must be picklable.
+    tickers : list
+    shards : int
+    rate_limit : float
+        Requests per minute across every worker.
+    async_mode : bool
+        Run `store_quotes_async` (`connect` must return the async client).
+    trade_options : dict, optional
+        Keyword arguments for each worker's `Trade`.
+
+    """
+
+    def __init__(
+            self,
+            connect,
+            tickers,
+            shards=4,
+            rate_limit=110,
+            async_mode=False,
+            trade_options=None,
+            max_restart_delay_sec=60,
+            ):
+
+        if shards < 1:
+            raise ValueError('shards must be at least 1 (got {})'.format(shards))
+
+        self.connect = connect
+        self.async_mode = async_mode
+        self.trade_options = dict(trade_options or {})
+        self.max_restart_delay_sec = max_restart_delay_sec
+
+        self.ring = ConsistentHashRing(range(shards))
+        self.tickers = list(dict.fromkeys(tickers))
+        self.assignment = self.ring.assign(self.tickers)
+
+        # Bursts up to one request per worker
+        self.rate_limiter = SharedTokenBucket(rate_limit/60, capacity=shards)
+        self.reports = multiprocessing.Queue()
+
+        self._processes = {}    # shard: multiprocessing.Process
+        self._failures = {}     # shard: consecutive failures
+        self._restartAt = {}    # shard: monotonic time of the next start
+        self.restarts = {x: 0 for x in self.assignment}
+        self.lag = {}           # shard: the last reported cycle statistics
+
+    def _start(self, shard):
+
+        process = multiprocessing.Process(
+            target=_run_shard,
+            args=(
+                shard,
+                self.assignment[shard],
+                self.connect,
+                self.rate_limiter,
+                self.reports,
+                self.async_mode,
+                self.trade_options,
+                ),
+            name='shard-{}'.format(shard),
+            daemon=True,
+            )
+        process.start()
+        self._processes[shard] = process
+
+    def _stop(self, shard, timeout_sec=30):
+
+        process = self._processes.pop(shard, None)
+        if process is None or not process.is_alive():
+            return
+
+        # Interrupt first, so the worker flushes its queued rows
+        os.kill(process.pid, signal.SIGINT)
+        process.join(timeout_sec)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    def start(self):
+
+        for shard, tickers in self.assignment.items():
+            if tickers:
+                self._start(shard)
+
+    def stop(self):
+
+        for shard in list(self._processes):
+            self._stop(shard)
+
+    def poll(self):
+        """
+        Collect the workers' reports, and restart any that have failed (a
+        nonzero exit code, or killed by a signal). A worker that exited
+        cleanly (e.g. no valid tickers left to poll) isn't restarted.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        while True:
+            try:
+                shard, pid, reportTime, stats = self.reports.get_nowait()
+            except queue.Empty:
+                break
+            if shard in self._processes and self._processes[shard].pid == pid:
+                self.lag[shard] = dict(stats, reported=reportTime)
+                self._failures[shard] = 0
+
+        now = time.monotonic()
+        for shard, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+
+            if process.exitcode == 0:
+                del self._processes[shard]
+                self._failures.pop(shard, None)
+                self._restartAt.pop(shard, None)
+                coftc_logging.notifications('Quote shard {} finished - not restarting'.format(shard))
+                continue
+
+            if shard not in self._restartAt:
+                failures = self._failures.get(shard, 0)
+                delay = min([self.max_restart_delay_sec, 2**failures - 1])
+                self._failures[shard] = failures + 1
+                self._restartAt[shard] = now + delay
+                coftc_logging.notifications(
+                    'Quote shard {} exited ({}) - restarting in {:.0f} sec'.format(shard, process.exitcode, delay)
+                    )
+            if now >= self._restartAt[shard]:
+                del self._restartAt[shard]
+                self.restarts[shard] += 1
+                self._start(shard)
+
+    def reshard(self, shards=None, tickers=None):
+        """
+        Change the number of shards and/or the tickers. Only the workers
+        whose tickers changed are restarted.
+
+        Returns
+        -------
+        list
+            The restarted shards.
+
+        """
+
+        if shards is not None and shards < 1:
+            raise ValueError('shards must be at least 1 (got {})'.format(shards))
+
+        if tickers is not None:
+            self.tickers = list(dict.fromkeys(tickers))
+        if shards is not None:
+            for shard in set(range(shards)) - set(self.ring.nodes):
+                self.ring.add(shard)
+                self.restarts.setdefault(shard, 0)
+            for shard in set(self.ring.nodes) - set(range(shards)):
+                self.ring.remove(shard)
+
+        assignment = self.ring.assign(self.tickers)
+        changed = [
+            x for x in set(assignment) | set(self.assignment)
+            if assignment.get(x) != self.assignment.get(x)
+            ]
+        for shard in changed:
+            self._stop(shard)
+            self.lag.pop(shard, None)
+            self._restartAt.pop(shard, None)
+        self.assignment = assignment
+        for shard in changed:
+            if assignment.get(shard):
+                self._start(shard)
+
+        return(sorted(changed))
+
+    def summary(self):
+        """
+        Returns
+        -------
+        str
+            One line per shard: tickers, last reported lag and restarts.
+
+        """
+
+        lines = []
+        for shard, tickers in sorted(self.assignment.items()):
+            stats = self.lag.get(shard)
+            if stats is None:
+                lagStr = 'no report yet'
+            else:
+                lagStr = 'lag {:.1f} sec{} ({:.0f} sec ago)'.format(
+                    stats['lag_sec'],
+                    '' if stats.get('lag_ticker') is None else ', {}'.format(stats['lag_ticker']),
+                    time.time() - stats['reported'],
+                    )
+            lines.append(
+                'Shard {}: {} tickers, {}, {} restarts'.format(shard, len(tickers), lagStr, self.restarts.get(shard, 0))
+                )
+
+        return('\n'.join(lines))
+
+    def run(self, report_sec=60, poll_sec=1):
+        """
+        Start the workers and supervise them until interrupted.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.start()
+        try:
+            lastReport = time.monotonic()
+            while True:
+                time.sleep(poll_sec)
+                self.poll()
+                if time.monotonic() - lastReport >= report_sec:
+                    lastReport = time.monotonic()
+                    print('Shards at {} Mountain\n{}\n'.format(pendulum.now().format('HH:mm:SS'), self.summary()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
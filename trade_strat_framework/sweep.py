@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .analyze import Analyze
+from .backtest import Backtest
+from .history import QuoteHistory
+
+# The `QuoteHistory` arrays shared with the workers
+_SHARED_FIELDS = ['times', 'price', 'ask', 'bid', 'volume']
+
+# Backtest settings that can be swept (any other key must be
+# '<analysis>.<parameter>', e.g. 'rsi.window')
+_BACKTEST_KEYS = ['slippage_bps', 'commission', 'position_value', 'allow_short']
+
+# Whether higher is better for each `BacktestResult.summary` metric (other
+# metrics rank higher first unless `higher_is_better` says otherwise)
+METRIC_DIRECTIONS = {'pnl': True, 'win_rate': True, 'trades': False, 'max_drawdown': False}
+
+# Per-worker state (set by `_init_worker`)
+_worker = {}
+
+
+def grid_points(grid):
+    """
+    Every combination of a parameter grid.
+
+    Parameters
+    ----------
+    grid : dict
+        Parameter: list of values. The parameters are `analysis_types`
+        (required), `period_minutes`, `tickers` (lists of tickers), the
+        `Backtest` settings (`slippage_bps`, `commission`, `position_value`,
+        `allow_short`), and analysis parameters as '<analysis>.<parameter>'
+        (e.g. 'rsi.window').
+
+    Returns
+    -------
+    list of dict
+
+    """
+
+    keys = sorted(grid)
+    return([dict(zip(keys, values)) for values in itertools.product(*[grid[x] for x in keys])])
+
+
+def sample_points(grid, n, seed=None):
+    """
+    `n` distinct random combinations of a parameter grid (see
+    `grid_points`), without building the full grid.
+
+    Returns
+    -------
+    list of dict
+
+    """
+
+    keys = sorted(grid)
+    sizes = [len(grid[x]) for x in keys]
+    total = math.prod(sizes)
+    rng = np.random.default_rng(seed)
+
+    points = []
+    for flat in rng.choice(total, size=min(n, total), replace=False).tolist():
+        point = {}
+        for key, size in zip(reversed(keys), reversed(sizes)):
+            flat, idx = divmod(flat, size)
+            point[key] = grid[key][idx]
+        points.append({x: point[x] for x in keys})
+
+    return(points)
+
+
+def point_key(point):
+
+    return(json.dumps(point, sort_keys=True))
+
+
+def _drop_partial_line(path, chunk_bytes=65536):
+
+    # Truncate the file to its last newline, so a line cut short by an
+    # interrupted run doesn't swallow the next result appended to it
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        keep = end
+        while keep > 0:
+            start = max([0, keep - chunk_bytes])
+            f.seek(start)
+            newline = f.read(keep - start).rfind(b'\n')
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            keep = start
+        if keep < end:
+            f.truncate(keep)
+
+
+def _init_worker(tickers, path):
+
+    # Map the shared arrays read-only (the pages are shared between the
+    # workers through the page cache)
+    arrays = {x: np.load(os.path.join(path, x + '.npy'), mmap_mode='r') for x in _SHARED_FIELDS}
+    _worker['history'] = {None: QuoteHistory(tickers, **arrays)}
+
+
+def _history(period_minutes):
+
+    if period_minutes not in _worker['history']:
+        _worker['history'][period_minutes] = _worker['history'][None].resample(period_minutes)
+
+    return(_worker['history'][period_minutes])
+
+
+def _run_point(point):
+
+    history = _history(point.get('period_minutes'))
+    if point.get('tickers'):
+        history = history.select(point['tickers'])
+
+    params = {}
+    for key, value in point.items():
+        if '.' in key:
+            name, param = key.split('.', 1)
+            params.setdefault(name, {})[param] = value
+
+    analyzer = Analyze(None, None, analysis_types=point['analysis_types'], dev=True)
+    analyzer.configure(params)
+    backtest = Backtest(analyzer, **{x: point[x] for x in _BACKTEST_KEYS if x in point})
+
+    return(point, backtest.run(history).summary())
+
+
+class ParameterSweep:
+    """ Run `Backtest` over many parameter combinations in parallel.
+
+    The history is written once to `.npy` files that every worker maps
+    read-only, so the workers share one copy and each grid point only sends
+    its parameters. Results are appended to `results_path` (JSON lines) as
+    they finish, and points already there are skipped, so an interrupted
+    sweep resumes where it stopped.
+
+    """
+
+    def __init__(self, history, results_path, processes=None, metric='pnl', higher_is_better=None):
+
+        self.history = history
+        self.results_path = Path(results_path)
+        self.processes = processes or os.cpu_count()
+        self.metric = metric
+        # By default, from `METRIC_DIRECTIONS`
+        self.higher_is_better = METRIC_DIRECTIONS.get(metric, True) if higher_is_better is None else higher_is_better
+
+    def results(self):
+        """
+        Returns
+        -------
+        dict
+            Point key: result (the point's parameters and `summary()`) of
+            every finished point.
+
+        """
+
+        finished = {}
+        if self.results_path.exists():
+            with open(self.results_path) as f:
+                for line in f:
+                    # A line cut short by an interrupted run is rerun
+                    try:
+                        result = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    finished[result['key']] = result
+
+        return(finished)
+
+    def ranked(self):
+        """
+        Returns
+        -------
+        list of dict
+            The finished results, best `metric` first (see
+            `higher_is_better`), and those without a value (None or NaN)
+            last.
+
+        """
+
+        sign = -1 if self.higher_is_better else 1
+
+        def rank(result):
+            value = result['summary'].get(self.metric)
+            if value is None or math.isnan(value):
+                return((True, 0))
+            return((False, sign*value))
+
+        return(sorted(self.results().values(), key=rank))
+
+    def run(self, points, callback=None):
+        """
+        Run the points not yet in `results_path`.
+
+        Parameters
+        ----------
+        points : list of dict
+            From `grid_points` or `sample_points`.
+        callback : callable, optional
+            Called with each result as it finishes.
+
+        Returns
+        -------
+        list of dict
+            All finished results, ranked (see `ranked`).
+
+        """
+
+        finished = self.results()
+        todo = list({point_key(x): x for x in points if point_key(x) not in finished}.values())
+
+        if todo:
+            _drop_partial_line(self.results_path)
+            with tempfile.TemporaryDirectory(prefix='sweep_') as path:
+                for field in _SHARED_FIELDS:
+                    np.save(os.path.join(path, field + '.npy'), getattr(self.history, field))
+
+                with multiprocessing.Pool(
+                        min(self.processes, len(todo)),
+                        initializer=_init_worker,
+                        initargs=(self.history.tickers, path),
+                        ) as pool, open(self.results_path, 'a') as f:
+                    for point, summary in pool.imap_unordered(_run_point, todo):
+                        result = {'key': point_key(point), 'point': point, 'summary': summary}
+                        f.write(json.dumps(result) + '\n')
+                        f.flush()
+                        if callback is not None:
+                            callback(result)
+
+        return(self.ranked())
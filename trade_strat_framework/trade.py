@@ -1,20 +1,35 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
-from pathlib import Path
 import os
 import pendulum
 import importlib
-import requests
-import math
 import time
+import asyncio
+import collections
+from http import HTTPStatus
+from typing import Optional
+from contextlib import contextmanager, nullcontext
 
 import typer
-import coftc_cred_man
-import coftc_db_utils
 import coftc_logging
-from tda import auth, client
+
+import numpy as np
+
+from .analyze import Analyze
+from .candles import CANDLES_FIELDS, CandleBuilder
+from .checkpoint import LoopCheckpoint
+from .metrics import Metrics, SamplingProfiler
+from .paper import FILLS_FIELDS, PaperTrader
+from .market import load_calendar
+from .ratelimit import BatchPlanner, TokenBucket, retry_after_sec
+from .schedule import DeadlineScheduler
+from .state import TickerState
+from .store import QuoteStore
+from .stream import LevelOneMerger, replay_level_one, tda_level_one
+from .transform import QUOTES_FIELDS, QuoteBatch, ny_local_seconds
+from .watchlist import Watchlist, WatchlistDiff
+from .writer import BufferedWriter
 
 # Create typer app
 app = typer.Typer()
@@ -41,6 +56,83 @@ class Trade:
                 15, '--period',
                 help="The time period (in minutes) with which to store quotes (and calculations)",
                 ),
+            batch_size: int = typer.Option(
+                100, '--batch-size',
+                help="The maximum number of tickers per `get_quotes` request (adapted down when requests are slow or fail)",
+                ),
+            rate_limit: float = typer.Option(
+                110, '--rate-limit',
+                help="The maximum number of `get_quotes` requests per minute (TDA allows 120)",
+                ),
+            max_concurrent: int = typer.Option(
+                4, '--max-concurrent',
+                help="The maximum number of `get_quotes` requests in flight at once (async mode)",
+                ),
+            coalesce_sec: float = typer.Option(
+                10, '--coalesce',
+                help="Tickers due within this many seconds of each other are requested together",
+                ),
+            buffer_size: int = typer.Option(
+                256, '--buffer-size',
+                help="The number of recent quotes kept in memory for each ticker",
+                ),
+            candle_periods: str = typer.Option(
+                '1', '--candles',
+                help="Candle timeframes to build, as multiples of the period (e.g. '1, 4')",
+                ),
+            write_behind: bool = typer.Option(
+                True, '--write-behind/--no-write-behind',
+                help="Insert quotes from a background thread (buffered multi-row inserts)"),
+            flush_rows: int = typer.Option(
+                5000, '--flush-rows',
+                help="Buffered quotes are inserted once this many rows are waiting (write-behind)",
+                ),
+            flush_sec: float = typer.Option(
+                5, '--flush-sec',
+                help="Buffered quotes are inserted at most this many seconds after being queued (write-behind)",
+                ),
+            paper: bool = typer.Option(
+                False, '--paper', show_default=False,
+                help="Paper trade the analysis signals against the quotes as they arrive"),
+            analysis_types: Optional[str] = typer.Option(
+                None, '--analysis',
+                help="List of analysis types to use when determining buy/sell signals"),
+            position_value: float = typer.Option(
+                10000, '--position-value',
+                help="The value of each position opened on a buy signal (paper trading)",
+                ),
+            metrics_interval: float = typer.Option(
+                300, '--metrics-interval',
+                help="Print a summary of the loop timings every this many seconds (0 to only print at the end)",
+                ),
+            metrics_port: int = typer.Option(
+                0, '--metrics-port',
+                help="Serve the loop timings on this local port (Prometheus text format; 0 to disable)",
+                ),
+            profile: bool = typer.Option(
+                False, '--profile', show_default=False,
+                help="Sample which stage of the loop is running (included in the metrics summary)"),
+            checkpoint: Optional[str] = typer.Option(
+                None, '--checkpoint',
+                help="Save the per-ticker loop state to this file every cycle, and resume from it on restart"),
+            max_idle_periods: int = typer.Option(
+                4, '--max-idle-periods',
+                help="Poll tickers whose quote time isn't changing up to this many periods apart (1 to poll every period)",
+                ),
+            market_hours: str = typer.Option(
+                'regular', '--market-hours',
+                help="Only poll during these market sessions: 'regular', 'extended' (pre-market and after hours too) or 'always'",
+                ),
+            calendar_path: Optional[str] = typer.Option(
+                None, '--calendar',
+                help="The market calendar file (default resources/market_calendar.json in the package)"),
+            watchlist_path: Optional[str] = typer.Option(
+                None, '--watchlist',
+                help="Also store the tickers in this TOML file, applying changes to it without a restart"),
+            watchlist_check_sec: float = typer.Option(
+                30, '--watchlist-check',
+                help="Check the watchlist file for changes at most every this many seconds",
+                ),
             interactive: bool = typer.Option(
                 True, '--interactive', '-i', show_default=False,
                 help="Run the script interactively (rather than automated)"),
@@ -50,12 +142,33 @@ class Trade:
             ):
         
         # TODO: Set up options for 'trade only', 'simulate only', or both.
-        # Currently this is only simulate (need to fix TDA login before
-        # trades are possible)
+        # Currently this is only simulate (`--paper`; need to fix TDA login
+        # before trades are possible)
 
         # If this is run in an interpreter, set the optional Options to their
         # defaults so the user doesn't have to
         self.period_minutes = period_minutes.default if isinstance(period_minutes, typer.models.OptionInfo) else period_minutes    
+        self.batch_size = batch_size.default if isinstance(batch_size, typer.models.OptionInfo) else batch_size
+        self.rate_limit = rate_limit.default if isinstance(rate_limit, typer.models.OptionInfo) else rate_limit
+        self.max_concurrent = max_concurrent.default if isinstance(max_concurrent, typer.models.OptionInfo) else max_concurrent
+        self.coalesce_sec = coalesce_sec.default if isinstance(coalesce_sec, typer.models.OptionInfo) else coalesce_sec
+        self.buffer_size = buffer_size.default if isinstance(buffer_size, typer.models.OptionInfo) else buffer_size
+        self.candle_periods = candle_periods.default if isinstance(candle_periods, typer.models.OptionInfo) else candle_periods
+        self.write_behind = write_behind.default if isinstance(write_behind, typer.models.OptionInfo) else write_behind
+        self.flush_rows = flush_rows.default if isinstance(flush_rows, typer.models.OptionInfo) else flush_rows
+        self.flush_sec = flush_sec.default if isinstance(flush_sec, typer.models.OptionInfo) else flush_sec
+        self.paper = paper.default if isinstance(paper, typer.models.OptionInfo) else paper
+        self.analysis_types = analysis_types.default if isinstance(analysis_types, typer.models.OptionInfo) else analysis_types
+        self.position_value = position_value.default if isinstance(position_value, typer.models.OptionInfo) else position_value
+        self.metrics_interval = metrics_interval.default if isinstance(metrics_interval, typer.models.OptionInfo) else metrics_interval
+        self.metrics_port = metrics_port.default if isinstance(metrics_port, typer.models.OptionInfo) else metrics_port
+        self.profile = profile.default if isinstance(profile, typer.models.OptionInfo) else profile
+        checkpoint = checkpoint.default if isinstance(checkpoint, typer.models.OptionInfo) else checkpoint
+        self.max_idle_periods = max_idle_periods.default if isinstance(max_idle_periods, typer.models.OptionInfo) else max_idle_periods
+        self.market_hours = market_hours.default if isinstance(market_hours, typer.models.OptionInfo) else market_hours
+        self.calendar_path = calendar_path.default if isinstance(calendar_path, typer.models.OptionInfo) else calendar_path
+        watchlist_path = watchlist_path.default if isinstance(watchlist_path, typer.models.OptionInfo) else watchlist_path
+        self.watchlist_check_sec = watchlist_check_sec.default if isinstance(watchlist_check_sec, typer.models.OptionInfo) else watchlist_check_sec
         self.interactive = interactive.default if isinstance(interactive, typer.models.OptionInfo) else interactive        
         self.dev = dev.default if isinstance(dev, typer.models.OptionInfo) else dev
         
@@ -67,190 +180,930 @@ class Trade:
         # Set credential manager
         self._client = tda_client
         self._conn = db_conn    
+        self._writer = None     # writer.BufferedWriter, while writing behind
+        
+        # Called with a dict of statistics at the end of each polling cycle
+        # (e.g. to report lag to a supervisor)
+        self.cycle_hooks = []
+        
+        # Timings of each stage of the loop (see `_instrumented`)
+        self.metrics = Metrics()
+        self.profiler = None
+        self._lastSummary = time.monotonic()
+        
+        # `get_quotes` pacing (bursts up to the number of concurrent
+        # requests) and batching
+        self.rate_limiter = TokenBucket(self.rate_limit/60, capacity=self.max_concurrent)
+        self.planner = BatchPlanner(max_batch=self.batch_size)
+        
+        # The per-ticker state saved each cycle, so a restart resumes the
+        # cadence instead of starting over with an initial read
+        self.checkpoint = None if checkpoint is None else LoopCheckpoint(checkpoint, self.period_minutes)
+        
+        # The last stored quote time (UTC epoch seconds) of each ticker, to
+        # drop repeated quotes before they're inserted (the `quotes` unique
+        # key would ignore them), and the number dropped per ticker
+        self.last_quote_sec = {}
+        self.duplicates = collections.Counter()
+        
+        # The market's sessions (loaded on first use, see `calendar`):
+        # outside them the loop sleeps until the next open
+        self._calendar = None
+        
+        # Tickers fed from a file, added and dropped as it changes (see
+        # `_update_watchlist`)
+        self.watchlist = None if watchlist_path is None else Watchlist(watchlist_path, self.watchlist_check_sec)
+        self.scheduler = None
+        
+        # Recent quotes of each ticker (read by Analyze without a query)
+        self.quote_store = QuoteStore(capacity=self.buffer_size)
+        
+        # Candles built from the quotes as they arrive
+        self.candles = CandleBuilder(
+            self.period_minutes,
+            multiples=[int(x) for x in self.candle_periods.replace(',', ' ').split()],
+            )
+        
+        # Paper trading of the analysis signals (fills are inserted into
+        # `fills` along with the quotes)
+        if self.paper:
+            self.analyzer = Analyze(self._client, self._conn, analysis_types=self.analysis_types, dev=self.dev)
+            self.analyzer.quote_store = self.quote_store
+            self.paper_trader = PaperTrader(self.quote_store, position_value=self.position_value)
+        else:
+            self.analyzer = None
+            self.paper_trader = None
+
+    @property
+    def calendar(self):
+        
+        # None with `--market-hours always` (poll around the clock)
+        if self._calendar is None and self.market_hours != 'always':
+            self._calendar = load_calendar(self.calendar_path, self.market_hours)
+        
+        return(self._calendar)
 
     @coftc_logging.exceptions()
     def json_quotes(self, ticker):
         
-        r = self._client.get_quotes(ticker)
-        assert r.status_code == requests.codes.okay, r.raise_for_status()
+        # Split into batches planned for the current batch size, each paced
+        # by the rate limiter
+        quoteDict = {}
+        for batch in self.planner.plan([ticker] if isinstance(ticker, str) else list(ticker)):
+            quoteDict.update(self._get_quotes(batch))
         
-        return(r.json())
+        return(quoteDict)
     
-    @coftc_logging.exceptions()
-    def store_quotes(self, ticker):
-        
-        # This is tightly coupled with the database - hardcode the conversions
-        # as (API name, Database field name)
-        dbFieldTransmute = [
-            ('symbol', 'ticker'),
-            ('lastPrice', 'price'),
-            ('askPrice', 'ask'),
-            ('bidPrice', 'bid'),
-            ('totalVolume', 'volume'),
-            ('delayed', 'delayed'),
-            ('quoteTimeInLong', 'datetime_newyork'),
+    def _get_quotes(self, batch, attempt=0):
+        
+        while True:
+            self.rate_limiter.acquire()
+            requestStart = time.monotonic()
+            r = self._client.get_quotes(batch)
+            backoff = self._check_quotes_response(r, batch, time.monotonic() - requestStart, attempt)
+            if backoff is None:
+                return(r.json())
+            
+            if r.status_code == HTTPStatus.REQUEST_URI_TOO_LONG and len(batch) > 1:
+                # Too many symbols for one request: split it
+                half = len(batch)//2
+                return({**self._get_quotes(batch[:half]), **self._get_quotes(batch[half:])})
+            
+            self.rate_limiter.pause(backoff)
+            attempt += 1
+    
+    def _check_quotes_response(self, r, batch, latency_sec, attempt, max_attempts=5):
+        """
+        Record the outcome of a `get_quotes` request with the batch planner,
+        and decide whether to retry it.
+
+        Returns
+        -------
+        float or None
+            The seconds to back off before retrying, or None if the request
+            succeeded.
+
+        """
+        
+        # Throttling is about the request count, not the batch size, so it
+        # isn't held against the batch size
+        ok = r.status_code == HTTPStatus.OK
+        self.metrics.observe('request_sec', latency_sec)
+        if not ok:
+            self.metrics.count('http_{}'.format(r.status_code))
+        if r.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+            self.planner.record(len(batch), latency_sec, ok)
+        if ok:
+            return(None)
+        
+        # Throttling is retried for as long as it takes (the loop must not
+        # crash on it); server errors and oversized requests a few times
+        if r.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+            if attempt == 0:
+                coftc_logging.notifications('get_quotes was throttled (429) - backing off')
+            return(retry_after_sec(r, attempt))
+        if (r.status_code >= 500 or r.status_code == HTTPStatus.REQUEST_URI_TOO_LONG) and attempt < max_attempts:
+            return(retry_after_sec(r, attempt))
+        
+        assert r.status_code == HTTPStatus.OK, r.raise_for_status()
+    
+    def _build_rows(self, quoteDict, tickerList, readDt, firstLoop):
+        """
+        Update the per-ticker state in `tickerList` (and the in-memory
+        quotes and candles) from a `get_quotes` response and build the rows
+        for the `quotes` and `candles` inserts.
+
+        Parameters
+        ----------
+        quoteDict : dict
+            The JSON response from `get_quotes`, keyed by symbol.
+        tickerList : state.TickerState
+            Per-ticker last read and quote time (UTC epoch seconds), time
+            correction and the number of reads in a row that returned an
+            unchanged quote (updated in place). Symbols not yet in
+            `tickerList` are added.
+        readDt : pendulum.DateTime
+            The time the response was read (New York time zone).
+        firstLoop : bool
+            Whether this is the first read of these tickers (stored in the
+            `initial` field).
+
+        Returns
+        -------
+        list
+            Quotes rows, in the order of `QUOTES_FIELDS`.
+        list
+            Finished candles, in the order of `CANDLES_FIELDS`.
+        list
+            Paper trading fills, in the order of `FILLS_FIELDS`.
+
+        """
+        
+        quoteDict = self._drop_unchanged(quoteDict, tickerList, readDt)
+        
+        # Convert the whole response at once (quote times are converted to
+        # New York time in one pass)
+        batch = QuoteBatch(quoteDict)
+        self.quote_store.append_batch(batch)
+        self.last_quote_sec.update(zip(batch.symbols, batch.epoch_sec.tolist()))
+        
+        # The previous quote time of each ticker (-1 if not yet read, or if
+        # the last read was unchanged - the quote time then says nothing
+        # about the polling offset)
+        rows = tickerList.add_tickers(batch.symbols)
+        prevSec = np.where(tickerList['unchanged'][rows] == 0, tickerList['quote_sec'][rows], -1)
+        
+        # If this isn't the first time through, compare the quote with
+        # (previous + expected period). Ensure the proper time period is
+        # maintained. If firstLoop, cannot have an error
+        if firstLoop:
+            timeCorrection = np.zeros(len(batch), dtype=np.int64)
+        else:
+            timeCorrection = np.where(
+                prevSec >= 0,
+                batch.epoch_sec - (prevSec + self.period_minutes*60),
+                0,
+                )
+        tickerList.update(
+            rows,
+            read_sec=readDt.timestamp(),
+            quote_sec=batch.epoch_sec,
+            time_correction_sec=timeCorrection,
+            delayed=batch.delayed,
+            unchanged=0,
+            )
+        
+        timeCorrection = timeCorrection.tolist()
+        if not firstLoop:
+            self.metrics.observe_many('time_correction_sec', timeCorrection)
+            self.metrics.set_per_ticker('time_correction_sec', batch.symbols, timeCorrection)
+        
+        # Update the candles (the `initial` rows are skipped, and late
+        # quotes are placed using time_correction_sec), then finish any
+        # candles that have ended
+        candleList = self.candles.update(batch, timeCorrection, firstLoop)
+        candleList += self.candles.close_due(int(ny_local_seconds([readDt.int_timestamp])[0]))
+        
+        fillList = self._paper_trade(batch, readDt)
+        
+        # Include time_correction_sec calculation, and use firstLoop as for
+        # the value in the `initial` field (the `initial` field will be used
+        # for candle calculations - if `initial`==True, calcs will not be
+        # made)
+        return(batch.rows(timeCorrection, firstLoop), candleList, fillList)
+    
+    def _drop_unchanged(self, quoteDict, tickerList, readDt):
+        """
+        Drop the quotes whose time (to the second, as in the `quotes` unique
+        key) is the last stored one of the ticker, counting them per ticker.
+        Their `tickerList` rows record the read, with no time correction.
+
+        Returns
+        -------
+        dict
+            The quotes that changed.
+
+        """
+        
+        lastSec = self.last_quote_sec
+        unchanged = [
+            key for key, quote in quoteDict.items()
+            if lastSec.get(key) == quote['quoteTimeInLong']//1000
             ]
+        if not unchanged:
+            return(quoteDict)
+        
+        for key in unchanged:
+            self.duplicates[key] += 1
+        rows = tickerList.rows(unchanged)
+        rows = rows[rows >= 0]
+        tickerList.update(
+            rows,
+            read_sec=readDt.timestamp(),
+            time_correction_sec=0,
+            unchanged=tickerList['unchanged'][rows] + 1,
+            )
+        self.metrics.count('duplicate_quotes', len(unchanged))
+        self.metrics.set_per_ticker('duplicates_skipped', unchanged, [self.duplicates[x] for x in unchanged])
+        
+        unchanged = set(unchanged)
+        return({key: quote for key, quote in quoteDict.items() if key not in unchanged})
+    
+    def _poll_periods(self, tickerList, rows):
+        
+        # Back off polling of tickers whose quote keeps coming back
+        # unchanged (doubling per unchanged read, up to max_idle_periods).
+        # Rows of -1 (not yet read) are polled every period
+        unchanged = tickerList.values('unchanged', rows)
+        periods = np.left_shift(1, np.minimum(unchanged, 30).astype(np.int64))
+        
+        return(np.clip(periods, 1, max([1, self.max_idle_periods])))
+    
+    def _paper_trade(self, batch, readDt):
+        
+        # Fill resting limit orders against the new quotes, then trade the
+        # updated signals (filled at the read time)
+        if self.paper_trader is None or len(batch) == 0:
+            return([])
+        
+        fillDt = readDt.naive()
+        fillList = self.paper_trader.on_quotes(batch.symbols, fillDt)
+        fillList += self.paper_trader.on_signals(
+            batch.symbols,
+            self.analyzer.signal_batch(batch.symbols, batch.price),
+            fillDt,
+            )
+        
+        return(fillList)
+    
+    def _warm_paper(self, ticker):
+        
+        # Warm the analyses from the stored quotes, so signals are available
+        # from the first read. While writing behind, the writer thread
+        # shares the connection
+        if self.analyzer is not None:
+            with nullcontext() if self._writer is None else self._writer.lock:
+                self.analyzer.warm_from_db(
+                    [ticker] if isinstance(ticker, str) else list(ticker),
+                    period_minutes=self.period_minutes,
+                    )
+    
+    def _report_cycle(self, stats):
+        
+        self.metrics.observe('cycle_sec', stats['loop_sec'])
+        self.metrics.observe('pause_sec', stats['pause_sec'])
+        self.metrics.count('cycles')
+        self.metrics.count('symbols', stats['symbols'])
+        if stats['pause_sec'] == 0:
+            self.metrics.count('cycles_without_pause')
+        
+        if self.metrics_interval and time.monotonic() - self._lastSummary >= self.metrics_interval:
+            self._print_metrics()
+        
+        for hook in self.cycle_hooks:
+            hook(stats)
+    
+    def _print_metrics(self):
+        
+        self._lastSummary = time.monotonic()
+        print('At {} Mountain:\n{}'.format(pendulum.now().format('HH:mm:SS'), self.metrics.summary()))
+        if self.profiler is not None:
+            print(self.profiler.summary())
+        print()
+    
+    @contextmanager
+    def _instrumented(self):
+        """
+        Serve the metrics (if `metrics_port`) and run the sampling profiler
+        (if `profile`) for the duration of the context, and print the
+        metrics summary on exit.
+
+        """
+        
+        server = self.metrics.serve(self.metrics_port) if self.metrics_port else None
+        if self.profile:
+            self.profiler = SamplingProfiler(self.metrics).start()
+        
+        try:
+            yield
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+            self._print_metrics()
+            if server is not None:
+                server.shutdown()
+    
+    def _restore_checkpoint(self, tickers):
+        """
+        The checkpointed state of `tickers` (see `checkpoint.LoopCheckpoint`),
+        restoring the adapted batch size.
+
+        Returns
+        -------
+        dict
+            'tickerList' (a `state.TickerState`) and 'deadlines' (wall-clock
+            epoch seconds) of the checkpointed tickers in `tickers` (both
+            empty if there is no usable checkpoint, or when interactive).
+
+        """
+
+        state = None if self.checkpoint is None or self.interactive else self.checkpoint.load()
+        if state is None:
+            return({'tickerList': TickerState(), 'deadlines': {}})
+
+        self.planner.batch_size = min([self.planner.max_batch, max([self.planner.min_batch, state['batch_size']])])
+
+        # Only tickers still on their cadence (see `LoopCheckpoint`) resume
+        tickers = [x for x in tickers if x in state['deadlines']]
+        print(
+            'Resuming {} of {} tickers from {} (saved {:.0f} sec ago)'.format(
+                len(tickers), len(state['tickerList']), self.checkpoint.path, time.time() - state['saved_sec'],
+                )
+            )
+
+        tickerList = state['tickerList'].select(tickers)
+        self.last_quote_sec.update(zip(tickerList.tickers, tickerList['quote_sec'].tolist()))
+        
+        return(
+            {
+                'tickerList': tickerList,
+                'deadlines': {x: state['deadlines'][x] for x in tickers},
+                }
+            )
+
+    def _closed_seconds(self, nextSec):
+        """
+        Returns
+        -------
+        float
+            Seconds from now until the market opens if it's closed at
+            `nextSec` (wall-clock epoch seconds, e.g. the next deadline),
+            else 0 (always 0 when interactive, or with `--market-hours
+            always`).
+
+        """
+
+        if self.interactive or self.calendar is None:
+            return(0)
+
+        openSec = self.calendar.next_open(nextSec)
+        if openSec <= nextSec:
+            return(0)
+
+        self.metrics.count('market_closed_sleeps')
+        print(
+            'Market closed: sleeping until {} New York time'.format(
+                pendulum.from_timestamp(openSec, 'America/New_York').format('ddd YYYY-MM-DD HH:mm'),
+                )
+            )
+
+        return(max([0, openSec - time.time()]))
+
+    def _with_watchlist(self, ticker):
+        
+        # `ticker` (a symbol or a list) and the watchlist's tickers
+        tickers = [ticker] if isinstance(ticker, str) else list(ticker)
+        if self.watchlist is not None:
+            tickers = list(dict.fromkeys(tickers + self.watchlist.tickers))
+        
+        return(tickers)
+
+    def _report_invalid(self, tickers, quoteDict):
+        
+        # TDA leaves unknown symbols out of the response
+        invalid = [x for x in tickers if x not in quoteDict]
+        if invalid:
+            self.metrics.count('invalid_tickers', len(invalid))
+            coftc_logging.notifications('Invalid tickers (no quote returned): {}'.format(', '.join(invalid)))
+
+    def _update_watchlist(self, tickerList, pinned=()):
+        """
+        Apply any change to the watchlist file: tickers removed from it
+        (other than `pinned`, the ones the loop was started with) are
+        dropped from the schedule and buffers, with their open candles
+        finished.
+
+        Returns
+        -------
+        watchlist.WatchlistDiff
+            The tickers dropped, and the tickers added (to be read, and so
+            validated, in one request).
+
+        """
+
+        diff = None if self.watchlist is None else self.watchlist.poll()
+        if diff is None:
+            return(WatchlistDiff([], []))
+
+        removed = [x for x in diff.removed if x not in pinned and x in tickerList]
+        added = [x for x in diff.added if x not in tickerList]
+        print('Watchlist {} changed: adding {}, dropping {}'.format(self.watchlist.path, len(added), len(removed)))
+
+        if removed:
+            for x in removed:
+                self.last_quote_sec.pop(x, None)
+                if self.scheduler is not None:
+                    self.scheduler.remove(x)
+            tickerList.remove_tickers(removed)
+            self.quote_store.remove_tickers(removed)
+            self._insert_rows([], self.candles.remove_tickers(removed))
+            self.metrics.count('watchlist_removed', len(removed))
+        self._warm_paper(added)
+
+        return(WatchlistDiff(added, removed))
+
+    def _save_checkpoint(self, tickerList, deadlines):
+
+        # `deadlines` are wall-clock epoch seconds
+        if self.checkpoint is not None:
+            with self.metrics.stage('checkpoint'):
+                self.checkpoint.save(tickerList, deadlines, self.planner.batch_size)
+
+    def _insert(self, table_name, fields, values):
+        
+        # Queue the rows if writing behind, otherwise insert now
+        if not values:
+            return
+        if self._writer is not None:
+            self._writer.put(table_name, values)
+        else:
+            self._conn.insert(table_name=table_name, fields=fields, values=values, on_duplicate='ignore')
+    
+    def _insert_rows(self, insertList, candleList=(), fillList=()):
+        
+        # Insert all into `quotes` table, finished candles into `candles`
+        # and paper trading fills into `fills`
+        self._insert('quotes', QUOTES_FIELDS, insertList)
+        self._insert('candles', CANDLES_FIELDS, candleList)
+        self._insert('fills', FILLS_FIELDS, fillList)
+    
+    @contextmanager
+    def _write_behind(self):
+        """
+        Run the write-behind thread (if enabled) for the duration of the
+        context. Queued rows are flushed on exit, including on
+        KeyboardInterrupt.
+
+        """
+        
+        if not self.write_behind:
+            yield
+            return
+        
+        # One thread writes every table, as the connection isn't thread-safe
+        try:
+            with BufferedWriter(
+                    self._conn,
+                    {'quotes': QUOTES_FIELDS, 'candles': CANDLES_FIELDS, 'fills': FILLS_FIELDS},
+                    flush_rows=self.flush_rows,
+                    flush_sec=self.flush_sec,
+                    metrics=self.metrics,
+                    ) as writer:
+                self._writer = writer
+                yield
+        finally:
+            self._writer = None
+    
+    @coftc_logging.exceptions()
+    def store_quotes(self, ticker=()):
+        
+        self._warm_paper(self._with_watchlist(ticker))
+        with self._instrumented(), self._write_behind():
+            self._store_quotes(ticker)
+    
+    def _store_quotes(self, ticker):
+        
+        # Per-ticker next-run deadlines (also reports per-ticker lateness)
+        self.scheduler = DeadlineScheduler()
         
         # Set a loop, but break it immediately if interactive
         firstLoop = True
+        
+        # Don't start polling until the market is open
+        with self.metrics.stage('closed'):
+            self.scheduler.sleep_for(self._closed_seconds(time.time()), step_sec=10 if self.dev else None)
+        
+        # Resume the checkpointed tickers on their cadence; only the others
+        # need an initial read (if none do, wait for the first deadline)
+        pinned = set([ticker] if isinstance(ticker, str) else ticker)
+        tickers = self._with_watchlist(ticker)
+        restored = self._restore_checkpoint(tickers)
+        tickerList = restored['tickerList']
+        monoOffset = self.scheduler.now() - time.time()
+        self.scheduler.schedule_many(
+            list(restored['deadlines']),
+            (np.fromiter(restored['deadlines'].values(), dtype=np.float64) + monoOffset).tolist(),
+            )
+        ticker = [x for x in tickers if x not in tickerList]
+        if not ticker:
+            firstLoop = False
+            with self.metrics.stage('sleep'):
+                self.scheduler.sleep_until_due(step_sec=10 if self.dev else None)
+            ticker = self.scheduler.pop_due(self.coalesce_sec, self.batch_size)
+        
         while True:
             loopTimeStart = pendulum.now('America/New_York')
             
-            quoteDict = self.json_quotes(ticker)
+            with self.metrics.stage('fetch'):
+                quoteDict = self.json_quotes(ticker)
             readDt = pendulum.now('America/New_York')
+            readMono = self.scheduler.now()
             
-            # If first time through, use the returned dict keys as the master
-            # ticker list (these are sanitized via tda-api) to store datetimes
-            # and nextRun to store the next runtimes (for not interactive)
             if firstLoop:
-                # tickerList has the same keys as quoteDict, but each key
-                # contains the 'last read' and 'quote' datetimes (in New York
-                # time zone)
-                tickerList = {
-                    key: {
-                        'read_dt_ny': None,
-                        'quote_dt_ny': None,
-                        'prev_quote_dt': None,
-                        'delayed': None,
-                        } for key in quoteDict.keys()
-                    }
-                
-                nextRun = {key: None for key in quoteDict.keys()}
-                
-            # Iterate through each currently-run symbol and store the matching
-            # values in `algo_trading`.`quotes`. Datetimes are stored in UTC.
-            insertList = []
-            for key in quoteDict.keys():
-                
-                # Update tickerList with new data
-                tickerList[key]['read_dt_ny'] = readDt
-                tickerList[key]['quote_dt_ny'] = pendulum.from_timestamp(
-                    int(
-                        str(
-                            quoteDict[key]['quoteTimeInLong']
-                            )[:-3]
-                        )
-                    ).in_tz('America/New_York')
-                tickerList[key]['delayed'] = quoteDict[key]['delayed']
-                
-                # If this isn't the first time through, compare the quote with
-                # (previous + expected period). Ensure the proper time period is maintained
-                if not firstLoop:               
-                    tickerList[key]['time_correction_period'] = tickerList[key]['quote_dt_ny'] - tickerList[key]['prev_quote_dt'].add(minutes=self.period_minutes)
-                    
-                    # raise Exception('breakpoint')
-                    
-                    # Correct the actual period based on history with the 
-                    # calculated period
-                    time_correction_sec = tickerList[key]['time_correction_period'].in_seconds()
-
-                    
-                # If firstLoop, cannot have an error. Initialize
-                # tickerList[key]['time_correction_period']
-                else:
-                    tickerList[key]['time_correction_period'] = tickerList[key]['quote_dt_ny'] - tickerList[key]['quote_dt_ny']
-                    time_correction_sec = 0
-                  
-                # Rewrite (or initialize) 'prev_quote_dt' for next loop
-                tickerList[key]['prev_quote_dt'] = tickerList[key]['quote_dt_ny']
-                
-                # Add to list for database insert
-                # Include time_correction_sec calculation, and use firstLoop
-                # as for the value in the `initial` field (the `initial` field
-                # will be used for candle calculations - if `initial`==True,
-                # calcs will not be made)
-                insertList.append(
-                    [
-                        pendulum.from_timestamp(
-                            int(
-                                str(
-                                    quoteDict[key][iterKey]
-                                    )[:-3]
-                                )
-                            ).in_tz('America/New_York') \
-                            if iterKey == 'quoteTimeInLong' else \
-                            quoteDict[key][iterKey] for iterKey in [
-                                x[0] for x in dbFieldTransmute
-                                ]
-                            ] + [time_correction_sec, firstLoop]
-                        )
-                
-            # Insert all into `quotes` table
-            self._conn.insert(table_name='quotes', fields=[x[1] for x in dbFieldTransmute]+['time_correction_sec', 'initial'], values=insertList, on_duplicate='ignore')
+                self._report_invalid(ticker, quoteDict)
             
-            print('Wrote {} at {} Mountain'.format(", ".join([quoteDict[key]['symbol'] for key in quoteDict.keys()]), pendulum.now().format('HH:mm:SS')))
+            with self.metrics.stage('transform'):
+                insertList, candleList, fillList = self._build_rows(quoteDict, tickerList, readDt, firstLoop)
+            with self.metrics.stage('insert'):
+                self._insert_rows(insertList, candleList, fillList)
+            
+            loopSec = (pendulum.now('America/New_York')-loopTimeStart).total_seconds()
 
             if self.interactive:
                 break
             
             else:   # if not interactive
             
-                # Finalizing
-                if firstLoop:
-                    loopTimeEnd = pendulum.now('America/New_York')
-                    loopSecPerSymbol = (loopTimeEnd-loopTimeStart).in_seconds()/len(ticker)
-                    
-                    firstLoop = False
+                firstLoop = False
             
-                # Determine when next to run the loop for each ticker
-                for key in quoteDict.keys():
-                    
-                    # Use the difference between the read
-                    # time and the quote time to calculate the next run time
-                    timeDiff = tickerList[key]['read_dt_ny'] - tickerList[key]['quote_dt_ny']
-                                
-                    # Add the specified period to the last quote time plus the
-                    # difference in quote and read (to get 'read_dt_ny'
-                    # without milliseconds)
-                    # Then add the 'time_correction_period' offset to correct
-                    # for any mismatch between expected and actual 'quote' time
-                    
-                    # The 'time_correction_period' seconds value is signed,
-                    # which works well with the subtract() function
-                    nextRun[key] = tickerList[key]['quote_dt_ny'].add(
-                        seconds=timeDiff.in_seconds()
-                        ).add(
-                            minutes=self.period_minutes
-                            ).subtract(
-                                seconds=math.floor(tickerList[key]['time_correction_period'].in_seconds()/2)
-                                )                                
-                    
-                print(nextRun)
+                self._schedule_next(list(quoteDict.keys()), tickerList, readMono)
                 
-                # Set the necessary next ticker and pause until next run
-                minNextRun = min([nextRun[key] for key in nextRun.keys()])
-                # Iterate twice to gain a better estimate for the amount of
-                # time the loop will take
-                for _ in range(2):
-                    newLoopSec = loopSecPerSymbol*len(ticker)
-                    ticker = [
-                        key for key in nextRun.keys() if nextRun[key] >= minNextRun.subtract(seconds=newLoopSec) and nextRun[key] <= minNextRun.add(seconds=newLoopSec)
-                        ]
+                # Apply any change to the watchlist: the added tickers get
+                # their initial read now, which also validates them
+                added = self._update_watchlist(tickerList, pinned).added
+                if added:
+                    with self.metrics.stage('fetch'):
+                        addedDict = self.json_quotes(added)
+                    self._report_invalid(added, addedDict)
+                    readDt = pendulum.now('America/New_York')
+                    readMono = self.scheduler.now()
+                    with self.metrics.stage('transform'):
+                        insertList, candleList, fillList = self._build_rows(addedDict, tickerList, readDt, True)
+                    with self.metrics.stage('insert'):
+                        self._insert_rows(insertList, candleList, fillList)
+                    self._schedule_next(list(addedDict.keys()), tickerList, readMono)
                 
-                print('Next ticker is {}'.format(', '.join(ticker)))
+                # With nothing to poll (every ticker dropped or invalid),
+                # wait for the watchlist to add some
+                while len(self.scheduler) == 0 and self.watchlist is not None:
+                    with self.metrics.stage('sleep'):
+                        self.scheduler.sleep_for(self.watchlist_check_sec)
+                    added = self._update_watchlist(tickerList, pinned).added
+                    if added:
+                        self.scheduler.schedule_many(added, [self.scheduler.now()]*len(added))
+                        firstLoop = True
+
+                # Without a watchlist, nothing can be added back
+                if len(self.scheduler) == 0:
+                    coftc_logging.notifications('store_quotes stopped: no valid tickers left to poll')
+                    break
+
+                wallOffset = time.time() - self.scheduler.now()
+                self._save_checkpoint(
+                    tickerList,
+                    {key: deadline + wallOffset for key, deadline in self.scheduler.deadlines().items()},
+                    )
+                
+                # If the market is closed at the next deadline, sleep until
+                # it opens and start the session with an initial read of
+                # every ticker (the cadence of the last session is stale)
+                closedSeconds = self._closed_seconds(self.scheduler.next_deadline() + wallOffset)
+                if closedSeconds > 0:
+                    pauseSeconds = closedSeconds
+                    with self.metrics.stage('closed'):
+                        self.scheduler.sleep_for(closedSeconds, step_sec=10 if self.dev else None)
+                    firstLoop = True
+                    ticker = self.scheduler.pop_all()
                 
-                pauseSeconds = max(
-                    [
-                        0,
-                        (minNextRun-pendulum.now('America/New_York')).in_seconds(),
-                        ]
-                    )   # ensure negative numbers are not allowed
+                else:
+                    pauseSeconds = self.scheduler.pause_seconds()
+                        
+                    if pauseSeconds == 0:
+                        coftc_logging.notifications('store_quotes loop is not pausing - possibly overloaded by the number of quotes')
                     
-                if pauseSeconds == 0:
-                    coftc_logging.notifications('store_quotes loop is not pausing - possibly overloaded by the number of quotes')
+                    # In dev mode, pause in 10-second increments to allow
+                    # KeyboardInterrupt
+                    with self.metrics.stage('sleep'):
+                        self.scheduler.sleep_until_due(step_sec=10 if self.dev else None)
                     
-                print('Pausing for {:.2f} min\n'.format(pauseSeconds/60))
+                    # Set the next tickers, coalescing those due within
+                    # `coalesce_sec` into the same request
+                    ticker = self.scheduler.pop_due(self.coalesce_sec, self.batch_size)
+                    self.metrics.observe_many('scheduler_lateness_sec', [self.scheduler.lateness[x] for x in ticker])
+                lateTicker, lateSec = self.scheduler.worst_lateness()
                 
-                if self.dev:     # in dev mode, pause in 10-second increments to
-                                 # allow KeyboardInterrupt
-                    pauseInt = math.floor(pauseSeconds/10)
-                    for idx in range(pauseInt):
-                        time.sleep(10)
-                    time.sleep(pauseSeconds - pauseInt*10)  # pause the remaining time, if applicable
-                    
-                else:
-                    time.sleep(pauseSeconds)
+                self._report_cycle(
+                    {
+                        'symbols': len(quoteDict),
+                        'loop_sec': loopSec,
+                        'pause_sec': pauseSeconds,
+                        'lag_sec': lateSec,
+                        'lag_ticker': lateTicker,
+                        }
+                    )
+    
+    def _schedule_next(self, keys, tickerList, readMono):
+        
+        # Determine when next to run the loop for each ticker: one period
+        # after this read (more for idle tickers), less half the
+        # 'time_correction_sec' offset to correct for any mismatch between
+        # expected and actual 'quote' time
+        
+        # The 'time_correction_sec' value is signed
+        rows = tickerList.add_tickers(keys)
+        deadlines = (
+            readMono
+            + self._poll_periods(tickerList, rows)*self.period_minutes*60
+            - np.floor_divide(tickerList['time_correction_sec'][rows], 2)
+            )
+        self.scheduler.schedule_many(keys, deadlines.tolist())
+    
+    @coftc_logging.exceptions()
+    def store_quotes_async(self, ticker=()):
+        """
+        Store quotes using tda-api's asynchronous client (`asyncio=True` when
+        the client is created).
+        
+        The tickers are split into batches by `self.planner` (at most
+        `self.batch_size`), and up to `self.max_concurrent` `get_quotes`
+        requests are kept in flight at once, paced by `self.rate_limiter`.
+        Each response is transformed and inserted while the remaining
+        batches are still being fetched, so one slow response (or a slow
+        database insert) doesn't hold back every other symbol.
+
+        Parameters
+        ----------
+        ticker : list
+            The tickers to store (as well as the watchlist's, if there is
+            one).
+
+        Returns
+        -------
+        float
+            The measured throughput (symbols/sec) of the last cycle.
+
+        """
+        
+        self._warm_paper(self._with_watchlist(ticker))
+        with self._instrumented(), self._write_behind():
+            return(asyncio.run(self._store_quotes_async(ticker)))
+    
+    async def _json_quotes_async(self, ticker, semaphore, attempt=0):
+        
+        while True:
+            async with semaphore:
+                await self.rate_limiter.acquire_async()
+                requestStart = time.monotonic()
+                r = await self._client.get_quotes(ticker)
+            backoff = self._check_quotes_response(r, ticker, time.monotonic() - requestStart, attempt)
+            if backoff is None:
+                return(r.json())
             
+            if r.status_code == HTTPStatus.REQUEST_URI_TOO_LONG and len(ticker) > 1:
+                half = len(ticker)//2
+                quoteDicts = await asyncio.gather(
+                    self._json_quotes_async(ticker[:half], semaphore),
+                    self._json_quotes_async(ticker[half:], semaphore),
+                    )
+                return({**quoteDicts[0], **quoteDicts[1]})
+            
+            self.rate_limiter.pause(backoff)
+            attempt += 1
+    
+    async def _poll_cycle_async(self, batches, tickerList, firstLoop):
+        """
+        Fetch every batch (at most `self.max_concurrent` at a time) and
+        insert each response as it arrives. Inserts are run one at a time in
+        a worker thread (the database connection isn't shared between
+        threads), overlapping with the fetches still in flight. With
+        write-behind enabled, this only queues the rows.
+
+        Returns
+        -------
+        set
+            The symbols returned (TDA leaves out unknown ones).
+
+        """
+        
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        insertQueue = asyncio.Queue()
+        
+        async def fetch(batch):
+            quoteDict = await self._json_quotes_async(batch, semaphore)
+            readDt = pendulum.now('America/New_York')
+            await insertQueue.put((quoteDict, readDt))
+        
+        async def insert():
+            returned = set()
+            while True:
+                item = await insertQueue.get()
+                if item is None:
+                    return(returned)
+                quoteDict, readDt = item
+                with self.metrics.stage('transform'):
+                    insertList, candleList, fillList = self._build_rows(quoteDict, tickerList, readDt, firstLoop)
+                insertStart = time.perf_counter()
+                await loop.run_in_executor(None, self._insert_rows, insertList, candleList, fillList)
+                self.metrics.observe('insert_sec', time.perf_counter() - insertStart)
+                returned.update(quoteDict)
+        
+        insertTask = asyncio.create_task(insert())
+        try:
+            await asyncio.gather(*[fetch(batch) for batch in batches])
+        finally:
+            # Let the inserter drain whatever was fetched before stopping
+            await insertQueue.put(None)
+            returned = await insertTask
+        
+        return(returned)
+    
+    async def _store_quotes_async(self, ticker):
+        
+        # Set a loop, but break it immediately if interactive
+        firstLoop = True
+        tickerList = TickerState()
+        
+        # Don't start polling until the market is open
+        closedSeconds = self._closed_seconds(time.time())
+        if closedSeconds > 0:
+            await asyncio.sleep(closedSeconds)
+        
+        pinned = set([ticker] if isinstance(ticker, str) else ticker)
+        ticker = self._with_watchlist(ticker)
+        
+        # Every ticker shares one cycle, so a checkpoint is only resumed if
+        # it covers them all (waiting for the saved next cycle)
+        restored = self._restore_checkpoint(ticker)
+        if restored['deadlines'] and len(restored['tickerList']) == len(set(ticker)):
+            tickerList = restored['tickerList']
+            tickerList.update(slice(None), next_cycle=0)
+            firstLoop = False
+            await asyncio.sleep(max([0, min(restored['deadlines'].values()) - time.time()]))
+        
+        # Idle tickers are skipped for some cycles (see `_poll_periods`);
+        # tickers not yet read are due every cycle
+        cycle = 0
+        while True:
+            loopTimeStart = time.monotonic()
+            
+            # Re-plan every cycle, as the batch size adapts
+            rows = tickerList.rows(ticker)
+            due = np.asarray(ticker, dtype=object)[tickerList.values('next_cycle', rows) <= cycle].tolist()
+            batches = self.planner.plan(due)
+            
+            returned = await self._poll_cycle_async(batches, tickerList, firstLoop)
+            symbolCount = len(returned)
+            if firstLoop:
+                self._report_invalid(due, returned)
+                ticker = [x for x in ticker if x in returned]
+            rows = tickerList.rows(due)
+            rows = rows[rows >= 0]
+            tickerList.update(rows, next_cycle=cycle + self._poll_periods(tickerList, rows))
+            cycle += 1
+            
+            # Apply any change to the watchlist: the added tickers get their
+            # initial read now, which also validates them
+            change = self._update_watchlist(tickerList, pinned)
+            if change.removed:
+                removed = set(change.removed)
+                ticker = [x for x in ticker if x not in removed]
+            if change.added:
+                addedReturned = await self._poll_cycle_async(self.planner.plan(change.added), tickerList, True)
+                symbolCount += len(addedReturned)
+                self._report_invalid(change.added, addedReturned)
+                added = [x for x in change.added if x in addedReturned]
+                tickerList.update(tickerList.rows(added), next_cycle=cycle)
+                ticker += added
+            
+            loopSec = time.monotonic() - loopTimeStart
+            symbolsPerSec = symbolCount/max(loopSec, 1e-6)
+            
+            if self.interactive:
+                break
+            
+            firstLoop = False
+            
+            # Every (active) ticker is polled once per period
+            pauseSeconds = max([0, self.period_minutes*60 - loopSec])
+            if pauseSeconds == 0:
+                coftc_logging.notifications('store_quotes_async loop is not pausing - possibly overloaded by the number of quotes')
+            
+            nextCycleSec = time.time() + pauseSeconds
+            self._save_checkpoint(tickerList, dict.fromkeys(tickerList.tickers, nextCycleSec))
+            
+            # If the market is closed by then, sleep until it opens and
+            # start the session with an initial read of every ticker (a
+            # restart after the open finds the checkpoint stale)
+            closedSeconds = self._closed_seconds(nextCycleSec)
+            if closedSeconds > 0:
+                pauseSeconds = closedSeconds
+                firstLoop = True
+                tickerList.update(slice(None), next_cycle=0)
+            
+            self._report_cycle(
+                {
+                    'symbols': symbolCount,
+                    'loop_sec': loopSec,
+                    'pause_sec': pauseSeconds,
+                    'lag_sec': max([0, loopSec - self.period_minutes*60]),
+                    'lag_ticker': None,
+                    }
+                )
+            
+            await asyncio.sleep(pauseSeconds)
+        
+        return(symbolsPerSec)
+    
+    @coftc_logging.exceptions()
+    def store_quotes_stream(self, ticker, replay_url=None, account_id=None):
+        """
+        Store quotes from TDA's level-one streaming API instead of polling
+        (requires the asynchronous client). Every update goes through the
+        same quotes, candles and paper trading path as a polled response.
+
+        Parameters
+        ----------
+        ticker : list
+            The tickers to subscribe to.
+        replay_url : str, optional
+            Read a recorded stream from a local replay server (see
+            `stream.serve_replay`, e.g. 'ws://localhost:8765') rather than
+            TDA, for offline testing.
+        account_id : int, optional
+            The TDA account for the stream login.
+
+        Returns
+        -------
+        int
+            The number of quote updates stored.
+
+        """
+        
+        ticker = list(ticker)
+        if replay_url is not None:
+            source = replay_level_one(replay_url)
+        else:
+            source = tda_level_one(self._client, ticker, account_id=account_id)
+        
+        self._warm_paper(ticker)
+        with self._instrumented(), self._write_behind():
+            return(asyncio.run(self._store_quotes_stream(source)))
+    
+    async def _store_quotes_stream(self, source):
+        
+        loop = asyncio.get_running_loop()
+        merger = LevelOneMerger()
+        quoteCount = 0
+        
+        async for message in source:
+            quoteDict = merger.apply(message.get('content', []))
+            if not quoteDict:
+                continue
+            readDt = pendulum.now('America/New_York')
+            
+            # Each update is stored at its own quote time, so there is no
+            # polling drift to correct (an empty tickerList gives a
+            # time_correction_sec of 0)
+            with self.metrics.stage('transform'):
+                insertList, candleList, fillList = self._build_rows(quoteDict, TickerState(), readDt, False)
+            insertStart = time.perf_counter()
+            if self._writer is not None:
+                self._insert_rows(insertList, candleList, fillList)
+            else:
+                await loop.run_in_executor(None, self._insert_rows, insertList, candleList, fillList)
+            self.metrics.observe('insert_sec', time.perf_counter() - insertStart)
+            self.metrics.count('stream_messages')
+            self.metrics.count('symbols', len(quoteDict))
+            quoteCount += len(quoteDict)
+            
+            if self.interactive:
+                break
+            
+            if self.metrics_interval and time.monotonic() - self._lastSummary >= self.metrics_interval:
+                self._print_metrics()
+        
+        return(quoteCount)
             
             
 
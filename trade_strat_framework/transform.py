@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+from operator import itemgetter
+
+import numpy as np
+import pendulum
+
+# This is tightly coupled with the database - hardcode the conversions
+# as (API name, Database field name)
+DB_FIELD_TRANSMUTE = [
+    ('symbol', 'ticker'),
+    ('lastPrice', 'price'),
+    ('askPrice', 'ask'),
+    ('bidPrice', 'bid'),
+    ('totalVolume', 'volume'),
+    ('delayed', 'delayed'),
+    ('quoteTimeInLong', 'datetime_newyork'),
+    ]
+
+# The `quotes` fields, in insert order
+QUOTES_FIELDS = [x[1] for x in DB_FIELD_TRANSMUTE]+['time_correction_sec', 'initial']
+
+NY_TZ = 'America/New_York'
+
+
+@lru_cache(maxsize=4096)
+def _ny_offset_sec(utcHour):
+
+    # New York's UTC offset (in seconds) during the given UTC hour. DST
+    # transitions happen on the hour, so the offset is constant within it
+    return(int(pendulum.from_timestamp(utcHour*3600).in_tz(NY_TZ).offset))
+
+
+def ny_local_seconds(epochSec):
+    """
+    Convert UTC epoch seconds to New York wall-clock seconds.
+
+    Parameters
+    ----------
+    epochSec : numpy.ndarray
+        UTC epoch seconds (int64).
+
+    Returns
+    -------
+    numpy.ndarray
+        Epoch seconds shifted to New York local time (int64), i.e. the
+        naive New York datetime as if it were UTC.
+
+    """
+
+    epochSec = np.asarray(epochSec, dtype=np.int64)
+    if epochSec.size == 0:
+        return(epochSec.copy())
+
+    # Look up the offset once per distinct UTC hour (usually one or two per
+    # batch), then apply it to the whole batch at once
+    utcHours, inverse = np.unique(epochSec // 3600, return_inverse=True)
+    offsets = np.fromiter(
+        (_ny_offset_sec(int(x)) for x in utcHours),
+        dtype=np.int64,
+        count=len(utcHours),
+        )
+
+    return(epochSec + offsets[inverse.reshape(epochSec.shape)])
+
+
+def epoch_ms_to_ny(epochMs):
+    """
+    Convert `quoteTimeInLong` (UTC epoch milliseconds) values to naive New
+    York datetimes, truncated to the second (as stored in
+    `quotes`.`datetime_newyork`).
+
+    Returns
+    -------
+    numpy.ndarray
+        datetime64[s] New York wall-clock times.
+
+    """
+
+    epochSec = np.asarray(epochMs, dtype=np.int64) // 1000
+
+    return(ny_local_seconds(epochSec).astype('datetime64[s]'))
+
+
+class QuoteBatch:
+    """ Columnar view of one `get_quotes` response.
+
+    The response is unpacked in a single pass into one column per API
+    field (`DB_FIELD_TRANSMUTE` order), and the quote times are converted to
+    New York time for the whole batch at once.
+
+    """
+
+    def __init__(self, quoteDict):
+
+        self.symbols = list(quoteDict.keys())
+
+        # Unpack every field of every quote in one pass
+        getter = itemgetter(*[x[0] for x in DB_FIELD_TRANSMUTE])
+        if self.symbols:
+            columns = list(zip(*map(getter, quoteDict.values())))
+        else:
+            columns = [() for _ in DB_FIELD_TRANSMUTE]
+
+        # The raw values are kept so the insert rows are identical to the
+        # values returned by the API
+        self._raw = dict(zip([x[0] for x in DB_FIELD_TRANSMUTE], columns))
+
+        self.price = np.asarray(self._raw['lastPrice'], dtype=np.float64)
+        self.ask = np.asarray(self._raw['askPrice'], dtype=np.float64)
+        self.bid = np.asarray(self._raw['bidPrice'], dtype=np.float64)
+        self.volume = np.asarray(self._raw['totalVolume'], dtype=np.int64)
+        self.delayed = np.asarray(self._raw['delayed'], dtype=bool)
+
+        # UTC epoch seconds (truncated, as `quoteTimeInLong` is in ms) and
+        # the matching New York wall-clock time
+        self.epoch_sec = np.asarray(self._raw['quoteTimeInLong'], dtype=np.int64) // 1000
+        self.datetime_ny = ny_local_seconds(self.epoch_sec).astype('datetime64[s]')
+
+    def __len__(self):
+        return(len(self.symbols))
+
+    def rows(self, time_correction_sec, initial):
+        """
+        Build the insert rows for the `quotes` table.
+
+        Parameters
+        ----------
+        time_correction_sec : sequence of int
+            The time correction of each quote (in batch order).
+        initial : bool
+            The value of the `initial` field for every row.
+
+        Returns
+        -------
+        list
+            Rows in the order of `QUOTES_FIELDS`.
+
+        """
+
+        # tolist() converts datetime64[s] to naive datetime.datetime
+        return(
+            [
+                list(row) for row in zip(
+                    self._raw['symbol'],
+                    self._raw['lastPrice'],
+                    self._raw['askPrice'],
+                    self._raw['bidPrice'],
+                    self._raw['totalVolume'],
+                    self._raw['delayed'],
+                    self.datetime_ny.tolist(),
+                    time_correction_sec,
+                    [initial]*len(self.symbols),
+                    )
+                ]
+            )
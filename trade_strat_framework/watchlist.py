@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from collections import namedtuple
+
+import coftc_logging
+
+from .history import TICKER_PATTERN
+
+try:
+    import tomllib
+except ImportError:     # Python < 3.11
+    import tomli as tomllib
+
+# The tickers a change to the watchlist file adds and removes (in file
+# order)
+WatchlistDiff = namedtuple('WatchlistDiff', ['added', 'removed'])
+
+
+def parse_watchlist(text):
+    """
+    The tickers of a TOML watchlist: every `tickers` array in the file, at
+    the top level or in a table (e.g. `[tech]`), in order and without
+    repeats. Symbols are stripped and upper-cased, and must match
+    `history.TICKER_PATTERN`.
+
+    Returns
+    -------
+    list
+
+    """
+
+    data = tomllib.loads(text)
+    arrays = [data.get('tickers', [])] + [
+        x.get('tickers', []) for x in data.values() if isinstance(x, dict)
+        ]
+
+    tickers = []
+    for array in arrays:
+        if not isinstance(array, list) or not all(isinstance(x, str) for x in array):
+            raise ValueError("'tickers' must be an array of strings")
+        tickers += [x.strip().upper() for x in array if x.strip()]
+
+    # Symbols go into SQL queries (see `history.ticker_list`)
+    invalid = [x for x in tickers if not TICKER_PATTERN.match(x)]
+    if invalid:
+        raise ValueError('Invalid ticker symbols: {}'.format(', '.join(repr(x) for x in invalid)))
+
+    return(list(dict.fromkeys(tickers)))
+
+
+class Watchlist:
+    """ A TOML watchlist file, reloaded when it changes.
+
+    `poll` is cheap enough to call every cycle: it stats the file at most
+    once per `check_sec`, and only reads and parses it when its modification
+    time or size changed. A file that fails to parse is reported and the
+    previous tickers are kept.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+    check_sec : float
+        The minimum time between checks of the file.
+    clock : callable
+        Monotonic seconds.
+
+    """
+
+    def __init__(self, path, check_sec=30, clock=time.monotonic):
+
+        self.path = str(path)
+        self.check_sec = check_sec
+        self._clock = clock
+
+        # The file is read now, so a missing or malformed watchlist fails
+        # at startup rather than on the first reload
+        self._stamp = self._file_stamp()
+        with open(self.path) as f:
+            self.tickers = parse_watchlist(f.read())
+        self._nextCheck = self._clock() + self.check_sec
+
+    def _file_stamp(self):
+
+        stat = os.stat(self.path)
+        return((stat.st_mtime_ns, stat.st_size))
+
+    def poll(self):
+        """
+        Reload the file if it changed since the last reload.
+
+        Returns
+        -------
+        WatchlistDiff or None
+            The tickers added and removed, or None if nothing changed (or
+            the file wasn't checked yet).
+
+        """
+
+        now = self._clock()
+        if now < self._nextCheck:
+            return(None)
+        self._nextCheck = now + self.check_sec
+
+        # A missing file (e.g. mid-save) is reported once, and read again
+        # when it's back
+        try:
+            stamp = self._file_stamp()
+        except OSError as e:
+            if self._stamp is not None:
+                coftc_logging.notifications('Watchlist {} not reloaded: {}'.format(self.path, e))
+            self._stamp = None
+            return(None)
+        if stamp == self._stamp:
+            return(None)
+        self._stamp = stamp
+
+        # A file that fails to parse is reported once per version
+        # (tomllib.TOMLDecodeError is a ValueError)
+        try:
+            with open(self.path) as f:
+                tickers = parse_watchlist(f.read())
+        except (OSError, ValueError) as e:
+            coftc_logging.notifications('Watchlist {} not reloaded: {}'.format(self.path, e))
+            return(None)
+
+        previous = set(self.tickers)
+        current = set(tickers)
+        diff = WatchlistDiff(
+            [x for x in tickers if x not in previous],
+            [x for x in self.tickers if x not in current],
+            )
+        self.tickers = tickers
+
+        return(diff if diff.added or diff.removed else None)
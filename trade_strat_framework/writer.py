@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import queue
+import threading
+import time
+
+import coftc_logging
+
+
+class BufferedWriter:
+    """ Write-behind inserter for one or more tables.
+
+    Rows are handed to a single background thread through a bounded queue
+    and merged into multi-row inserts, per table. A table is flushed once
+    `flush_rows` of its rows are buffered or its oldest buffered row is
+    `flush_sec` old. When the queue is full, `put` blocks (backpressure)
+    rather than growing memory.
+
+    The database connection is only used from the writer thread while it's
+    running (one thread for all the tables, since a connection isn't
+    thread-safe). Other users of the connection meanwhile (e.g. queries
+    from the producer's thread) must hold `lock`.
+
+    Parameters
+    ----------
+    conn : coftc_db_utils.Conn
+    tables : dict
+        Table name: the fields of its rows, in insert order.
+
+    """
+
+    _STOP = object()    # queue sentinel
+
+    def __init__(
+            self,
+            conn,
+            tables,
+            flush_rows=5000,
+            flush_sec=5,
+            max_pending=100,
+            on_duplicate='ignore',
+            metrics=None,
+            ):
+
+        self._conn = conn
+        self.tables = dict(tables)
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self.on_duplicate = on_duplicate
+
+        # Insert timings go to `<table_name>_insert_sec` (metrics.Metrics)
+        self.metrics = metrics
+
+        # Each queue item is (table name, put time, list of rows)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._error = None
+
+        # Held by the writer thread around each insert
+        self.lock = threading.Lock()
+
+        self.rows_written = collections.Counter()   # table name: rows
+        self.inserts = collections.Counter()        # table name: inserts
+
+    def __enter__(self):
+        self.start()
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, table_name):
+        return(table_name in self.tables)
+
+    def start(self):
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name='db-writer',
+            daemon=True,
+            )
+        self._thread.start()
+
+    def put(self, table_name, rows):
+        """
+        Queue rows of `table_name` for insert. Blocks while the queue is
+        full.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if table_name not in self.tables:
+            raise KeyError("The writer has no table '{}'".format(table_name))
+
+        self._raise_error()
+        if rows:
+            self._queue.put((table_name, time.monotonic(), list(rows)))
+
+    def close(self):
+        """
+        Flush everything queued and stop the writer thread.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+
+        self._raise_error()
+
+    def _raise_error(self):
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+
+        buffers = {x: [] for x in self.tables}
+        # Per table, (rows, put time) of each item still (partly) in the
+        # buffer, oldest first, so the time threshold follows the oldest
+        # row left (a partial flush doesn't restart its clock)
+        arrivals = {x: collections.deque() for x in self.tables}
+        while True:
+            flushAt = min([x[0][1] + self.flush_sec for x in arrivals.values() if x], default=None)
+            timeout = None if flushAt is None else max([0, flushAt - time.monotonic()])
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                for table_name, buffer in buffers.items():
+                    self._flush(table_name, buffer)
+                return
+
+            if item is not None:
+                table_name, putAt, rows = item
+                arrivals[table_name].append([len(rows), putAt])
+                buffers[table_name].extend(rows)
+
+            # Size threshold: insert the full chunks and keep the remainder
+            # buffered. Time threshold: insert everything
+            for table_name, buffer in buffers.items():
+                tableArrivals = arrivals[table_name]
+                if len(buffer) >= self.flush_rows:
+                    fullRows = len(buffer) - len(buffer) % self.flush_rows
+                    self._flush(table_name, buffer[:fullRows])
+                    buffers[table_name] = buffer[fullRows:]
+                    while fullRows:
+                        flushed = min([fullRows, tableArrivals[0][0]])
+                        tableArrivals[0][0] -= flushed
+                        fullRows -= flushed
+                        if tableArrivals[0][0] == 0:
+                            tableArrivals.popleft()
+                elif tableArrivals and time.monotonic() >= tableArrivals[0][1] + self.flush_sec:
+                    self._flush(table_name, buffer)
+                    buffers[table_name] = []
+                    tableArrivals.clear()
+
+    def _flush(self, table_name, buffer):
+
+        # Insert in chunks of at most `flush_rows`. On failure, keep the
+        # error for the producer and drop the chunk (rather than retrying
+        # forever and blocking quote collection)
+        for idx in range(0, len(buffer), self.flush_rows):
+            chunk = buffer[idx:idx+self.flush_rows]
+            insertStart = time.perf_counter()
+            try:
+                with self.lock:
+                    self._conn.insert(
+                        table_name=table_name,
+                        fields=self.tables[table_name],
+                        values=chunk,
+                        on_duplicate=self.on_duplicate,
+                        )
+            except Exception as e:
+                coftc_logging.notifications(
+                    '{} writer failed to insert {} rows: {}'.format(table_name, len(chunk), e)
+                    )
+                self._error = e
+            else:
+                self.rows_written[table_name] += len(chunk)
+                self.inserts[table_name] += 1
+                if self.metrics is not None:
+                    self.metrics.observe('{}_insert_sec'.format(table_name), time.perf_counter() - insertStart)